@@ -0,0 +1,118 @@
+"""
+Counts the UPDATEs and audit log entries written by one update_database cycle \
+over runs which haven't changed, with and without the change tracking on \
+RunAnalysis, SampleAnalysis and RunAnalysisSummary.
+
+Loads the test_data fixture into a throwaway sqlite database and checks the \
+watched run analyses against the files in test_data.
+
+Usage: DJANGO_SETTINGS_MODULE=mysite.settings python benchmarks/benchmark_noop_saves.py [cycles]
+
+"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+from django.conf import settings
+
+temp_dir = tempfile.TemporaryDirectory()
+
+# never touch the real database
+settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(temp_dir.name, 'benchmark.sqlite3')}}
+settings.MIGRATION_MODULES = {'qc_database': None}
+settings.MESSAGE_SLACK = False
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from auditlog.models import LogEntry
+
+from qc_database.models import *
+from qc_database import ingestion
+from pipelines import parsers
+from pipelines.config import compile_config
+
+TRACKED_MODELS = [RunAnalysis, SampleAnalysis, RunAnalysisSummary]
+
+
+def get_config(repo_dir):
+
+	config_dict = parsers.parse_config(str(repo_dir.joinpath('config', 'config_local.yaml')))
+
+	for run_config_key in config_dict['pipelines']:
+
+		config_dict['pipelines'][run_config_key]['results_dir'] = str(repo_dir.joinpath('test_data'))
+		config_dict['pipelines'][run_config_key].pop('fastq_dir', None)
+
+	return compile_config(config_dict)
+
+
+def run_cycle(config):
+
+	run_analyses = RunAnalysis.objects.filter(watching=True).select_related('run', 'pipeline', 'analysis_type').order_by('pk')
+
+	log_entries = LogEntry.objects.count()
+
+	with CaptureQueriesContext(connection) as queries:
+
+		ingestion.process_run_analyses(run_analyses, config)
+
+	updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+
+	return len(queries.captured_queries), len(updates), LogEntry.objects.count() - log_entries
+
+
+def measure(config, track_changes, cycles):
+
+	for model in TRACKED_MODELS:
+
+		model.track_changes = track_changes
+
+	totals = [0, 0, 0]
+
+	for i in range(cycles):
+
+		for j, count in enumerate(run_cycle(config)):
+
+			totals[j] = totals[j] + count
+
+	return [total / cycles for total in totals]
+
+
+if __name__ == '__main__':
+
+	cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+	repo_dir = Path(__file__).resolve().parents[1]
+
+	call_command('migrate', run_syncdb=True, verbosity=0)
+	call_command('loaddata', 'test_data', verbosity=0)
+
+	config = get_config(repo_dir)
+
+	n_run_analyses = RunAnalysis.objects.filter(watching=True).count()
+	n_sample_analyses = SampleAnalysis.objects.count()
+
+	print(f'{n_run_analyses} watched run analyses, {n_sample_analyses} sample analyses')
+
+	# first cycle loads the metrics - after that nothing changes
+	run_cycle(config)
+
+	print(f'{"":<24} {"queries":>10} {"UPDATEs":>10} {"log entries":>12}')
+
+	for name, track_changes in [('saving every field', False), ('change tracking', True)]:
+
+		queries, updates, log_entries = measure(config, track_changes, cycles)
+
+		print(f'{name:<24} {queries:>10.0f} {updates:>10.0f} {log_entries:>12.0f}')
+
+	temp_dir.cleanup()
@@ -0,0 +1,137 @@
+"""
+Micro-benchmark for the Picard metrics parsers.
+
+Compares read_picard_metrics against the csv.reader state machine the parsers used before.
+
+Usage: python benchmarks/benchmark_picard_parsers.py [results_dir] [repeats]
+
+"""
+from pathlib import Path
+import csv
+import sys
+import timeit
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pipelines import parsers
+
+
+def legacy_parse_first_row(metrics_file):
+	"""
+	The old single row parser e.g. parse_hs_metrics_file
+	"""
+
+	metrics_dict = {}
+
+	with open (metrics_file) as file:
+
+		metrics_file = csv.reader(file, delimiter='\t')
+
+		next_keys = False
+		next_values = False
+
+		keys = []
+		values = []
+
+		for row in metrics_file:
+
+			if len(row) != 0:
+
+				if next_values == True:
+
+					values = row
+					break
+
+				if next_keys == True:
+
+					keys = row
+					next_keys = False
+					next_values = True
+
+				if row[0] == '## METRICS CLASS':
+
+					next_keys = True
+
+	for key, value in zip(keys, values):
+
+		metrics_dict[key.lower()] = value
+
+	return metrics_dict
+
+
+def legacy_parse_all_rows(metrics_file):
+	"""
+	The old multi row parser e.g. parse_alignment_metrics_file
+	"""
+
+	metrics_dicts = []
+
+	with open (metrics_file) as file:
+
+		metrics_file = csv.reader(file, delimiter='\t')
+
+		next_keys = False
+		next_values = False
+
+		keys = []
+
+		for row in metrics_file:
+
+			if len(row) != 0:
+
+				if next_values == True:
+
+					row_dict = {}
+
+					for key, value in zip(keys, row):
+
+						if key.lower() not in ['read_group',  'sample', 'library']:
+
+							row_dict[key.lower()] = value
+
+					metrics_dicts.append(row_dict)
+
+				if next_keys == True:
+
+					keys = row
+					next_keys = False
+					next_values = True
+
+				if row[0] == '## METRICS CLASS':
+
+					next_keys = True
+
+	return metrics_dicts
+
+
+def run_benchmark(name, files, old_parser, new_parser, repeats):
+
+	old_time = timeit.timeit(lambda: [old_parser(file) for file in files], number=repeats)
+	new_time = timeit.timeit(lambda: [new_parser(file) for file in files], number=repeats)
+
+	print(f'{name:<22} files={len(files):<4} legacy={old_time:.3f}s new={new_time:.3f}s speedup={old_time / new_time:.2f}x')
+
+
+if __name__ == '__main__':
+
+	results_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parents[1].joinpath('test_data')
+	repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+	benchmarks = [
+		('hs_metrics', '*_HsMetrics.txt', legacy_parse_first_row, parsers.parse_hs_metrics_file),
+		('duplication_metrics', '*_MarkDuplicatesMetrics.txt', legacy_parse_first_row, parsers.parse_duplication_metrics_file),
+		('insert_metrics', '*_InsertMetrics.txt', legacy_parse_first_row, parsers.parse_insert_metrics_file),
+		('alignment_metrics', '*_AlignmentSummaryMetrics.txt', legacy_parse_all_rows, parsers.parse_alignment_metrics_file),
+		('variant_detail', '*.variant_calling_detail_metrics', legacy_parse_all_rows, parsers.parse_variant_detail_metrics_file),
+	]
+
+	for name, pattern, old_parser, new_parser in benchmarks:
+
+		files = sorted(results_dir.rglob(pattern))
+
+		if len(files) == 0:
+
+			print(f'{name:<22} no files found')
+			continue
+
+		run_benchmark(name, files, old_parser, new_parser, repeats)
@@ -0,0 +1,195 @@
+"""
+Benchmark for checking the samples of a run analysis on a slow mount with and \
+without prefetching their directories.
+
+Writes a GermlineEnrichment results folder and IlluminaQC fastq folder for a run \
+and adds a fixed delay to every directory listing and stat, like a network mount \
+with that round trip time. Each repeat starts with an empty snapshot cache and \
+makes the same checks as ingestion - the sample fingerprints, sample_is_complete \
+and sample_is_valid for every sample and demultiplex_run_is_valid.
+
+Usage: python benchmarks/benchmark_prefetch.py [n_samples] [latency_ms] [repeats]
+
+"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pipelines import directory_snapshot
+from pipelines.directory_snapshot import SnapshotCache
+from pipelines.germline_pipelines import GermlineEnrichment
+from pipelines.quality_pipelines import IlluminaQC
+
+
+class SlowEntry:
+	"""
+	A DirEntry whose stat takes a round trip.
+	"""
+
+	def __init__(self, entry, latency):
+
+		self.entry = entry
+		self.latency = latency
+		self.name = entry.name
+		self.path = entry.path
+
+	def is_dir(self):
+
+		# d_type comes back with the listing
+		return self.entry.is_dir()
+
+	def stat(self):
+
+		time.sleep(self.latency)
+
+		return self.entry.stat()
+
+
+class SlowScandir:
+
+	def __init__(self, path, latency):
+
+		time.sleep(latency)
+
+		self.it = os.scandir(path)
+		self.latency = latency
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *args):
+
+		self.it.close()
+
+	def __iter__(self):
+
+		return (SlowEntry(entry, self.latency) for entry in self.it)
+
+
+class SlowOs:
+	"""
+	Stands in for os in pipelines.directory_snapshot.
+	"""
+
+	def __init__(self, latency):
+
+		self.latency = latency
+
+	def scandir(self, path):
+
+		return SlowScandir(path, self.latency)
+
+	def __getattr__(self, name):
+
+		return getattr(os, name)
+
+
+def write_run(root, samples):
+
+	results_dir = root.joinpath('results')
+	fastq_dir = root.joinpath('fastqs')
+
+	pipeline = GermlineEnrichment(results_dir=results_dir, sample_names=samples, run_id='run1')
+
+	for sample in samples:
+
+		sample_dir = results_dir.joinpath(sample)
+		sample_dir.mkdir(parents=True)
+
+		for pattern in pipeline.sample_expected_files:
+
+			sample_dir.joinpath(pattern.replace('*', sample)).touch()
+
+		sample_dir.joinpath('1_GermlineEnrichment-2.5.3.sh.e1').touch()
+
+		fastq_sample_dir = fastq_dir.joinpath('Data', sample)
+		fastq_sample_dir.mkdir(parents=True)
+
+		for read in ['R1', 'R2']:
+
+			fastq_sample_dir.joinpath(f'{sample}_S1_L001_{read}_001.fastq.gz').write_bytes(b'0' * 200)
+
+		fastq_sample_dir.joinpath(f'{sample}.variables').touch()
+
+	return results_dir, fastq_dir
+
+
+def check_run(results_dir, fastq_dir, samples, concurrency=None):
+	"""
+	The checks ingestion makes for a run analysis - prefetching first unless concurrency is None.
+	"""
+
+	snapshot_cache = SnapshotCache()
+
+	illumina_qc = IlluminaQC(fastq_dir=fastq_dir, sample_names=samples, n_lanes=1, run_id='run1', analysis_type='panel', min_fastq_size=100).use_snapshot_cache(snapshot_cache)
+	pipeline = GermlineEnrichment(results_dir=results_dir, sample_names=samples, run_id='run1').use_snapshot_cache(snapshot_cache)
+
+	if concurrency != None:
+
+		illumina_qc.prefetch_sample_dirs(samples, concurrency)
+		pipeline.prefetch_sample_fingerprints(samples, concurrency)
+		pipeline.prefetch_sample_dirs(samples, concurrency)
+
+	demultiplex_valid = illumina_qc.demultiplex_run_is_valid()
+
+	results = [(pipeline.get_sample_fingerprint(sample), pipeline.sample_is_complete(sample), pipeline.sample_is_valid(sample)) for sample in samples]
+
+	return demultiplex_valid, [result[1:] for result in results]
+
+
+def measure(results_dir, fastq_dir, samples, concurrency, repeats):
+
+	timings = []
+
+	for i in range(repeats):
+
+		start = time.perf_counter()
+		result = check_run(results_dir, fastq_dir, samples, concurrency)
+		timings.append(time.perf_counter() - start)
+
+	return min(timings), result
+
+
+def main():
+
+	n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 96
+	latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+	repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+	samples = [f'sample{i}' for i in range(1, n_samples + 1)]
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		results_dir, fastq_dir = write_run(Path(temp_dir), samples)
+
+		directory_snapshot.os = SlowOs(latency_ms / 1000)
+
+		try:
+
+			print(f'{n_samples} samples with {latency_ms}ms per listing and stat, best of {repeats}')
+
+			sequential, expected = measure(results_dir, fastq_dir, samples, None, repeats)
+
+			print(f'{"sequential":>16}: {sequential * 1000:8.1f}ms')
+
+			for concurrency in [1, 8, 32, 64]:
+
+				elapsed, result = measure(results_dir, fastq_dir, samples, concurrency, repeats)
+
+				assert result == expected
+
+				print(f'{"concurrency " + str(concurrency):>16}: {elapsed * 1000:8.1f}ms ({sequential / elapsed:.1f}x)')
+
+		finally:
+
+			directory_snapshot.os = os
+
+
+if __name__ == '__main__':
+
+	main()
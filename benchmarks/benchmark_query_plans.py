@@ -0,0 +1,180 @@
+"""
+Query plan benchmark for the database indexes.
+
+Builds a throwaway sqlite database with a generated archive (about 5k runs and 200k \
+sample analyses by default), then prints the query plan and timing of the hot queries \
+with the indexes defined in models.py and again with them dropped.
+
+Usage: DJANGO_SETTINGS_MODULE=mysite.settings python benchmarks/benchmark_query_plans.py [n_runs] [samples_per_run]
+
+"""
+from pathlib import Path
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+from django.conf import settings
+
+temp_dir = tempfile.TemporaryDirectory()
+
+# never touch the real database
+settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(temp_dir.name, 'benchmark.sqlite3')}}
+settings.MIGRATION_MODULES = {'qc_database': None}
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+
+from qc_database.models import *
+
+
+# model, index name pairs added for the hot queries
+BENCHMARK_INDEXES = [
+	(SampleAnalysis, 'sampleanalysis_run_pipe_idx'),
+	(RunAnalysis, 'runanalysis_watching_run_idx'),
+	(RunAnalysis, 'runanalysis_signoff_date_idx'),
+	(Run, 'run_instrument_date_idx'),
+	(InteropRunQuality, 'interop_run_read_lane_idx'),
+	(SampleFastqcData, 'fastqc_sa_read_lane_idx'),
+]
+
+
+def generate_database(n_runs, samples_per_run):
+
+	pipelines = [Pipeline(pipeline_id=f'GermlineEnrichment-2.5.{i}') for i in range(4)]
+	analysis_types = [AnalysisType(analysis_type_id=f'Panel{i}') for i in range(10)]
+	worksheets = [WorkSheet(worksheet_id=f'WS{i}') for i in range(n_runs)]
+
+	Pipeline.objects.bulk_create(pipelines)
+	AnalysisType.objects.bulk_create(analysis_types)
+	WorkSheet.objects.bulk_create(worksheets)
+
+	start_date = datetime.date(2015, 1, 1)
+
+	runs = [Run(run_id=f'{i:06d}_M00001_{i:04d}_000000000-ABCDE', instrument_date=start_date + datetime.timedelta(days=i % 3000)) for i in range(n_runs)]
+	Run.objects.bulk_create(runs)
+
+	samples = [Sample(sample_id=f'S{i:07d}') for i in range(n_runs * samples_per_run)]
+	Sample.objects.bulk_create(samples)
+
+	run_analyses = []
+	sample_analyses = []
+	interop_qualities = []
+
+	for i, run in enumerate(runs):
+
+		pipeline = pipelines[i % len(pipelines)]
+		analysis_type = analysis_types[i % len(analysis_types)]
+
+		run_analyses.append(RunAnalysis(run=run,
+										pipeline=pipeline,
+										analysis_type=analysis_type,
+										watching= i >= n_runs - 50,
+										signoff_date= None if i >= n_runs - 50 else start_date + datetime.timedelta(days=i % 3000)))
+
+		for j in range(samples_per_run):
+
+			sample_analyses.append(SampleAnalysis(sample=samples[i * samples_per_run + j],
+												run=run,
+												pipeline=pipeline,
+												analysis_type=analysis_type,
+												worksheet=worksheets[i]))
+
+		for read in range(1, 5):
+
+			for lane in range(1, 3):
+
+				interop_qualities.append(InteropRunQuality(run=run, read_number=read, lane_number=lane, percent_q30=90,
+											density=1000, density_pf=900, cluster_count=1000, cluster_count_pf=900,
+											percent_pf=90, reads=1000, reads_pf=900, yield_g=1))
+
+	RunAnalysis.objects.bulk_create(run_analyses)
+	SampleAnalysis.objects.bulk_create(sample_analyses)
+	InteropRunQuality.objects.bulk_create(interop_qualities)
+
+	return runs
+
+
+def get_queries(runs):
+
+	run = runs[len(runs) // 2]
+	run_analysis = RunAnalysis.objects.get(run=run)
+	sample_analysis = SampleAnalysis.objects.filter(run=run).first()
+
+	return [
+		('sample analyses for a run analysis', lambda: SampleAnalysis.objects.filter(run=run, pipeline=run_analysis.pipeline, analysis_type=run_analysis.analysis_type)),
+		('sample analysis by sample/run/pipeline', lambda: SampleAnalysis.objects.filter(sample=sample_analysis.sample, run=run, pipeline=run_analysis.pipeline)),
+		('home page', lambda: RunAnalysis.objects.filter(watching=True).order_by('-run')),
+		('archive page', lambda: RunAnalysis.objects.filter(watching=False).order_by('-run')[:100]),
+		('signed off in a month', lambda: RunAnalysis.objects.filter(signoff_date__range=(datetime.date(2016, 1, 1), datetime.date(2016, 2, 1)))),
+		('ngs kpis', lambda: Run.objects.filter(instrument_date__range=(datetime.date(2016, 1, 1), datetime.date(2016, 2, 1))).order_by('instrument_date', 'experiment')),
+		('interop for a run', lambda: InteropRunQuality.objects.filter(run=run)),
+	]
+
+
+def run_queries(queries, repeats):
+
+	for name, get_queryset in queries:
+
+		plan = get_queryset().explain()
+
+		start = time.time()
+
+		for i in range(repeats):
+
+			list(get_queryset())
+
+		elapsed = (time.time() - start) / repeats * 1000
+
+		print(f'{name:<40} {elapsed:8.2f} ms')
+
+		for line in plan.splitlines():
+
+			print(f'    {line}')
+
+
+if __name__ == '__main__':
+
+	n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	samples_per_run = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+	repeats = 20
+
+	call_command('migrate', run_syncdb=True, verbosity=0)
+
+	start = time.time()
+	runs = generate_database(n_runs, samples_per_run)
+	print(f'generated {n_runs} runs and {n_runs * samples_per_run} sample analyses in {time.time() - start:.1f}s')
+
+	with connection.cursor() as cursor:
+
+		cursor.execute('ANALYZE')
+
+	queries = get_queries(runs)
+
+	print('\n--- with indexes ---')
+	run_queries(queries, repeats)
+
+	with connection.schema_editor() as schema_editor:
+
+		for model, index_name in BENCHMARK_INDEXES:
+
+			index = [index for index in model._meta.indexes if index.name == index_name][0]
+			schema_editor.remove_index(model, index)
+
+	with connection.cursor() as cursor:
+
+		cursor.execute('ANALYZE')
+
+	print('\n--- without indexes ---')
+	run_queries(queries, repeats)
+
+	temp_dir.cleanup()
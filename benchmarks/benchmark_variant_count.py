@@ -0,0 +1,142 @@
+"""
+Benchmark for counting passing variants in a multi sample vcf.
+
+Writes a synthetic vcf (bgzipped and tabix indexed) and compares the old per sample \
+counter with count_passing_variants in a single pass and split by contig.
+
+Usage: python benchmarks/benchmark_variant_count.py [n_records] [n_samples] [workers]
+
+"""
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+
+import pysam
+from pysam import VariantFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pipelines import parsers
+
+
+def write_synthetic_vcf(vcf_path, n_records, samples, contigs=24):
+	"""
+	Write a vcf with a mix of PASS and filtered records and random genotypes
+	"""
+
+	random.seed(1)
+
+	genotypes = ['0/0', '0/1', '1/1', './.']
+	filters = ['PASS', 'PASS', 'PASS', 'LowQual']
+	records_per_contig = n_records // contigs
+
+	with open(vcf_path, 'w') as vcf:
+
+		vcf.write('##fileformat=VCFv4.2\n')
+		vcf.write('##FILTER=<ID=PASS,Description="All filters passed">\n')
+		vcf.write('##FILTER=<ID=LowQual,Description="Low quality">\n')
+		vcf.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n')
+		vcf.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+		vcf.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">\n')
+
+		for contig in range(1, contigs + 1):
+
+			vcf.write(f'##contig=<ID=chr{contig},length=250000000>\n')
+
+		vcf.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' + '\t'.join(samples) + '\n')
+
+		for contig in range(1, contigs + 1):
+
+			for i in range(records_per_contig):
+
+				sample_columns = '\t'.join(f'{random.choice(genotypes)}:30' for sample in samples)
+
+				vcf.write(f'chr{contig}\t{(i + 1) * 10}\t.\tA\tG\t50\t{random.choice(filters)}\tDP=100\tGT:DP\t{sample_columns}\n')
+
+	return pysam.tabix_index(str(vcf_path), preset='vcf', force=True)
+
+
+def legacy_get_passing_variant_count(vcf_path, samples):
+	"""
+	The old counter - called once per sample
+	"""
+
+	bcf_in = VariantFile(vcf_path)
+
+	count_dict = {}
+
+	for rec in bcf_in.fetch():
+
+		chrom = rec.chrom
+		pos = rec.pos
+		ref = rec.ref
+		alt = rec.alts
+		filter_status = rec.filter.keys()
+		info = rec.info
+		quality = rec.qual
+
+		for sample in samples:
+
+			sample_genotype_data = rec.samples[sample]
+
+			gt_list = []
+
+			for allele in sample_genotype_data['GT']:
+
+				if allele == None or allele == 0:
+
+					pass
+
+				else:
+
+					gt_list.append(allele)
+
+			if 'PASS' in filter_status and len(gt_list) > 0:
+
+				if sample not in count_dict:
+
+					count_dict[sample] = 0
+
+				else:
+
+					count_dict[sample] = count_dict[sample] + 1
+	
+	if len(count_dict) == 0:
+
+		for sample in samples:
+
+			count_dict[sample] = 0
+
+	return count_dict
+
+
+def timed(name, function):
+
+	start = time.time()
+	result = function()
+	print(f'{name:<28} {time.time() - start:.2f}s')
+
+	return result
+
+
+if __name__ == '__main__':
+
+	n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	n_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+	samples = [f'sample{i}' for i in range(1, n_samples + 1)]
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		vcf_path = timed('write synthetic vcf', lambda: write_synthetic_vcf(Path(temp_dir).joinpath('synthetic.vcf'), n_records, samples))
+
+		legacy = timed('legacy (once per sample)', lambda: {sample: legacy_get_passing_variant_count(vcf_path, [sample])[sample] for sample in samples})
+		single_pass = timed('single pass', lambda: parsers.get_passing_variant_count(vcf_path, samples))
+		by_contig = timed(f'by contig ({workers} workers)', lambda: parsers.get_passing_variant_count(vcf_path, samples, workers))
+
+		assert legacy == single_pass == by_contig
+
+		print(f'{n_records} records, {n_samples} samples - counts match')
@@ -0,0 +1,220 @@
+from pipelines.directory_snapshot import SnapshotCache
+from pipelines.metrics_cache import MetricsCache
+from pipelines.mount_guard import MountUnavailable
+from pipelines import integrity, prefetch
+from pathlib import Path
+import hashlib
+import glob
+
+
+class BasePipeline:
+	"""
+	Base class for the pipeline and QC classes.
+
+	All filesystem lookups go through a SnapshotCache so each directory is read once, \
+	and metrics files are parsed through a MetricsCache so each is parsed once.
+
+	"""
+
+	snapshot_cache = None
+	metrics_cache = None
+
+	# how ingestion checks the pipeline - set by each registered pipeline class, see pipelines.registry
+	pipeline_ids = []
+	config_keys = []
+	sample_checks = False
+	run_includes_samples = False
+	metric_steps = []
+	ingest = True
+
+	# also check compressed outputs aren't truncated - set from strict_validation in the config
+	strict_validation = False
+	integrity_files = ['*.bam']
+
+	# entries of the sample directories whose size the checks look at - stat'd when prefetching
+	prefetch_stat_patterns = []
+
+	def use_snapshot_cache(self, snapshot_cache):
+		"""
+		Share a snapshot cache with other pipeline objects checking the same run.
+		"""
+
+		self.snapshot_cache = snapshot_cache
+
+		return self
+
+	def get_snapshot_cache(self):
+
+		if self.snapshot_cache == None:
+
+			self.snapshot_cache = SnapshotCache()
+
+		return self.snapshot_cache
+
+	def use_metrics_cache(self, metrics_cache):
+		"""
+		Share parsed metrics files with other pipeline objects and later passes.
+		"""
+
+		self.metrics_cache = metrics_cache
+
+		return self
+
+	def get_metrics_cache(self):
+
+		if self.metrics_cache == None:
+
+			self.metrics_cache = MetricsCache()
+
+		return self.metrics_cache
+
+	def parse(self, parser, path, *args):
+		"""
+		parser(path, *args) through the metrics cache.
+		"""
+
+		return self.get_snapshot_cache().probe(path, self.get_metrics_cache().parse, parser, path, *args)
+
+	def read_lines(self, path):
+		"""
+		The lines of a small text file such as a marker file.
+		"""
+
+		return self.get_snapshot_cache().probe(path, lambda: Path(path).read_text().splitlines())
+
+	def glob(self, path, pattern):
+
+		return self.get_snapshot_cache().glob(path, pattern)
+
+	def exists(self, path):
+
+		return self.get_snapshot_cache().exists(path)
+
+	def stat(self, path):
+
+		return self.get_snapshot_cache().stat(path)
+
+	def listdir(self, path):
+
+		return self.get_snapshot_cache().listdir(path)
+
+	def files_are_intact(self, paths):
+		"""
+		Check the BGZF trailers of the files in a thread pool - see pipelines.integrity
+		"""
+
+		return all(integrity.check_files(paths, self.get_metrics_cache(), probe=self.get_snapshot_cache().probe).values())
+
+	def get_sample_integrity_files(self, sample):
+		"""
+		The sample's files matching integrity_files which strict validation checks.
+		"""
+
+		paths = []
+
+		for directory in self.get_sample_dirs(sample):
+
+			for pattern in self.integrity_files:
+
+				paths.extend(self.glob(directory, pattern))
+
+		return paths
+
+	def get_pattern_dirs(self, path, patterns):
+		"""
+		The directories the glob patterns look in under path - up to the first wildcard for patterns with a /
+		"""
+
+		directories = []
+
+		for pattern in patterns:
+
+			parts = []
+
+			for part in Path(pattern).parent.parts:
+
+				if glob.has_magic(part) == True:
+
+					break
+
+				parts.append(part)
+
+			directory = Path(path).joinpath(*parts)
+
+			if directory not in directories:
+
+				directories.append(directory)
+
+		return directories
+
+	def get_sample_dirs(self, sample):
+		"""
+		The directories sample_is_complete and sample_is_valid look in - including \
+		subdirectories of the sample directory named in the expected files.
+		"""
+
+		sample_path = Path(self.results_dir).joinpath(sample)
+
+		patterns = getattr(self, 'sample_expected_files', []) + getattr(self, 'sample_not_expected_files', [])
+
+		if getattr(self, 'sample_complete_marker', None) != None:
+
+			patterns = patterns + [self.sample_complete_marker]
+
+		return self.get_pattern_dirs(sample_path, [''] + patterns)
+
+	def prefetch_sample_dirs(self, samples, concurrency=prefetch.DEFAULT_CONCURRENCY):
+		"""
+		List the sample directories of samples concurrently before checking them one by one.
+		"""
+
+		requests = [(directory, self.prefetch_stat_patterns) for sample in samples for directory in self.get_sample_dirs(sample)]
+
+		prefetch.prefetch(self.get_snapshot_cache(), requests, concurrency)
+
+	def prefetch_sample_fingerprints(self, samples, concurrency=prefetch.DEFAULT_CONCURRENCY):
+		"""
+		Stat the sample directories of samples concurrently for get_sample_fingerprint.
+		"""
+
+		parents = {}
+
+		for sample in samples:
+
+			for directory in self.get_sample_dirs(sample):
+
+				parents.setdefault(str(directory.parent), (directory.parent, []))[1].append(glob.escape(directory.name))
+
+		prefetch.prefetch(self.get_snapshot_cache(), list(parents.values()), concurrency)
+
+	def get_sample_fingerprint(self, sample, settings=''):
+		"""
+		Hash of the mtimes of the sample's directories - these change whenever a file \
+		is added, removed or renamed so an unchanged fingerprint means the sample checks \
+		would give the same answer as last time.
+
+		settings should describe anything else the checks depend on e.g. the expected files.
+
+		A missing directory is hashed as missing so the fingerprint changes when it appears.
+
+		"""
+
+		fingerprint = hashlib.sha1(str(settings).encode())
+
+		for directory in self.get_sample_dirs(sample):
+
+			try:
+
+				mtime = self.stat(directory).st_mtime_ns
+
+			except MountUnavailable:
+
+				raise
+
+			except OSError:
+
+				mtime = 'missing'
+
+			fingerprint.update(f'{directory}:{mtime};'.encode())
+
+		return fingerprint.hexdigest()
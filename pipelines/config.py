@@ -0,0 +1,536 @@
+"""
+The YAML config compiled into a Config object.
+
+The config is validated and has its defaults applied once when it is loaded so \
+a mistake is reported straight away rather than quietly replaced with a default \
+for every sample. Each pipeline-version-panel key gets a PipelineConfig with the \
+settings as attributes.
+
+The compiled config is pickled next to the config file and reused until the \
+config file changes.
+
+"""
+
+from pathlib import Path
+import logging
+import os
+import pickle
+
+from pipelines import parsers
+from pipelines.mount_guard import DEFAULT_COOLDOWN
+from pipelines.prefetch import DEFAULT_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# bump when the compiled layout changes so old cache files are ignored
+CONFIG_CACHE_VERSION = 7
+
+# used for any setting a pipeline doesn't give
+PIPELINE_DEFAULTS = {
+	'results_dir': None,
+	'fastq_dir': None,
+	'qc_checks': None,
+	'min_q30_score': 0.8,
+	'contamination_cutoff': 0.015,
+	'ntc_contamination_cutoff': 10,
+	'min_fastq_size': 100000,
+	'min_variants': 25,
+	'max_variants': 1000,
+	'min_sensitivity': None,
+	'min_titv': 2.0,
+	'max_titv': 2.1,
+	'min_coverage': 0.0,
+	'min_fusion_aligned_reads_unique': 0,
+	# also check FASTQs and BAMs aren't truncated - see pipelines.integrity
+	'strict_validation': False,
+}
+
+NUMBER_SETTINGS = ['min_q30_score', 'contamination_cutoff', 'ntc_contamination_cutoff', 'min_fastq_size',
+					'min_variants', 'max_variants', 'min_sensitivity', 'min_titv', 'max_titv',
+					'min_coverage', 'min_fusion_aligned_reads_unique']
+
+DIRECTORY_SETTINGS = ['results_dir', 'fastq_dir']
+
+BOOLEAN_SETTINGS = ['strict_validation']
+
+# settings which were only ever used together - give both or neither
+PAIRED_SETTINGS = [('min_variants', 'max_variants'), ('min_titv', 'max_titv'), ('contamination_cutoff', 'ntc_contamination_cutoff')]
+
+# the checks auto_qc knows about
+QC_CHECKS = ['pct_q30', 'fastqc', 'contamination', 'ntc_contamination', 'sex_match', 'variant_check',
+			'sensitivity', 'coverage', 'titv', 'fusion_contamination', 'fusion_alignment']
+
+# seconds between checks of a run analysis
+SCHEDULER_DEFAULTS = {
+	'active_interval': 60,
+	'idle_interval': 300,
+	'max_interval': 21600,
+}
+
+# threads parsing the metric files of a run analysis
+DEFAULT_METRIC_WORKERS = 4
+
+# checking copied run folders against a checksum manifest - see qc_database.copy_verification
+COPY_VERIFICATION_DEFAULTS = {
+	'enabled': False,
+	'manifest': 'md5sum.txt',
+	'workers': 4,
+	# don't ingest a run until its copy has been verified
+	'required': False,
+}
+
+# deadlines for filesystem probes on network mounts - see pipelines.mount_guard
+MOUNT_PROBE_DEFAULTS = {
+	# mount path to seconds
+	'mounts': {},
+	'cooldown': DEFAULT_COOLDOWN,
+	# JSON file the degraded mounts are kept in between runs
+	'state': None,
+}
+
+
+class ConfigError(Exception):
+
+	pass
+
+
+def is_number(value):
+
+	return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_string_list(value):
+
+	return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+class PipelineConfig:
+	"""
+	The settings for one pipeline-version-panel key with the defaults filled in.
+
+	configured is False for keys which aren't in the config at all.
+
+	"""
+
+	def __init__(self, key, values, configured=True):
+
+		self.key = key
+		self.configured = configured
+
+		# everything in the config including the file lists the pipeline classes take
+		self.values = dict(PIPELINE_DEFAULTS)
+		self.values.update(values)
+
+		for setting in PIPELINE_DEFAULTS:
+
+			setattr(self, setting, self.values[setting])
+
+		# stored on the run analysis as a comma separated list
+		if self.qc_checks == None:
+
+			self.auto_qc_checks = None
+
+		else:
+
+			self.auto_qc_checks = ','.join(self.qc_checks)
+
+		self.pipeline_kwargs = {}
+
+	def get_pipeline_kwargs(self, pipeline_class):
+		"""
+		The config_keys of a pipeline class - empty unless they are all set.
+
+		"""
+
+		if pipeline_class not in self.pipeline_kwargs:
+
+			if all(key in self.values for key in pipeline_class.config_keys):
+
+				self.pipeline_kwargs[pipeline_class] = {key: self.values[key] for key in pipeline_class.config_keys}
+
+			else:
+
+				self.pipeline_kwargs[pipeline_class] = {}
+
+		return self.pipeline_kwargs[pipeline_class]
+
+
+class Config:
+	"""
+	The whole config - pipelines, archives, scheduler, metric_workers, metrics_cache, copy_verification, \
+	mount_probes, probe_concurrency and remove_missing_samples.
+
+	"""
+
+	def __init__(self, pipelines, archives, scheduler, metric_workers, metrics_cache_path=None, source=None, copy_verification=None, mount_probes=None,
+					probe_concurrency=DEFAULT_CONCURRENCY, remove_missing_samples=False):
+
+		self.pipelines = pipelines
+		self.archives = archives
+		self.scheduler = scheduler
+		self.metric_workers = metric_workers
+		self.metrics_cache_path = metrics_cache_path
+		self.source = source
+
+		if copy_verification == None:
+
+			copy_verification = dict(COPY_VERIFICATION_DEFAULTS)
+
+		self.copy_verification = copy_verification
+
+		if mount_probes == None:
+
+			mount_probes = dict(MOUNT_PROBE_DEFAULTS)
+
+		self.mount_probes = mount_probes
+		self.probe_concurrency = probe_concurrency
+		self.remove_missing_samples = remove_missing_samples
+
+		self.unconfigured = {}
+
+	def get_pipeline(self, key):
+		"""
+		The PipelineConfig for a pipeline-version-panel key - all defaults if it isn't configured.
+
+		"""
+
+		pipeline_config = self.pipelines.get(key)
+
+		if pipeline_config != None:
+
+			return pipeline_config
+
+		if key not in self.unconfigured:
+
+			self.unconfigured[key] = PipelineConfig(key, {}, configured=False)
+
+		return self.unconfigured[key]
+
+
+def check_pipeline_settings(key, values):
+	"""
+	Return a list of the problems with one pipeline's settings.
+
+	"""
+
+	errors = []
+
+	if not isinstance(values, dict):
+
+		return [f'pipelines.{key} should be a mapping of settings']
+
+	for setting, value in values.items():
+
+		if setting in NUMBER_SETTINGS:
+
+			if not is_number(value) and not (setting == 'min_sensitivity' and value == None):
+
+				errors.append(f'pipelines.{key}.{setting} should be a number not {value!r}')
+
+		elif setting in BOOLEAN_SETTINGS:
+
+			if not isinstance(value, bool):
+
+				errors.append(f'pipelines.{key}.{setting} should be true or false not {value!r}')
+
+		elif setting in DIRECTORY_SETTINGS:
+
+			if not isinstance(value, str):
+
+				errors.append(f'pipelines.{key}.{setting} should be a path not {value!r}')
+
+		elif setting == 'qc_checks':
+
+			if not is_string_list(value):
+
+				errors.append(f'pipelines.{key}.qc_checks should be a list of checks not {value!r}')
+
+			else:
+
+				for check in value:
+
+					if check not in QC_CHECKS:
+
+						errors.append(f'pipelines.{key}.qc_checks has unknown check {check}')
+
+		elif setting.endswith('_files'):
+
+			if not is_string_list(value):
+
+				errors.append(f'pipelines.{key}.{setting} should be a list of file patterns not {value!r}')
+
+	for first, second in PAIRED_SETTINGS:
+
+		if (first in values) != (second in values):
+
+			errors.append(f'pipelines.{key} should set both {first} and {second} or neither')
+
+	for minimum, maximum in [('min_variants', 'max_variants'), ('min_titv', 'max_titv')]:
+
+		if is_number(values.get(minimum)) and is_number(values.get(maximum)) and values[minimum] > values[maximum]:
+
+			errors.append(f'pipelines.{key}.{minimum} is greater than {maximum}')
+
+	return errors
+
+
+def compile_config(config_dict, source=None):
+	"""
+	Validate a parsed config and build a Config from it.
+
+	Raises ConfigError listing every problem found.
+
+	"""
+
+	if config_dict == None:
+
+		config_dict = {}
+
+	if not isinstance(config_dict, dict):
+
+		raise ConfigError(f'{source or "config"} should be a mapping')
+
+	errors = []
+
+	pipelines = {}
+
+	pipeline_dict = config_dict.get('pipelines') or {}
+
+	if not isinstance(pipeline_dict, dict):
+
+		errors.append('pipelines should be a mapping of pipeline-version-panel keys')
+		pipeline_dict = {}
+
+	for key, values in pipeline_dict.items():
+
+		pipeline_errors = check_pipeline_settings(key, values)
+
+		if len(pipeline_errors) > 0:
+
+			errors.extend(pipeline_errors)
+			continue
+
+		pipelines[key] = PipelineConfig(key, values)
+
+	archives = config_dict.get('archives') or []
+
+	if not isinstance(archives, list):
+
+		errors.append('archives should be a list')
+		archives = []
+
+	for archive in archives:
+
+		if not isinstance(archive, dict) or not isinstance(archive.get('path'), str):
+
+			errors.append(f'archives entry {archive!r} should have a path')
+
+	scheduler = dict(SCHEDULER_DEFAULTS)
+
+	scheduler_dict = config_dict.get('scheduler') or {}
+
+	if not isinstance(scheduler_dict, dict):
+
+		errors.append('scheduler should be a mapping')
+		scheduler_dict = {}
+
+	for setting, value in scheduler_dict.items():
+
+		if setting not in SCHEDULER_DEFAULTS:
+
+			errors.append(f'scheduler.{setting} is not a scheduler setting')
+
+		elif not is_number(value) or value <= 0:
+
+			errors.append(f'scheduler.{setting} should be a positive number not {value!r}')
+
+		else:
+
+			scheduler[setting] = value
+
+	metric_workers = config_dict.get('metric_workers', DEFAULT_METRIC_WORKERS)
+
+	if not isinstance(metric_workers, int) or isinstance(metric_workers, bool) or metric_workers < 1:
+
+		errors.append(f'metric_workers should be a whole number above 0 not {metric_workers!r}')
+
+	# sqlite file the parsed metrics are kept in between passes - only kept in memory if not set
+	metrics_cache_path = config_dict.get('metrics_cache')
+
+	if metrics_cache_path != None and not isinstance(metrics_cache_path, str):
+
+		errors.append(f'metrics_cache should be a path not {metrics_cache_path!r}')
+
+	copy_verification = dict(COPY_VERIFICATION_DEFAULTS)
+
+	copy_verification_dict = config_dict.get('copy_verification') or {}
+
+	if not isinstance(copy_verification_dict, dict):
+
+		errors.append('copy_verification should be a mapping')
+		copy_verification_dict = {}
+
+	for setting, value in copy_verification_dict.items():
+
+		if setting not in COPY_VERIFICATION_DEFAULTS:
+
+			errors.append(f'copy_verification.{setting} is not a copy_verification setting')
+
+		elif setting in ['enabled', 'required'] and not isinstance(value, bool):
+
+			errors.append(f'copy_verification.{setting} should be true or false not {value!r}')
+
+		elif setting == 'manifest' and not isinstance(value, str):
+
+			errors.append(f'copy_verification.manifest should be a file name not {value!r}')
+
+		elif setting == 'workers' and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+
+			errors.append(f'copy_verification.workers should be a whole number above 0 not {value!r}')
+
+		else:
+
+			copy_verification[setting] = value
+
+	mount_probes = dict(MOUNT_PROBE_DEFAULTS)
+
+	mount_probes_dict = config_dict.get('mount_probes') or {}
+
+	if not isinstance(mount_probes_dict, dict):
+
+		errors.append('mount_probes should be a mapping')
+		mount_probes_dict = {}
+
+	for setting, value in mount_probes_dict.items():
+
+		if setting not in MOUNT_PROBE_DEFAULTS:
+
+			errors.append(f'mount_probes.{setting} is not a mount_probes setting')
+
+		elif setting == 'mounts':
+
+			if not isinstance(value, dict):
+
+				errors.append(f'mount_probes.mounts should be a mapping of mount path to seconds not {value!r}')
+				continue
+
+			for mount, timeout in value.items():
+
+				if not is_number(timeout) or timeout <= 0:
+
+					errors.append(f'mount_probes.mounts.{mount} should be a positive number of seconds not {timeout!r}')
+
+			mount_probes['mounts'] = dict(value)
+
+		elif setting == 'cooldown' and (not is_number(value) or value < 0):
+
+			errors.append(f'mount_probes.cooldown should be a number of seconds not {value!r}')
+
+		elif setting == 'state' and value != None and not isinstance(value, str):
+
+			errors.append(f'mount_probes.state should be a path not {value!r}')
+
+		else:
+
+			mount_probes[setting] = value
+
+	# directory listings and stats made at once when checking a run analysis - see pipelines.prefetch
+	probe_concurrency = config_dict.get('probe_concurrency', DEFAULT_CONCURRENCY)
+
+	if not isinstance(probe_concurrency, int) or isinstance(probe_concurrency, bool) or probe_concurrency < 1:
+
+		errors.append(f'probe_concurrency should be a whole number above 0 not {probe_concurrency!r}')
+
+	# delete sample analyses taken off a changed sample sheet rather than keeping them
+	remove_missing_samples = config_dict.get('remove_missing_samples', False)
+
+	if not isinstance(remove_missing_samples, bool):
+
+		errors.append(f'remove_missing_samples should be true or false not {remove_missing_samples!r}')
+
+	if len(errors) > 0:
+
+		raise ConfigError(f'Problems with {source or "config"}:\n' + '\n'.join(errors))
+
+	return Config(pipelines, archives, scheduler, metric_workers, metrics_cache_path, source, copy_verification, mount_probes, probe_concurrency,
+					remove_missing_samples)
+
+
+def get_cache_path(config_path):
+
+	config_path = Path(config_path)
+
+	return config_path.parent.joinpath(f'.{config_path.name}.compiled')
+
+
+def load_config(config_path, use_cache=True):
+	"""
+	Load and compile the config at config_path.
+
+	The compiled config is cached next to the config file and keyed on the config's \
+	mtime and size so it is only parsed again when it changes.
+
+	"""
+
+	config_path = os.path.abspath(config_path)
+
+	try:
+
+		stat = os.stat(config_path)
+
+	except OSError as e:
+
+		raise ConfigError(f'Could not read config {config_path}: {e}')
+
+	cache_key = (CONFIG_CACHE_VERSION, config_path, stat.st_mtime_ns, stat.st_size)
+
+	cache_path = get_cache_path(config_path)
+
+	if use_cache == True:
+
+		try:
+
+			with open(cache_path, 'rb') as cache_file:
+
+				cached_key, config = pickle.load(cache_file)
+
+			if cached_key == cache_key:
+
+				return config
+
+		except:
+
+			pass
+
+	try:
+
+		config_dict = parsers.parse_config(config_path)
+
+	except Exception as e:
+
+		raise ConfigError(f'Could not parse config {config_path}: {e}')
+
+	config = compile_config(config_dict, config_path)
+
+	if use_cache == True:
+
+		# write then rename so another process never reads half a cache file
+		temp_path = f'{cache_path}.{os.getpid()}'
+
+		try:
+
+			with open(temp_path, 'wb') as cache_file:
+
+				pickle.dump((cache_key, config), cache_file)
+
+			os.replace(temp_path, cache_path)
+
+		except OSError as e:
+
+			if os.path.exists(temp_path):
+
+				os.remove(temp_path)
+
+			logger.debug(f'Could not cache compiled config at {cache_path}: {e}')
+
+	return config
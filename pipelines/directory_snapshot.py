@@ -0,0 +1,196 @@
+from pathlib import Path
+from pipelines.mount_guard import get_mount_guard
+import fnmatch
+import glob
+import os
+
+
+class DirectorySnapshot:
+	"""
+	The contents of a single directory, listed once with os.scandir.
+
+	Pattern matching is done against the in memory listing so checking many
+	patterns against one directory only costs a single readdir.
+
+	"""
+
+	def __init__(self, path):
+
+		self.path = Path(path)
+		self.entries = {}
+		self.stats = {}
+
+		try:
+
+			with os.scandir(str(self.path)) as it:
+
+				for entry in it:
+
+					self.entries[entry.name] = entry
+
+		except (FileNotFoundError, NotADirectoryError):
+
+			pass
+
+	def names(self):
+
+		return sorted(self.entries.keys())
+
+	def glob(self, pattern):
+		"""
+		Equivalent of Path(path).glob(pattern) for a pattern without a /
+		"""
+
+		if glob.has_magic(pattern) == False:
+
+			if pattern in self.entries:
+
+				return [self.path.joinpath(pattern)]
+
+			return []
+
+		return [self.path.joinpath(name) for name in self.names() if fnmatch.fnmatchcase(name, pattern)]
+
+	def exists(self, name):
+
+		return name in self.entries
+
+	def is_dir(self, name):
+
+		entry = self.entries.get(name)
+
+		if entry == None:
+
+			return False
+
+		try:
+
+			return entry.is_dir()
+
+		except OSError:
+
+			return False
+
+	def stat(self, name):
+		"""
+		Stat info for an entry - fetched the first time it is asked for and then kept.
+		"""
+
+		if name not in self.stats:
+
+			entry = self.entries.get(name)
+
+			if entry == None:
+
+				raise FileNotFoundError(str(self.path.joinpath(name)))
+
+			self.stats[name] = entry.stat()
+
+		return self.stats[name]
+
+
+class SnapshotCache:
+	"""
+	Holds a DirectorySnapshot for every directory looked at while checking a run.
+
+	Share one between the QC and pipeline objects so each results and fastq
+	directory is only listed once per cron pass.
+
+	Listings, stats and anything passed to probe go through a MountGuard so a
+	hung network mount raises MountUnavailable instead of blocking.
+
+	"""
+
+	def __init__(self, mount_guard=None):
+
+		self.snapshots = {}
+
+		if mount_guard == None:
+
+			mount_guard = get_mount_guard()
+
+		self.mount_guard = mount_guard
+
+	def probe(self, path, func, *args):
+		"""
+		func(*args) with the deadline of the mount path is on.
+		"""
+
+		return self.mount_guard.probe(path, func, *args)
+
+	def has_snapshot(self, path):
+
+		return str(path) in self.snapshots
+
+	def add(self, path, snapshot):
+		"""
+		Store a snapshot listed elsewhere - see pipelines.prefetch
+		"""
+
+		self.snapshots[str(path)] = snapshot
+
+	def snapshot(self, path):
+
+		key = str(path)
+
+		if key not in self.snapshots:
+
+			self.snapshots[key] = self.probe(path, DirectorySnapshot, path)
+
+		return self.snapshots[key]
+
+	def glob(self, path, pattern):
+		"""
+		Equivalent of list(Path(path).glob(pattern)).
+
+		Patterns can contain directories e.g. post_processing/results/sex/*.txt
+
+		"""
+
+		parts = [part for part in str(pattern).split('/') if part not in ('', '.')]
+
+		if len(parts) == 0:
+
+			return []
+
+		directories = [Path(path)]
+
+		for part in parts[:-1]:
+
+			new_directories = []
+
+			for directory in directories:
+
+				snapshot = self.snapshot(directory)
+
+				for match in snapshot.glob(part):
+
+					if snapshot.is_dir(match.name):
+
+						new_directories.append(match)
+
+			directories = new_directories
+
+		found = []
+
+		for directory in directories:
+
+			found = found + self.snapshot(directory).glob(parts[-1])
+
+		return found
+
+	def exists(self, path):
+
+		path = Path(path)
+
+		return self.snapshot(path.parent).exists(path.name)
+
+	def stat(self, path):
+
+		path = Path(path)
+
+		return self.probe(path, self.snapshot(path.parent).stat, path.name)
+
+	def listdir(self, path):
+
+		return self.snapshot(path).names()
@@ -2,9 +2,27 @@ from pathlib import Path
 import glob
 import re
 from pipelines import parsers
-
-
-class DragenGE:
+from pipelines.base_pipeline import BasePipeline
+from pipelines.registry import register_pipeline, metric_step
+
+
+@register_pipeline
+class DragenGE(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['DragenGE']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_expected_files', 'run_not_expected_files', 'post_sample_files']
+	sample_checks = False
+	run_includes_samples = False
+	metric_steps = [
+		metric_step('get_coverage_metrics', 'add_custom_coverage_metrics'),
+		metric_step('get_contamination', 'add_contamination_metrics'),
+		metric_step('get_sex_metrics', 'add_sex_metrics', ['sex']),
+		metric_step('get_alignment_metrics', 'add_dragen_alignment_metrics'),
+		metric_step('get_variant_calling_metrics', 'add_dragen_variant_calling_metrics'),
+		metric_step('get_sensitivity', 'add_sensitivity_metrics', first_completion_only=True),
+		metric_step('get_variant_count_metrics', 'add_variant_count_metrics'),
+	]
 
 	def __init__(self,
 				 results_dir,
@@ -37,7 +55,7 @@ class DragenGE:
 
 		results_path = Path(self.results_dir)
 		
-		marker = results_path.glob(self.run_complete_marker)
+		marker = self.glob(results_path, self.run_complete_marker)
 
 		if len(list(marker)) == 1:
 
@@ -58,17 +76,15 @@ class DragenGE:
 
 			results_path = Path(self.results_dir)
 		
-			marker = results_path.glob(self.run_complete_marker)
+			marker = self.glob(results_path, self.run_complete_marker)
 
 			marker = list(marker)[0]
 
 			# last line in file
 			last_report = ''
 
-			with open(marker, 'r') as outfile:
-
-				for x in outfile:
-					last_report = x.strip()
+			for x in self.read_lines(marker):
+				last_report = x.strip()
 
 			if 'success' in last_report:
 
@@ -85,11 +101,11 @@ class DragenGE:
 
 		for sample in self.sample_names:
 
-			sample_coverage_metrics_file = results_path.glob(f'post_processing/results/coverage/*{sample}.depth_summary')
+			sample_coverage_metrics_file = self.glob(results_path, f'post_processing/results/coverage/*{sample}.depth_summary')
 
 			sample_coverage_metrics_file = list(sample_coverage_metrics_file)[0]	
 
-			parsed_coverage_metrics = parsers.parse_custom_coverage_metrics(sample_coverage_metrics_file)
+			parsed_coverage_metrics = self.parse(parsers.parse_custom_coverage_metrics, sample_coverage_metrics_file)
 
 			run_coverage_metrics_dict[sample] = parsed_coverage_metrics
 
@@ -103,11 +119,11 @@ class DragenGE:
 
 		for sample in self.sample_names:
 
-			sample_contamination_metrics_file = results_path.glob(f'post_processing/results/contamination/*{sample}_contamination.selfSM')
+			sample_contamination_metrics_file = self.glob(results_path, f'post_processing/results/contamination/*{sample}_contamination.selfSM')
 
 			sample_contamination_metrics_file = list(sample_contamination_metrics_file)[0]	
 
-			parsed_contamination_metrics = parsers.parse_contamination_metrics(sample_contamination_metrics_file)
+			parsed_contamination_metrics = self.parse(parsers.parse_contamination_metrics, sample_contamination_metrics_file)
 
 			run_contamination_metrics_dict[sample] = parsed_contamination_metrics
 
@@ -121,12 +137,12 @@ class DragenGE:
 
 		for sample in self.sample_names:
 
-			sample_sex_metrics_file = results_path.glob(f'post_processing/results/sex/*{sample}_calculated_sex.txt')
+			sample_sex_metrics_file = self.glob(results_path, f'post_processing/results/sex/*{sample}_calculated_sex.txt')
 
 			try:
 				sample_sex_metrics_file = list(sample_sex_metrics_file)[0]
 			
-				parsed_sex_metrics = parsers.parse_dragen_sex_file(sample_sex_metrics_file)
+				parsed_sex_metrics = self.parse(parsers.parse_dragen_sex_file, sample_sex_metrics_file)
 
 				run_sex_metrics_dict[sample] = parsed_sex_metrics
 
@@ -141,11 +157,11 @@ class DragenGE:
 		
 		results_path = Path(self.results_dir)
 
-		variant_metrics_file = results_path.glob(f'{self.run_id}.vc_metrics.csv')
+		variant_metrics_file = self.glob(results_path, f'{self.run_id}.vc_metrics.csv')
 		
 		variant_metrics_file = list(variant_metrics_file)[0]
 		
-		parsed_variant_metrics_file = parsers.parse_dragen_vc_metrics_file(variant_metrics_file)
+		parsed_variant_metrics_file = self.parse(parsers.parse_dragen_vc_metrics_file, variant_metrics_file)
 
 		return parsed_variant_metrics_file  
 	
@@ -158,11 +174,11 @@ class DragenGE:
 
 		for sample in self.sample_names:
 
-			alignment_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.mapping_metrics.csv')
+			alignment_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}.mapping_metrics.csv')
 
 			alignment_metrics_file = list(alignment_metrics_file)[0]
 			
-			parsed_alignment_metrics = parsers.parse_dragen_alignment_metrics_file(alignment_metrics_file)
+			parsed_alignment_metrics = self.parse(parsers.parse_dragen_alignment_metrics_file, alignment_metrics_file)
 
 			run_alignment_metrics_dict[sample] = parsed_alignment_metrics
 
@@ -173,11 +189,11 @@ class DragenGE:
 		
 		results_path = Path(self.results_dir)
 
-		sensitivity_file = results_path.glob(f'post_processing/results/sensitivity/{self.run_id}*_sensitivity.txt')
+		sensitivity_file = self.glob(results_path, f'post_processing/results/sensitivity/{self.run_id}*_sensitivity.txt')
 		
 		sensitivity_file = list(sensitivity_file)[0]
 		
-		parsed_sensitivity_file = parsers.parse_sensitivity_file(sensitivity_file)
+		parsed_sensitivity_file = self.parse(parsers.parse_sensitivity_file, sensitivity_file)
 
 		return parsed_sensitivity_file  
 	
@@ -188,20 +204,35 @@ class DragenGE:
 
 		sample_variant_count_dict = {}
 
-		for sample in self.sample_names:
+		vcf_file = self.glob(results_path, f'post_processing/results/old_variant_database_vcf/{self.run_id}_old_variant_database.vcf')
 
-			vcf_file = results_path.glob(f'post_processing/results/old_variant_database_vcf/{self.run_id}_old_variant_database.vcf')
+		vcf_file = list(vcf_file)[0]
 
-			vcf_file = list(vcf_file)[0]
+		# count all the samples in one pass of the run vcf
+		vcf_count_metrics = self.parse(parsers.get_passing_variant_count, vcf_file, self.sample_names)
 
-			vcf_count_metrics = parsers.get_passing_variant_count(vcf_file, [sample])
+		for sample in self.sample_names:
 
-			sample_variant_count_dict[sample] = vcf_count_metrics
+			sample_variant_count_dict[sample] = {sample: vcf_count_metrics[sample]}
 
 		return sample_variant_count_dict
 
 
-class DragenWGS:
+@register_pipeline
+class DragenWGS(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['DragenWGS']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_expected_files', 'run_not_expected_files', 'post_sample_files']
+	sample_checks = True
+	run_includes_samples = True
+	metric_steps = [
+		metric_step('get_alignment_metrics', 'add_dragen_alignment_metrics'),
+		metric_step('get_variant_calling_metrics', 'add_dragen_variant_calling_metrics'),
+		metric_step('get_wgs_mapping_metrics', 'add_dragen_wgs_coverage_metrics'),
+		metric_step('get_exonic_mapping_metrics', 'add_dragen_exonic_coverage_metrics'),
+		metric_step('get_ploidy_metrics', 'add_dragen_ploidy_metrics'),
+	]
 
 	def __init__(self,
 				 results_dir,
@@ -231,34 +262,46 @@ class DragenWGS:
 		self.post_sample_files = post_sample_files
 		
 		
-	def sample_is_complete(self, sample):
+	def get_sample_marker_path(self):
 		"""
-		Look for presence of file indicating that a sample has completed the pipeline.
-
-		For example the output error log.
+		The sample complete marker is written at run level - in post_processing/results for the newer versions.
 		"""
 
 		results_path = Path(self.results_dir)
 
-		new_path = False
-
 		for i in self.run_expected_files:
 
 			if 'post_processing' in i:
 
-				
-				new_path = True
-				break
+				return results_path.joinpath('post_processing/results/')
 
-		if new_path:
+		return results_path.joinpath('results')
 
-			results_path = results_path.joinpath('post_processing/results/')
+	def get_sample_dirs(self, sample):
+		"""
+		The sample directory, the run level marker directory and the directories the post_sample_files are in.
+		"""
 
-		else:
+		sample_path = Path(self.results_dir).joinpath(sample)
 
-			results_path = results_path.joinpath('results')
+		post_sample_files = [file.replace('{sample}', sample) for file in self.post_sample_files]
+
+		directories = self.get_pattern_dirs(sample_path, [''] + self.sample_expected_files + self.sample_not_expected_files)
+		directories = directories + self.get_pattern_dirs(self.get_sample_marker_path(), ['', self.sample_complete_marker])
+		directories = directories + self.get_pattern_dirs(self.results_dir, post_sample_files)
+
+		return [directory for i, directory in enumerate(directories) if directory not in directories[:i]]
+
+	def sample_is_complete(self, sample):
+		"""
+		Look for presence of file indicating that a sample has completed the pipeline.
+
+		For example the output error log.
+		"""
 
-		marker = results_path.glob(self.sample_complete_marker)
+		results_path = self.get_sample_marker_path()
+
+		marker = self.glob(results_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -281,7 +324,7 @@ class DragenWGS:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) == 0:
 
@@ -290,7 +333,7 @@ class DragenWGS:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -302,7 +345,7 @@ class DragenWGS:
 			
 			joined = f'{sample}'.join(split)
 						
-			found_file = results_path.glob(joined)
+			found_file = self.glob(results_path, joined)
 			
 			if len(list(found_file)) < 1:
 
@@ -336,7 +379,7 @@ class DragenWGS:
 
 			results_path = results_path.joinpath('results')
 
-		marker = results_path.glob(self.sample_complete_marker)
+		marker = self.glob(results_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -358,7 +401,7 @@ class DragenWGS:
 		# check files we want to be there are there
 		for file in self.run_expected_files:
 			
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 								
@@ -368,7 +411,7 @@ class DragenWGS:
 		for file in self.run_not_expected_files:
 			
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -420,11 +463,11 @@ class DragenWGS:
 		
 		results_path = Path(self.results_dir)
 
-		variant_metrics_file = results_path.glob(f'{self.run_id}.vc_metrics.csv')
+		variant_metrics_file = self.glob(results_path, f'{self.run_id}.vc_metrics.csv')
 		
 		variant_metrics_file = list(variant_metrics_file)[0]
 		
-		parsed_variant_metrics_file = parsers.parse_dragen_vc_metrics_file(variant_metrics_file)
+		parsed_variant_metrics_file = self.parse(parsers.parse_dragen_vc_metrics_file, variant_metrics_file)
 
 		return parsed_variant_metrics_file  
 	
@@ -437,11 +480,11 @@ class DragenWGS:
 
 		for sample in self.sample_names:
 
-			alignment_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.mapping_metrics.csv')
+			alignment_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}.mapping_metrics.csv')
 
 			alignment_metrics_file = list(alignment_metrics_file)[0]
 			
-			parsed_alignment_metrics = parsers.parse_dragen_alignment_metrics_file(alignment_metrics_file)
+			parsed_alignment_metrics = self.parse(parsers.parse_dragen_alignment_metrics_file, alignment_metrics_file)
 
 			run_alignment_metrics_dict[sample] = parsed_alignment_metrics
 
@@ -456,11 +499,11 @@ class DragenWGS:
 
 		for sample in self.sample_names:
 
-			wgs_coverage_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.wgs_coverage_metrics.csv')
+			wgs_coverage_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}.wgs_coverage_metrics.csv')
 
 			wgs_coverage_metrics_file = list(wgs_coverage_metrics_file)[0]
 			
-			parsed_wgs_coverage_metrics = parsers.parse_dragen_wgs_coverage_metrics_file(wgs_coverage_metrics_file)
+			parsed_wgs_coverage_metrics = self.parse(parsers.parse_dragen_wgs_coverage_metrics_file, wgs_coverage_metrics_file)
 
 			run_wgs_coverage_metrics_dict[sample] = parsed_wgs_coverage_metrics
 
@@ -474,11 +517,11 @@ class DragenWGS:
 
 		for sample in self.sample_names:
 
-			wgs_coverage_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.qc-coverage-region-1_coverage_metrics.csv')
+			wgs_coverage_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}.qc-coverage-region-1_coverage_metrics.csv')
 
 			wgs_coverage_metrics_file = list(wgs_coverage_metrics_file)[0]
 			
-			parsed_wgs_coverage_metrics = parsers.parse_dragen_wgs_coverage_metrics_file(wgs_coverage_metrics_file)
+			parsed_wgs_coverage_metrics = self.parse(parsers.parse_dragen_wgs_coverage_metrics_file, wgs_coverage_metrics_file)
 
 			run_wgs_coverage_metrics_dict[sample] = parsed_wgs_coverage_metrics
 
@@ -495,15 +538,13 @@ class DragenWGS:
 
 		for sample in self.sample_names:
 
-			run_ploidy_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.ploidy_estimation_metrics.csv')
-
-			if len(list(run_ploidy_metrics_file)) ==1:
+			run_ploidy_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}.ploidy_estimation_metrics.csv')
 
-				run_ploidy_metrics_file = results_path.joinpath(sample).glob(f'*{sample}.ploidy_estimation_metrics.csv')
+			if len(run_ploidy_metrics_file) ==1:
 
-				run_ploidy_metrics_file = list(run_ploidy_metrics_file)[0]
+				run_ploidy_metrics_file = run_ploidy_metrics_file[0]
 				
-				parsed_run_ploidy_metrics = parsers.parse_ploidy_metrics_file(run_ploidy_metrics_file)
+				parsed_run_ploidy_metrics = self.parse(parsers.parse_ploidy_metrics_file, run_ploidy_metrics_file)
 
 				run_ploidy_metrics_dict[sample] = parsed_run_ploidy_metrics
 
@@ -2,8 +2,22 @@ from pathlib import Path
 import glob
 import re
 from pipelines import parsers
-
-class SomaticFusion:
+from pipelines.base_pipeline import BasePipeline
+from pipelines.registry import register_pipeline, metric_step
+
+@register_pipeline
+class SomaticFusion(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['Fusion']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_expected_files', 'run_not_expected_files']
+	sample_checks = True
+	run_includes_samples = False
+	metric_steps = [
+		metric_step('get_fastqc_data', 'add_fastqc_data'),
+		metric_step('get_contamination_metrics', 'add_fusion_contamination_metrics'),
+		metric_step('get_alignment_metrics', 'add_fusion_alignment_metrics'),
+	]
 
 	def __init__(self,
 				results_dir,
@@ -39,7 +53,7 @@ class SomaticFusion:
 
 		sample_path = results_path.joinpath(sample)
 
-		marker = sample_path.glob(self.sample_complete_marker)
+		marker = self.glob(sample_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -63,7 +77,7 @@ class SomaticFusion:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) < 1:
 
@@ -72,7 +86,7 @@ class SomaticFusion:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -113,7 +127,7 @@ class SomaticFusion:
 
 		for file in self.run_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -122,7 +136,7 @@ class SomaticFusion:
 		# check file we do not want to be there are not there
 		for file in self.run_not_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -142,7 +156,7 @@ class SomaticFusion:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.joinpath(sample).glob(f'*{sample}*_fastqc.txt')
+			fastqc_data_files = self.glob(results_path.joinpath(sample), f'*{sample}*_fastqc.txt')
 
 			sample_fastqc_list = []
 
@@ -153,7 +167,7 @@ class SomaticFusion:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file(fastqc_data)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file, fastqc_data)
 
 				file_fastqc_dict = {} 
 				file_fastqc_dict['lane'] = lane
@@ -189,7 +203,7 @@ class SomaticFusion:
 
 		fusion_contamination_file = results_path.joinpath('contamination.csv')
 
-		parsed_fusion_contamination_data  = parsers.parse_fusion_contamination_metrics_file(fusion_contamination_file)
+		parsed_fusion_contamination_data  = self.parse(parsers.parse_fusion_contamination_metrics_file, fusion_contamination_file)
 
 		return parsed_fusion_contamination_data
 
@@ -200,10 +214,10 @@ class SomaticFusion:
 
 		results_path = Path(self.results_dir)
 
-		fusion_alignment_metrics_file = results_path.glob(f'*{self.run_id}*-aligned_reads.csv')
+		fusion_alignment_metrics_file = self.glob(results_path, f'*{self.run_id}*-aligned_reads.csv')
 
 		fusion_alignment_metrics_file = list(fusion_alignment_metrics_file)[0]
 
-		fusion_alignment_metrics_data  = parsers.parse_fusion_alignment_metrics_file(fusion_alignment_metrics_file)
+		fusion_alignment_metrics_data  = self.parse(parsers.parse_fusion_alignment_metrics_file, fusion_alignment_metrics_file)
 
 		return fusion_alignment_metrics_data
@@ -2,9 +2,28 @@ from pathlib import Path
 import glob
 import re
 from pipelines import parsers
-
-class GermlineEnrichment:
-
+from pipelines.base_pipeline import BasePipeline
+from pipelines.registry import register_pipeline, metric_step
+
+@register_pipeline
+class GermlineEnrichment(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['GermlineEnrichment']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_expected_files', 'run_not_expected_files']
+	sample_checks = True
+	run_includes_samples = True
+	metric_steps = [
+		metric_step('get_fastqc_data', 'add_fastqc_data'),
+		metric_step('get_hs_metrics', 'add_hs_metrics'),
+		metric_step('get_depth_metrics', 'add_depth_of_coverage_metrics'),
+		metric_step('get_duplication_metrics', 'add_duplication_metrics'),
+		metric_step('get_contamination', 'add_contamination_metrics'),
+		metric_step('get_calculated_sex', 'add_sex_metrics', ['gender']),
+		metric_step('get_alignment_metrics', 'add_alignment_metrics'),
+		metric_step('get_variant_calling_metrics', 'add_variant_calling_metrics'),
+		metric_step('get_insert_metrics', 'add_insert_metrics'),
+	]
 
 	def __init__(self,
 				 results_dir,
@@ -60,7 +79,7 @@ class GermlineEnrichment:
 
 		sample_path = results_path.joinpath(sample)
 
-		marker = sample_path.glob(self.sample_complete_marker)
+		marker = self.glob(sample_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -83,7 +102,7 @@ class GermlineEnrichment:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -92,7 +111,7 @@ class GermlineEnrichment:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -110,7 +129,7 @@ class GermlineEnrichment:
 
 		results_path = Path(self.results_dir)
 
-		marker = results_path.glob(self.run_complete_marker)
+		marker = self.glob(results_path, self.run_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -131,7 +150,7 @@ class GermlineEnrichment:
 		# check files we want to be there are there
 		for file in self.run_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -140,7 +159,7 @@ class GermlineEnrichment:
 		# check file we do not want to be there are not there
 		for file in self.run_not_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -193,7 +212,7 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.joinpath(sample).glob(f'*{sample}*_fastqc.txt')
+			fastqc_data_files = self.glob(results_path.joinpath(sample), f'*{sample}*_fastqc.txt')
 
 			sample_fastqc_list = []
 
@@ -203,7 +222,7 @@ class GermlineEnrichment:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file(fastqc_data)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file, fastqc_data)
 
 				file_fastqc_dict = {} 
 				file_fastqc_dict['lane'] = lane
@@ -241,11 +260,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			hs_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_HsMetrics.txt')
+			hs_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_HsMetrics.txt')
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
 
 			run_hs_metrics_dict[sample] = parsed_hs_metrics_data
 
@@ -259,11 +278,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_depth_summary_file = results_path.joinpath(sample).glob(f'*{sample}*_DepthOfCoverage.sample_summary')
+			sample_depth_summary_file = self.glob(results_path.joinpath(sample), f'*{sample}*_DepthOfCoverage.sample_summary')
 
 			sample_depth_summary_file = list(sample_depth_summary_file)[0]	
 
-			parsed_depth_metrics = parsers.parse_gatk_depth_summary_file(sample_depth_summary_file)
+			parsed_depth_metrics = self.parse(parsers.parse_gatk_depth_summary_file, sample_depth_summary_file)
 
 			run_depth_metrics_dict[sample] = parsed_depth_metrics
 
@@ -277,11 +296,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_duplication_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_MarkDuplicatesMetrics.txt')
+			sample_duplication_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_MarkDuplicatesMetrics.txt')
 
 			sample_duplication_metrics_file = list(sample_duplication_metrics_file)[0]	
 
-			parsed_duplication_metrics = parsers.parse_duplication_metrics_file(sample_duplication_metrics_file)
+			parsed_duplication_metrics = self.parse(parsers.parse_duplication_metrics_file, sample_duplication_metrics_file)
 
 			run_duplication_metrics_dict[sample] = parsed_duplication_metrics
 
@@ -295,11 +314,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_contamination_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_Contamination.selfSM')
+			sample_contamination_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_Contamination.selfSM')
 
 			sample_contamination_metrics_file = list(sample_contamination_metrics_file)[0]	
 
-			parsed_contamination_metrics = parsers.parse_contamination_metrics(sample_contamination_metrics_file)
+			parsed_contamination_metrics = self.parse(parsers.parse_contamination_metrics, sample_contamination_metrics_file)
 
 			run_contamination_metrics_dict[sample] = parsed_contamination_metrics
 
@@ -314,11 +333,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			qc_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_QC.txt')
+			qc_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_QC.txt')
 
 			qc_metrics_file = list(qc_metrics_file)[0]
 
-			parsed_qc_metrics_file = parsers.parse_qc_metrics_file(qc_metrics_file)
+			parsed_qc_metrics_file = self.parse(parsers.parse_qc_metrics_file, qc_metrics_file)
 
 			calculated_sex_dict[sample] = parsed_qc_metrics_file
 
@@ -332,11 +351,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			alignment_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_AlignmentSummaryMetrics.txt')
+			alignment_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_AlignmentSummaryMetrics.txt')
 
 			alignment_metrics_file = list(alignment_metrics_file)[0]
 
-			parsed_alignment_metrics_file = parsers.parse_alignment_metrics_file(alignment_metrics_file)
+			parsed_alignment_metrics_file = self.parse(parsers.parse_alignment_metrics_file, alignment_metrics_file)
 
 			alignment_metrics_dict[sample] = parsed_alignment_metrics_file
 
@@ -348,11 +367,11 @@ class GermlineEnrichment:
 
 		variant_metrics_dict = {}
 
-		variant_detail_metrics_file = results_path.glob(f'*{self.run_id}*_CollectVariantCallingMetrics.txt.variant_calling_detail_metrics')
+		variant_detail_metrics_file = self.glob(results_path, f'*{self.run_id}*_CollectVariantCallingMetrics.txt.variant_calling_detail_metrics')
 
 		variant_detail_metrics_file = list(variant_detail_metrics_file)[0]
 
-		variant_metrics_dict = parsers.parse_variant_detail_metrics_file(variant_detail_metrics_file)
+		variant_metrics_dict = self.parse(parsers.parse_variant_detail_metrics_file, variant_detail_metrics_file)
 
 		return variant_metrics_dict
 
@@ -365,11 +384,11 @@ class GermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			insert_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_InsertMetrics.txt')
+			insert_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_InsertMetrics.txt')
 
 			insert_metrics_file = list(insert_metrics_file)[0]
 
-			parsed_insert_metrics_file = parsers.parse_insert_metrics_file(insert_metrics_file)
+			parsed_insert_metrics_file = self.parse(parsers.parse_insert_metrics_file, insert_metrics_file)
 
 			insert_metrics_dict[sample] = parsed_insert_metrics_file
 
@@ -0,0 +1,96 @@
+"""
+Cheap checks that compressed FASTQ and BAM files were written or copied completely.
+
+BGZF files (BAMs and most FASTQs from bcl2fastq and DRAGEN) end with a fixed \
+28 byte empty block so a truncated file can be spotted by reading its last few \
+bytes. Plain gzip files can't be checked without decompressing them so only \
+their header is looked at.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+# the empty block every BGZF file should end with
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# files are mostly on NFS so check plenty at once
+INTEGRITY_WORKERS = 16
+
+
+def is_bgzf_header(header):
+
+	# FEXTRA set and a BC subfield straight after the 12 byte fixed header
+	return header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+
+def file_is_intact(path):
+	"""
+	Does a .gz or .bam file look complete.
+
+	"""
+
+	try:
+
+		with open(str(path), 'rb') as f:
+
+			header = f.read(18)
+
+			if header[:3] != GZIP_MAGIC:
+
+				return False
+
+			if is_bgzf_header(header) == False:
+
+				return True
+
+			f.seek(0, os.SEEK_END)
+
+			if f.tell() < len(BGZF_EOF):
+
+				return False
+
+			f.seek(-len(BGZF_EOF), os.SEEK_END)
+
+			return f.read() == BGZF_EOF
+
+	except OSError:
+
+		return False
+
+
+def check_files(paths, metrics_cache=None, workers=INTEGRITY_WORKERS, probe=None):
+	"""
+	Check many files at once in a thread pool.
+
+	With a metrics cache a file is only read again once its size or mtime changes. \
+	probe is a MountGuard.probe giving each check a deadline.
+
+	Returns a dictionary of path to True/False.
+
+	"""
+
+	paths = list(paths)
+
+	if len(paths) == 0:
+
+		return {}
+
+	if metrics_cache == None:
+
+		check = file_is_intact
+
+	else:
+
+		check = lambda path: metrics_cache.parse(file_is_intact, path)
+
+	if probe != None:
+
+		unprobed_check = check
+		check = lambda path: probe(path, unprobed_check, path)
+
+	with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+
+		return dict(zip(paths, executor.map(check, paths)))
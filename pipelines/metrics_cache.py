@@ -0,0 +1,197 @@
+"""
+A cache of parsed metrics files shared by the validation and metric getters.
+
+Results are keyed on the file's path, the parser and its arguments, and are \
+only used while the file's size and mtime and PARSER_VERSION in pipelines.parsers \
+match, so a file is only parsed again once it changes. They are kept in memory \
+for a pass and, if a store path is given, in a small sqlite database so the next \
+pass can reuse them.
+
+"""
+
+from pathlib import Path
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+from pipelines import parsers
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsCache:
+	"""
+	Use parse(parser, path, *args) in place of parser(path, *args).
+
+	Hits and misses are counted in memory_hits, store_hits and misses.
+
+	"""
+
+	def __init__(self, store_path=None):
+
+		self.store_path = store_path
+		self.lock = threading.Lock()
+
+		# pickled results so every caller gets its own copy
+		self.memory = {}
+
+		self.memory_hits = 0
+		self.store_hits = 0
+		self.misses = 0
+
+		self.store = None
+
+		if store_path != None:
+
+			self.open_store()
+
+	def open_store(self):
+
+		try:
+
+			Path(self.store_path).parent.mkdir(parents=True, exist_ok=True)
+
+			self.store = sqlite3.connect(str(self.store_path), timeout=30, check_same_thread=False)
+			# worker processes read and write the store at the same time
+			self.store.execute('PRAGMA journal_mode=WAL')
+			# one row per file and parser - replaced when the file changes
+			self.store.execute('CREATE TABLE IF NOT EXISTS metrics (key TEXT PRIMARY KEY, signature TEXT, value BLOB)')
+			self.store.commit()
+
+		except sqlite3.Error as e:
+
+			logger.warning(f'Could not open metrics cache {self.store_path}: {e}')
+			self.store = None
+
+	def get_key(self, parser, path, args):
+
+		stat = os.stat(str(path))
+
+		key = f'{os.path.abspath(str(path))}|{parser.__module__}.{parser.__name__}|{args!r}'
+		signature = f'{stat.st_size}|{stat.st_mtime_ns}|{parsers.PARSER_VERSION}'
+
+		return key, signature
+
+	def read_store(self, key, signature):
+
+		if self.store == None:
+
+			return None
+
+		try:
+
+			row = self.store.execute('SELECT value FROM metrics WHERE key = ? AND signature = ?', (key, signature)).fetchone()
+
+		except sqlite3.Error as e:
+
+			logger.warning(f'Could not read metrics cache {self.store_path}: {e}')
+			return None
+
+		if row == None:
+
+			return None
+
+		return zlib.decompress(row[0])
+
+	def write_store(self, key, signature, value):
+
+		if self.store == None:
+
+			return
+
+		try:
+
+			self.store.execute('INSERT OR REPLACE INTO metrics (key, signature, value) VALUES (?, ?, ?)', (key, signature, zlib.compress(value)))
+			self.store.commit()
+
+		except sqlite3.Error as e:
+
+			logger.warning(f'Could not write metrics cache {self.store_path}: {e}')
+
+	def parse(self, parser, path, *args):
+
+		try:
+
+			key, signature = self.get_key(parser, path, args)
+
+		except OSError:
+
+			# let the parser raise whatever it normally would for a missing file
+			return parser(path, *args)
+
+		with self.lock:
+
+			value = self.memory.get((key, signature))
+
+			if value != None:
+
+				self.memory_hits = self.memory_hits + 1
+				return pickle.loads(value)
+
+			value = self.read_store(key, signature)
+
+			if value != None:
+
+				self.store_hits = self.store_hits + 1
+				self.memory[(key, signature)] = value
+				return pickle.loads(value)
+
+			self.misses = self.misses + 1
+
+		result = parser(path, *args)
+
+		value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+		with self.lock:
+
+			self.memory[(key, signature)] = value
+			self.write_store(key, signature, value)
+
+		return result
+
+	def get_counts(self):
+
+		return {'memory_hits': self.memory_hits, 'store_hits': self.store_hits, 'misses': self.misses}
+
+	def clear_memory(self):
+
+		with self.lock:
+
+			self.memory = {}
+
+	def close(self):
+
+		if self.store != None:
+
+			self.store.close()
+			self.store = None
+
+
+caches = {}
+
+
+def get_metrics_cache(store_path=None):
+	"""
+	The metrics cache for this process - one per store path.
+
+	"""
+
+	if store_path not in caches:
+
+		caches[store_path] = MetricsCache(store_path)
+
+	return caches[store_path]
+
+
+def clear_metrics_caches():
+	"""
+	Forget the in memory results at the start of a pass - the store is kept.
+
+	"""
+
+	for metrics_cache in caches.values():
+
+		metrics_cache.clear_memory()
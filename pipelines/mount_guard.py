@@ -0,0 +1,238 @@
+"""
+Filesystem probes with a deadline for each network mount.
+
+A hung network mount blocks any call which touches it, so probes of paths under \
+a configured mount are run on a daemon thread and given up on once the mount's \
+timeout has passed. The mount is then marked degraded and probes under it fail \
+straight away with MountUnavailable until the cool down has passed, so a bad mount \
+costs at most one timeout per cool down rather than stalling everything behind it.
+
+Degraded mounts are written to a small JSON state file, if one is configured, so \
+the next update_database run and any worker processes skip them as well.
+
+Paths which aren't under a configured mount are probed directly.
+
+"""
+
+from pathlib import Path
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds a mount is skipped for after a probe times out
+DEFAULT_COOLDOWN = 900
+
+
+class MountUnavailable(OSError):
+	"""
+	A probe timed out or its mount is degraded - an OSError so existing handlers skip the path.
+
+	"""
+
+	def __init__(self, mount, message):
+
+		super().__init__(message)
+		self.mount = mount
+
+
+class MountGuard:
+	"""
+	Use probe(path, func, *args) in place of func(*args) for anything touching path.
+
+	mounts is a dictionary of mount path to timeout in seconds.
+
+	"""
+
+	def __init__(self, mounts=None, cooldown=DEFAULT_COOLDOWN, state_path=None):
+
+		# longest first so nested mounts match before their parents
+		self.mounts = sorted(((os.path.normpath(mount), timeout) for mount, timeout in (mounts or {}).items()), key=lambda mount: len(mount[0]), reverse=True)
+		self.cooldown = cooldown
+		self.state_path = state_path
+		self.lock = threading.Lock()
+
+		# mount to the time it can be probed again
+		self.degraded = {}
+		self.state_mtime = None
+
+		self.load_state()
+
+	def get_mount(self, path):
+		"""
+		The (mount, timeout) a path is under - (None, None) if it isn't under a configured mount.
+
+		"""
+
+		path = os.path.normpath(str(path))
+
+		for mount, timeout in self.mounts:
+
+			if path == mount or path.startswith(mount + os.sep):
+
+				return mount, timeout
+
+		return None, None
+
+	def load_state(self):
+		"""
+		Read the degraded mounts another process may have written - only when the file has changed.
+
+		"""
+
+		if self.state_path == None:
+
+			return
+
+		try:
+
+			mtime = os.stat(str(self.state_path)).st_mtime_ns
+
+			if mtime == self.state_mtime:
+
+				return
+
+			with open(str(self.state_path), 'r') as f:
+
+				state = json.load(f)
+
+		except (OSError, ValueError):
+
+			return
+
+		with self.lock:
+
+			self.state_mtime = mtime
+
+			for mount, until in state.items():
+
+				self.degraded[mount] = max(until, self.degraded.get(mount, 0))
+
+	def save_state(self):
+
+		if self.state_path == None:
+
+			return
+
+		now = time.time()
+
+		with self.lock:
+
+			state = {mount: until for mount, until in self.degraded.items() if until > now}
+
+		# write then rename so another process never reads half a file
+		temp_path = f'{self.state_path}.{os.getpid()}'
+
+		try:
+
+			Path(self.state_path).parent.mkdir(parents=True, exist_ok=True)
+
+			with open(temp_path, 'w') as f:
+
+				json.dump(state, f)
+
+			os.replace(temp_path, str(self.state_path))
+
+		except OSError as e:
+
+			logger.warning(f'Could not save degraded mounts to {self.state_path}: {e}')
+
+	def is_degraded(self, mount, now=None):
+
+		if now == None:
+
+			now = time.time()
+
+		self.load_state()
+
+		return self.degraded.get(mount, 0) > now
+
+	def mark_degraded(self, mount):
+
+		with self.lock:
+
+			self.degraded[mount] = time.time() + self.cooldown
+
+		logger.warning(f'{mount} is not responding - skipping it for {self.cooldown} seconds')
+
+		self.save_state()
+
+	def get_degraded_mounts(self):
+
+		now = time.time()
+
+		return sorted(mount for mount, _ in self.mounts if self.is_degraded(mount, now))
+
+	def probe(self, path, func, *args, **kwargs):
+		"""
+		Call func(*args, **kwargs), giving up after the timeout of the mount path is under.
+
+		"""
+
+		mount, timeout = self.get_mount(path)
+
+		if mount == None:
+
+			return func(*args, **kwargs)
+
+		if self.is_degraded(mount):
+
+			raise MountUnavailable(mount, f'{mount} is degraded - skipping {path}')
+
+		result = {}
+
+		def run():
+
+			try:
+
+				result['value'] = func(*args, **kwargs)
+
+			except BaseException as e:
+
+				result['error'] = e
+
+		# a daemon thread so one stuck in the kernel doesn't stop the process exiting
+		thread = threading.Thread(target=run, name=f'probe {mount}', daemon=True)
+		thread.start()
+		thread.join(timeout)
+
+		if thread.is_alive():
+
+			self.mark_degraded(mount)
+
+			raise MountUnavailable(mount, f'Probe of {path} timed out after {timeout} seconds')
+
+		if 'error' in result:
+
+			raise result['error']
+
+		return result['value']
+
+
+guards = {}
+
+
+def get_mount_guard(mount_probes=None):
+	"""
+	The mount guard for this process - one per mount_probes config section.
+
+	Without any mounts configured every probe is made directly.
+
+	"""
+
+	if mount_probes == None:
+
+		mount_probes = {}
+
+	mounts = mount_probes.get('mounts') or {}
+
+	key = (tuple(sorted(mounts.items())), mount_probes.get('cooldown'), mount_probes.get('state'))
+
+	if key not in guards:
+
+		guards[key] = MountGuard(mounts, mount_probes.get('cooldown', DEFAULT_COOLDOWN), mount_probes.get('state'))
+
+	return guards[key]
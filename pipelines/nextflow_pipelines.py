@@ -2,9 +2,29 @@ from pathlib import Path
 import glob
 import re
 from pipelines import parsers
-
-
-class NextflowGermlineEnrichment:
+from pipelines.base_pipeline import BasePipeline
+from pipelines.registry import register_pipeline, metric_step
+
+
+@register_pipeline
+class NextflowGermlineEnrichment(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['nextflow']
+	config_keys = []
+	sample_checks = False
+	run_includes_samples = False
+	metric_steps = [
+		metric_step('get_fastqc_data', 'add_fastqc_data'),
+		metric_step('get_hs_metrics', 'add_hs_metrics'),
+		metric_step('get_duplication_metrics', 'add_duplication_metrics'),
+		metric_step('get_contamination', 'add_contamination_metrics'),
+		metric_step('get_alignment_metrics', 'add_alignment_metrics'),
+		metric_step('get_variant_calling_metrics', 'add_variant_calling_metrics'),
+		metric_step('get_insert_metrics', 'add_insert_metrics'),
+		metric_step('get_coverage_metrics', 'add_custom_coverage_metrics'),
+		metric_step('get_sex_metrics', 'add_sex_metrics', ['sex']),
+	]
 
 	def __init__(self,
 				 results_dir,
@@ -25,7 +45,7 @@ class NextflowGermlineEnrichment:
 
 		results_path = Path(self.results_dir)
 		
-		marker = results_path.glob(self.run_complete_marker)
+		marker = self.glob(results_path, self.run_complete_marker)
 
 		if len(list(marker)) == 1:
 
@@ -46,17 +66,15 @@ class NextflowGermlineEnrichment:
 
 			results_path = Path(self.results_dir)
 		
-			marker = results_path.glob(self.run_complete_marker)
+			marker = self.glob(results_path, self.run_complete_marker)
 
 			marker = list(marker)[0]
 
 			# last line in file
 			last_report = ''
 
-			with open(marker, 'r') as outfile:
-
-				for x in outfile:
-					last_report = x.strip()
+			for x in self.read_lines(marker):
+				last_report = x.strip()
 
 			if 'success' in last_report:
 
@@ -73,7 +91,7 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.glob(f'post_processing/results/fastqc/*{sample}*/summary.txt')
+			fastqc_data_files = self.glob(results_path, f'post_processing/results/fastqc/*{sample}*/summary.txt')
 
 			sample_fastqc_list = []
 
@@ -84,7 +102,7 @@ class NextflowGermlineEnrichment:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file(fastqc_data)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file, fastqc_data)
 
 				file_fastqc_dict = {} 
 				file_fastqc_dict['lane'] = lane
@@ -120,11 +138,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			hs_metrics_file = results_path.glob(f'post_processing/results/metrics/*{sample}_hs_metrics.txt')
+			hs_metrics_file = self.glob(results_path, f'post_processing/results/metrics/*{sample}_hs_metrics.txt')
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
 
 			run_hs_metrics_dict[sample] = parsed_hs_metrics_data
 
@@ -139,11 +157,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_duplication_metrics_file = results_path.glob(f'post_processing/results/metrics/*{sample}_markduplicate_metrics.txt')
+			sample_duplication_metrics_file = self.glob(results_path, f'post_processing/results/metrics/*{sample}_markduplicate_metrics.txt')
 
 			sample_duplication_metrics_file = list(sample_duplication_metrics_file)[0]	
 
-			parsed_duplication_metrics = parsers.parse_duplication_metrics_file(sample_duplication_metrics_file)
+			parsed_duplication_metrics = self.parse(parsers.parse_duplication_metrics_file, sample_duplication_metrics_file)
 
 			run_duplication_metrics_dict[sample] = parsed_duplication_metrics
 
@@ -158,11 +176,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			alignment_metrics_file = results_path.glob(f'post_processing/results/metrics/*{sample}_alignment_summary_metrics.txt')
+			alignment_metrics_file = self.glob(results_path, f'post_processing/results/metrics/*{sample}_alignment_summary_metrics.txt')
 
 			alignment_metrics_file = list(alignment_metrics_file)[0]
 
-			parsed_alignment_metrics_file = parsers.parse_alignment_metrics_file(alignment_metrics_file)
+			parsed_alignment_metrics_file = self.parse(parsers.parse_alignment_metrics_file, alignment_metrics_file)
 
 			alignment_metrics_dict[sample] = parsed_alignment_metrics_file
 
@@ -175,11 +193,11 @@ class NextflowGermlineEnrichment:
 
 		variant_metrics_dict = {}
 
-		variant_detail_metrics_file = results_path.glob(f'post_processing/results/metrics/*.variant_calling_detail_metrics')
+		variant_detail_metrics_file = self.glob(results_path, f'post_processing/results/metrics/*.variant_calling_detail_metrics')
 
 		variant_detail_metrics_file = list(variant_detail_metrics_file)[0]
 
-		variant_metrics_dict = parsers.parse_variant_detail_metrics_file(variant_detail_metrics_file)
+		variant_metrics_dict = self.parse(parsers.parse_variant_detail_metrics_file, variant_detail_metrics_file)
 
 		return variant_metrics_dict
 
@@ -192,11 +210,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			insert_metrics_file = results_path.glob(f'post_processing/results/metrics/*{sample}_insert_metrics.txt')
+			insert_metrics_file = self.glob(results_path, f'post_processing/results/metrics/*{sample}_insert_metrics.txt')
 
 			insert_metrics_file = list(insert_metrics_file)[0]
 
-			parsed_insert_metrics_file = parsers.parse_insert_metrics_file(insert_metrics_file)
+			parsed_insert_metrics_file = self.parse(parsers.parse_insert_metrics_file, insert_metrics_file)
 
 			insert_metrics_dict[sample] = parsed_insert_metrics_file
 
@@ -211,11 +229,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_contamination_metrics_file = results_path.glob(f'post_processing/results/contamination/*{sample}_contamination.selfSM')
+			sample_contamination_metrics_file = self.glob(results_path, f'post_processing/results/contamination/*{sample}_contamination.selfSM')
 
 			sample_contamination_metrics_file = list(sample_contamination_metrics_file)[0]	
 
-			parsed_contamination_metrics = parsers.parse_contamination_metrics(sample_contamination_metrics_file)
+			parsed_contamination_metrics = self.parse(parsers.parse_contamination_metrics, sample_contamination_metrics_file)
 
 			run_contamination_metrics_dict[sample] = parsed_contamination_metrics
 
@@ -230,11 +248,11 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_coverage_metrics_file = results_path.glob(f'post_processing/results/coverage/*{sample}.depth_summary')
+			sample_coverage_metrics_file = self.glob(results_path, f'post_processing/results/coverage/*{sample}.depth_summary')
 
 			sample_coverage_metrics_file = list(sample_coverage_metrics_file)[0]	
 
-			parsed_coverage_metrics = parsers.parse_custom_coverage_metrics(sample_coverage_metrics_file)
+			parsed_coverage_metrics = self.parse(parsers.parse_custom_coverage_metrics, sample_coverage_metrics_file)
 
 			run_coverage_metrics_dict[sample] = parsed_coverage_metrics
 
@@ -249,13 +267,13 @@ class NextflowGermlineEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_sex_metrics_file = results_path.glob(f'post_processing/results/sex/*{sample}_calculated_sex.txt')
+			sample_sex_metrics_file = self.glob(results_path, f'post_processing/results/sex/*{sample}_calculated_sex.txt')
 
 			try:
 
 				sample_sex_metrics_file = list(sample_sex_metrics_file)[0]
 
-				parsed_sex_metrics = parsers.parse_dragen_sex_file(sample_sex_metrics_file)
+				parsed_sex_metrics = self.parse(parsers.parse_dragen_sex_file, sample_sex_metrics_file)
 
 				run_sex_metrics_dict[sample] = parsed_sex_metrics
 
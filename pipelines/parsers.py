@@ -9,6 +9,11 @@ import math
 import pandas as pd
 from pysam import VariantFile
 import string
+from concurrent.futures import ProcessPoolExecutor
+
+
+# bump when a parser's output changes so cached results in pipelines.metrics_cache aren't used
+PARSER_VERSION = 1
 
 
 def sample_sheet_parser(sample_sheet_path):
@@ -197,68 +202,235 @@ def extract_data_from_run_info_dict(run_info_dict):
 
 	return runinfo_sorted_dict
 
-def parse_interop_data(run_folder_dir, num_reads, num_lanes):
-	"""
-	Parses summary statistics out of interops data using the Illumina interops package
+INTEROP_CACHE_NAME = '.qc_database_interop_cache.json'
+
+# bump this if the tables read from the interop files change
+INTEROP_CACHE_VERSION = 1
+
+INTEROP_READ_COLUMNS = ['read_number',
+						'lane_number',
+						'percent_q30',
+						'density',
+						'density_pf',
+						'cluster_count',
+						'cluster_count_pf',
+						'error_rate',
+						'percent_aligned',
+						'percent_pf',
+						'phasing',
+						'prephasing',
+						'reads',
+						'reads_pf',
+						'yield_g']
+
+INTEROP_INDEX_COLUMNS = ['lane_number', 'sample_id', 'cluster_count', 'total_pf_reads']
+
+
+def read_interop_tables(run_folder_dir, num_reads, num_lanes):
 	"""
+	Read the binary interop files using the Illumina interops package.
 
-	# make empty dict to store output
-	interop_dict = {'read_summaries': {}}
+	The summary and index metrics are loaded together in a single read and each \
+	read/lane summary cell is only looked up once.
 
+	Returns a read/lane summary table and an index (lane/sample) table as DataFrames.
+
+	"""
 
-	# taken from illumina interops package documentation, all of this is required, 
-	# even though only the summary variable is used further on
+	# taken from illumina interops package documentation
 	run_metrics = py_interop_run_metrics.run_metrics()
 	valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
 	py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load)
-	run_folder = run_metrics.read(run_folder_dir, valid_to_load)
+	py_interop_run_metrics.list_index_metrics_to_load(valid_to_load)
+	run_metrics.read(run_folder_dir, valid_to_load)
+
 	summary = py_interop_summary.run_summary()
 	py_interop_summary.summarize_run_metrics(run_metrics, summary)
 
+	read_rows = []
 
 	for read in range(num_reads):
 
-		new_read = read + 1
+		read_summary = summary.at(read)
 
-		if new_read not in interop_dict['read_summaries']:
+		for lane in range(num_lanes):
 
-			interop_dict['read_summaries'][new_read] = {}
+			cell = read_summary.at(lane)
 
+			density_pf = cell.density_pf().mean()
 
-		for lane in range(num_lanes):
+			read_rows.append([read + 1,
+							lane + 1,
+							cell.percent_gt_q30(),
+							cell.density().mean(),
+							density_pf,
+							density_pf, # cluster_count has always been filled with the density_pf mean
+							cell.cluster_count_pf().mean(),
+							cell.error_rate().mean(),
+							cell.percent_aligned().mean(),
+							cell.percent_pf().mean(),
+							cell.phasing().mean(),
+							cell.prephasing().mean(),
+							cell.reads(),
+							cell.reads_pf(),
+							cell.yield_g()])
 
-			new_lane = lane + 1
+	index_summary = py_interop_summary.index_flowcell_summary()
+	py_interop_summary.summarize_index_metrics(run_metrics, index_summary)
 
-			if new_lane not in interop_dict['read_summaries'][new_read]:
+	index_rows = []
 
-				interop_dict['read_summaries'][new_read][new_lane] = {}
+	for lane in range(index_summary.size()):
 
-			interop_dict['read_summaries'][read+1][lane+1]['percent_q30'] = summary.at(read).at(lane).percent_gt_q30()
-			interop_dict['read_summaries'][read+1][lane+1]['density'] = summary.at(read).at(lane).density().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['density_pf'] = summary.at(read).at(lane).density_pf().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['cluster_count'] = summary.at(read).at(lane).density_pf().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['cluster_count_pf'] = summary.at(read).at(lane).cluster_count_pf().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['error_rate'] = summary.at(read).at(lane).error_rate().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['percent_aligned'] = summary.at(read).at(lane).percent_aligned().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['percent_pf'] = summary.at(read).at(lane).percent_pf().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['phasing'] = summary.at(read).at(lane).phasing().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['prephasing'] = summary.at(read).at(lane).prephasing().mean()
-			interop_dict['read_summaries'][read+1][lane+1]['reads'] = summary.at(read).at(lane).reads()
-			interop_dict['read_summaries'][read+1][lane+1]['reads_pf'] = summary.at(read).at(lane).reads_pf()
-			interop_dict['read_summaries'][read+1][lane+1]['yield_g'] = summary.at(read).at(lane).yield_g()
+		lane_summary = index_summary.at(lane)
 
-			for key in interop_dict['read_summaries'][read+1][lane+1]:
+		for count in range(lane_summary.size()):
 
-				if math.isnan(interop_dict['read_summaries'][read+1][lane+1][key]):
+			count_summary = lane_summary.at(count)
 
-					interop_dict['read_summaries'][read+1][lane+1][key] = None
+			index_rows.append([lane + 1,
+							count_summary.sample_id(),
+							count_summary.cluster_count(),
+							lane_summary.total_pf_reads()])
 
+	read_table = pd.DataFrame(read_rows, columns=INTEROP_READ_COLUMNS)
+	index_table = pd.DataFrame(index_rows, columns=INTEROP_INDEX_COLUMNS)
 
-	run_metrics = py_interop_run_metrics.run_metrics()
-	valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
-	py_interop_run_metrics.list_index_metrics_to_load(valid_to_load)
-	run_folder = run_metrics.read(run_folder_dir, valid_to_load)
+	return read_table, index_table
+
+
+def get_interop_file_mtimes(run_folder_dir):
+
+	mtimes = {}
+
+	try:
+
+		with os.scandir(os.path.join(run_folder_dir, 'InterOp')) as entries:
+
+			for entry in entries:
+
+				if entry.name.endswith('.bin'):
+
+					mtimes[entry.name] = entry.stat().st_mtime
+
+	except FileNotFoundError:
+
+		pass
+
+	return mtimes
+
+
+def load_interop_tables(run_folder_dir, num_reads, num_lanes):
+	"""
+	Get the interop tables for a run, using the cache file in the run folder if \
+	the interop files have not changed since it was written.
+
+	"""
+
+	cache_key = {
+		'version': INTEROP_CACHE_VERSION,
+		'num_reads': num_reads,
+		'num_lanes': num_lanes,
+		'mtimes': get_interop_file_mtimes(run_folder_dir)
+	}
+
+	cache_path = os.path.join(run_folder_dir, INTEROP_CACHE_NAME)
+
+	try:
+
+		with open(cache_path) as cache_file:
+
+			cache = json.load(cache_file)
+
+		if cache['key'] == cache_key:
+
+			read_table = pd.DataFrame(cache['read_table'], columns=INTEROP_READ_COLUMNS)
+			index_table = pd.DataFrame(cache['index_table'], columns=INTEROP_INDEX_COLUMNS)
+
+			return read_table, index_table
+
+	except (OSError, ValueError, KeyError, TypeError):
+
+		pass
+
+	read_table, index_table = read_interop_tables(run_folder_dir, num_reads, num_lanes)
+
+	cache = {
+		'key': cache_key,
+		'read_table': read_table.values.tolist(),
+		'index_table': index_table.values.tolist()
+	}
+
+	# the archive may be read only - just read the interops again next time
+	try:
+
+		temp_path = cache_path + '.tmp'
+
+		with open(temp_path, 'w') as cache_file:
+
+			json.dump(cache, cache_file)
+
+		os.replace(temp_path, cache_path)
 
+	except OSError:
+
+		pass
+
+	return read_table, index_table
+
+
+def get_index_summaries(index_table):
+	"""
+	Percentage of the PF reads on the flowcell identified as each sample.
+
+	"""
+
+	index_summaries = {}
+
+	if len(index_table) == 0:
+
+		return index_summaries
+
+	total_pf_reads = index_table.groupby('lane_number')['total_pf_reads'].first().sum()
+
+	if total_pf_reads == 0:
+
+		return index_summaries
+
+	sample_cluster_counts = index_table.groupby('sample_id')['cluster_count'].sum()
+
+	for sample_id, pct_reads_identified in (sample_cluster_counts / total_pf_reads * 100).items():
+
+		index_summaries[sample_id] = float(pct_reads_identified)
+
+	return index_summaries
+
+
+def parse_interop_data(run_folder_dir, num_reads, num_lanes):
+	"""
+	Parses summary statistics out of interops data using the Illumina interops package
+	"""
+
+	read_table, index_table = load_interop_tables(run_folder_dir, num_reads, num_lanes)
+
+	interop_dict = {'read_summaries': {}, 'index_summaries': get_index_summaries(index_table)}
+
+	for row in read_table.to_dict(orient='records'):
+
+		read = int(row.pop('read_number'))
+		lane = int(row.pop('lane_number'))
+
+		for key in row:
+
+			if math.isnan(row[key]):
+
+				row[key] = None
+
+		if read not in interop_dict['read_summaries']:
+
+			interop_dict['read_summaries'][read] = {}
+
+		interop_dict['read_summaries'][read][lane] = row
 
 	return interop_dict
 
@@ -314,44 +486,125 @@ def parse_fastqc_file_cruk(fastqc_text_file, run_id):
 
 		return fqcdict
 
-def parse_hs_metrics_file(hs_metrics_file):
+def convert_metric_value(value):
+	"""
+	Convert a value from a metrics file to an int or float - '?' and '' become None.
 
-	hs_metrics_dict = {}
+	Anything which is not a number is returned unchanged.
 
-	with open (hs_metrics_file) as file:
+	"""
 
-		hs_metrics_file = csv.reader(file, delimiter='\t')
+	if value == '?' or value == '':
 
-		next_keys = False
-		next_values = False
+		return None
 
-		keys = []
-		values = []
+	try:
 
-		for row in hs_metrics_file:
+		return int(value)
 
-			if len(row) != 0:
+	except ValueError:
 
-				if next_values == True:
+		pass
 
-					values = row
-					break
+	try:
 
-				if next_keys == True:
+		return float(value)
 
-					keys = row
-					next_keys = False
-					next_values = True
+	except ValueError:
 
-				if row[0] == '## METRICS CLASS':
+		return value
 
-					next_keys = True
 
-	for key, value in zip(keys, values):
+def read_picard_metrics(metrics_file, max_rows=None, exclude=(), string_columns=()):
+	"""
+	Read the ## METRICS CLASS section of a Picard/GATK metrics file.
+
+	The file is streamed and reading stops as soon as the section has been consumed - \
+	either max_rows value rows have been read or a blank or # line ends the section \
+	so histograms further down the file are never read.
+
+	Returns a list of dictionaries, one per value row, with lower case keys and values \
+	converted by convert_metric_value. Columns in exclude are dropped and columns in \
+	string_columns are left as they are in the file.
+
+	"""
+
+	rows = []
+
+	keys = None
+
+	with open(metrics_file) as file:
+
+		in_section = False
+
+		for line in file:
+
+			line = line.rstrip('\r\n')
+
+			if in_section == False:
+
+				if line.split('\t')[0] == '## METRICS CLASS':
+
+					in_section = True
 
-		hs_metrics_dict[key.lower()] = value
+				continue
+
+			if keys == None:
+
+				# header is the first non empty line after the metrics class
+				if line != '':
+
+					keys = [key.lower() for key in line.split('\t')]
+
+				continue
+
+			if line == '' or line.startswith('#'):
+
+				break
+
+			row_dict = {}
+
+			for key, value in zip(keys, line.split('\t')):
+
+				if key in exclude:
+
+					continue
+
+				if key in string_columns:
+
+					row_dict[key] = value
+
+				else:
+
+					row_dict[key] = convert_metric_value(value)
+
+			rows.append(row_dict)
+
+			if max_rows != None and len(rows) >= max_rows:
+
+				break
+
+	return rows
+
+
+def read_picard_metrics_row(metrics_file, exclude=()):
+	"""
+	Read the first row of the metrics section - an empty dictionary if there isn't one.
+
+	"""
+
+	rows = read_picard_metrics(metrics_file, max_rows=1, exclude=exclude)
 
-	return hs_metrics_dict
+	if len(rows) == 0:
+
+		return {}
+
+	return rows[0]
+
+
+def parse_hs_metrics_file(hs_metrics_file):
+
+	return read_picard_metrics_row(hs_metrics_file)
 
 
 def parse_gatk_depth_summary_file(gatk_depth_summary_file):
@@ -390,42 +643,7 @@ def parse_gatk_depth_summary_file(gatk_depth_summary_file):
 
 def parse_duplication_metrics_file(duplication_metrics_file):
 
-	duplication_metrics_dict = {}
-
-	with open (duplication_metrics_file) as file:
-
-		duplication_metrics_file = csv.reader(file, delimiter='\t')
-
-		next_keys = False
-		next_values = False
-
-		keys = []
-		values = []
-
-		for row in duplication_metrics_file:
-
-			if len(row) != 0:
-
-				if next_values == True:
-
-					values = row
-					break
-
-				if next_keys == True:
-
-					keys = row
-					next_keys = False
-					next_values = True
-
-				if row[0] == '## METRICS CLASS':
-
-					next_keys = True
-
-	for key, value in zip(keys, values):
-
-		duplication_metrics_dict[key.lower()] = value
-
-	return duplication_metrics_dict
+	return read_picard_metrics_row(duplication_metrics_file)
 
 
 def parse_contamination_metrics(self_sm_contamination_file):
@@ -509,190 +727,126 @@ def parse_qc_metrics_file(qc_metrics_file):
 
 def parse_alignment_metrics_file(alignments_metric_file):
 
-	alignment_metrics_dicts = []
-
-	with open (alignments_metric_file) as file:
-
-		alignments_metric_file = csv.reader(file, delimiter='\t')
-
-		next_keys = False
-		next_values = False
-
-		keys = []
-		values = []
-
-		for row in alignments_metric_file:
-
-			if len(row) != 0:
-
-				if next_values == True:
-
-					row_dict = {}
-
-					values = row
-
-					for key, value in zip(keys, values):
-
-						if key.lower() not in ['read_group',  'sample', 'library']:
-
-							row_dict[key.lower()] = value
-
-					alignment_metrics_dicts.append(row_dict)
-
-				if next_keys == True:
-
-					keys = row
-					next_keys = False
-					next_values = True
-
-				if row[0] == '## METRICS CLASS':
-
-					next_keys = True
-
-	return alignment_metrics_dicts
+	return read_picard_metrics(alignments_metric_file, exclude=['read_group', 'sample', 'library'])
 	
 def parse_variant_detail_metrics_file(variant_detail_metrics_file):
 
 	variant_detail_metrics_dict = {}
 
-	with open (variant_detail_metrics_file) as file:
-
-		variant_detail_metrics_file = csv.reader(file, delimiter='\t')
-
-		next_keys = False
-		next_values = False
-
-		keys = []
-		values = []
-
-		for row in variant_detail_metrics_file:
+	for row in read_picard_metrics(variant_detail_metrics_file, string_columns=['sample_alias']):
 
-			if len(row) != 0:
+		variant_detail_metrics_dict[row.pop('sample_alias')] = row
 
-				if next_values == True:
+	return variant_detail_metrics_dict
 
-					sample_details_dict = {}
 
-					for key, value in zip(keys, row):
+def parse_insert_metrics_file(insert_metrics_file):
 
-						if key.lower() not in ['sample_alias']:
+	return read_picard_metrics_row(insert_metrics_file, exclude=['read_group', 'sample', 'library'])
 
-							sample_details_dict[key.lower()] = value
-					
-					variant_detail_metrics_dict[row[0]] = sample_details_dict
+def parse_config(config_location):
+	"""
+	Parse the YAML config file.
+	"""
+	with open(config_location, 'r') as stream:
+		return yaml.safe_load(stream)
 
-				if next_keys == True:
+def _count_passing_variants(vcf_path, samples, contig=None):
+	"""
+	Count the PASS records where each sample has a non reference allele.
 
-					keys = row
-					next_keys = False
-					next_values = True
+	Only the requested samples are decoded and records which do not PASS are \
+	skipped before any genotypes are looked at.
 
-				if row[0] == '## METRICS CLASS':
+	"""
 
-					next_keys = True
+	count_dict = {sample: 0 for sample in samples}
 
-	return variant_detail_metrics_dict
+	with VariantFile(str(vcf_path)) as bcf_in:
 
+		bcf_in.subset_samples(samples)
 
-def parse_insert_metrics_file(insert_metrics_file):
+		if contig == None:
 
-	insert_metrics_dict = {}
+			records = bcf_in.fetch()
 
-	with open (insert_metrics_file) as file:
+		else:
 
-		insert_metrics_file = csv.reader(file, delimiter='\t')
+			records = bcf_in.fetch(contig)
 
-		next_keys = False
-		next_values = False
+		for rec in records:
 
-		keys = []
-		values = []
+			if 'PASS' not in rec.filter:
 
-		for row in insert_metrics_file:
+				continue
 
-			if len(row) != 0:
+			for sample in samples:
 
-				if next_values == True:
+				for allele in rec.samples[sample]['GT']:
 
-					values = row
-					break
+					if allele != None and allele != 0:
 
-				if next_keys == True:
+						count_dict[sample] = count_dict[sample] + 1
+						break
 
-					keys = row
-					next_keys = False
-					next_values = True
+	return count_dict
 
-				if row[0] == '## METRICS CLASS':
 
-					next_keys = True
+def _count_passing_variants_in_contig(args):
 
-	for key, value in zip(keys, values):
+	return _count_passing_variants(*args)
 
-		if key.lower() not in ['read_group',  'sample', 'library']:
 
-			insert_metrics_dict[key.lower()] = value
+def count_passing_variants(vcf_path, samples, workers=1):
+	"""
+	Count passing variants for all the samples in a single pass of the vcf.
 
-	return insert_metrics_dict
+	If the vcf has a tabix/csi index and workers > 1 the contigs are counted in parallel.
 
-def parse_config(config_location):
 	"""
-	Parse the YAML config file.
-	"""
-	with open(config_location, 'r') as stream:
-		return yaml.safe_load(stream)
 
-def get_passing_variant_count(vcf_path, samples):
-	"""
-	count number of passing variants in vcf
+	samples = list(samples)
 
-	"""
-	
-	bcf_in = VariantFile(vcf_path)
+	if workers > 1:
 
-	count_dict = {}
+		with VariantFile(str(vcf_path)) as bcf_in:
 
-	for rec in bcf_in.fetch():
+			contigs = list(bcf_in.index.keys()) if bcf_in.index != None else []
 
-		chrom = rec.chrom
-		pos = rec.pos
-		ref = rec.ref
-		alt = rec.alts
-		filter_status = rec.filter.keys()
-		info = rec.info
-		quality = rec.qual
+		if len(contigs) > 1:
 
-		for sample in samples:
+			count_dict = {sample: 0 for sample in samples}
 
-			sample_genotype_data = rec.samples[sample]
+			with ProcessPoolExecutor(max_workers=workers) as executor:
 
-			gt_list = []
+				jobs = [(vcf_path, samples, contig) for contig in contigs]
 
-			for allele in sample_genotype_data['GT']:
+				for contig_count_dict in executor.map(_count_passing_variants_in_contig, jobs):
 
-				if allele == None or allele == 0:
+					for sample in samples:
 
-					pass
+						count_dict[sample] = count_dict[sample] + contig_count_dict[sample]
 
-				else:
+			return count_dict
 
-					gt_list.append(allele)
+	return _count_passing_variants(vcf_path, samples)
 
-			if 'PASS' in filter_status and len(gt_list) > 0:
 
-				if sample not in count_dict:
+def get_passing_variant_count(vcf_path, samples, workers=1):
+	"""
+	count number of passing variants in vcf
 
-					count_dict[sample] = 0
+	The first passing variant for each sample has never been counted so the \
+	count is one less than the number of passing variants (and 0 when there are none).
+	Existing runs have been QC'd against these numbers so this is kept.
 
-				else:
+	"""
 
-					count_dict[sample] = count_dict[sample] + 1
-	
-	if len(count_dict) == 0:
+	count_dict = count_passing_variants(vcf_path, samples, workers)
 
-		for sample in samples:
+	for sample in count_dict:
 
-			count_dict[sample] = 0
+		count_dict[sample] = max(count_dict[sample] - 1, 0)
 
 	return count_dict
 
@@ -0,0 +1,117 @@
+"""
+Listing the directories a run analysis check will look at all at once.
+
+The validators loop over the samples one after another and every directory \
+listing or stat they make is a round trip to the file server, so on a slow \
+mount a run check takes samples x directories x round trip. prefetch makes \
+those listings and stats concurrently with asyncio, at most concurrency at a \
+time, and puts the results in the SnapshotCache the validators use so they then \
+run against memory.
+
+Each request is a directory and a list of patterns for the entries in it to stat. \
+Listings and stats go through the snapshot cache's mount guard.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import fnmatch
+
+from pipelines.directory_snapshot import DirectorySnapshot
+from pipelines.mount_guard import MountUnavailable
+
+# listings and stats in flight at once
+DEFAULT_CONCURRENCY = 32
+
+
+def raise_first_error(results):
+	"""
+	Everything is gathered with return_exceptions so no task is left running when one fails.
+	"""
+
+	for result in results:
+
+		if isinstance(result, BaseException):
+
+			raise result
+
+
+async def fetch_stat(loop, executor, semaphore, snapshot_cache, snapshot, name):
+
+	async with semaphore:
+
+		try:
+
+			await loop.run_in_executor(executor, snapshot_cache.probe, snapshot.path.joinpath(name), snapshot.stat, name)
+
+		except MountUnavailable:
+
+			raise
+
+		except OSError:
+
+			# left for the validators to find
+			pass
+
+
+async def fetch_directory(loop, executor, semaphore, snapshot_cache, directory, stat_patterns):
+
+	async with semaphore:
+
+		snapshot = await loop.run_in_executor(executor, snapshot_cache.probe, directory, DirectorySnapshot, directory)
+
+	snapshot_cache.add(directory, snapshot)
+
+	names = [name for name in snapshot.names() if any(fnmatch.fnmatchcase(name, pattern) for pattern in stat_patterns)]
+
+	# stats start as soon as their directory is listed rather than after every listing
+	raise_first_error(await asyncio.gather(*[fetch_stat(loop, executor, semaphore, snapshot_cache, snapshot, name) for name in names], return_exceptions=True))
+
+
+async def fetch_all(snapshot_cache, requests, concurrency):
+
+	loop = asyncio.get_event_loop()
+
+	# made here so it belongs to the running loop
+	semaphore = asyncio.Semaphore(concurrency)
+
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+		results = await asyncio.gather(*[fetch_directory(loop, executor, semaphore, snapshot_cache, directory, stat_patterns) for directory, stat_patterns in requests], return_exceptions=True)
+
+	raise_first_error(results)
+
+
+def prefetch(snapshot_cache, requests, concurrency=DEFAULT_CONCURRENCY):
+	"""
+	List the directories in requests and stat their entries matching the patterns concurrently.
+
+	requests is a list of (directory, stat_patterns). Directories already in the \
+	snapshot cache aren't listed again. Raises MountUnavailable if a mount stops responding.
+
+	"""
+
+	merged = {}
+
+	for directory, stat_patterns in requests:
+
+		if snapshot_cache.has_snapshot(directory):
+
+			continue
+
+		merged.setdefault(str(directory), (directory, set()))[1].update(stat_patterns)
+
+	if len(merged) == 0:
+
+		return
+
+	# a loop of our own as this can be called from worker threads and processes
+	loop = asyncio.new_event_loop()
+
+	try:
+
+		loop.run_until_complete(fetch_all(snapshot_cache, list(merged.values()), concurrency))
+
+	finally:
+
+		loop.close()
@@ -2,8 +2,12 @@ from pathlib import Path
 import glob
 import re
 from pipelines import parsers
+from pipelines.base_pipeline import BasePipeline
 
-class IlluminaQC:
+class IlluminaQC(BasePipeline):
+
+	# fastq sizes are checked against min_fastq_size
+	prefetch_stat_patterns = ['*.fastq.gz']
 
 	def __init__(self,
 				fastq_dir,
@@ -13,7 +17,8 @@ class IlluminaQC:
 				analysis_type,
 				min_fastq_size=1000000,
 				ntc_patterns = ['NTC', 'ntc'],
-				run_complete_marker = '1_IlluminaQC.sh.e*'):
+				run_complete_marker = '1_IlluminaQC.sh.e*',
+				strict_validation = False):
 
 		self.fastq_dir = fastq_dir
 		self.sample_names = sample_names
@@ -23,12 +28,17 @@ class IlluminaQC:
 		self.run_complete_marker = run_complete_marker
 		self.min_fastq_size = min_fastq_size
 		self.ntc_patterns = ntc_patterns
+		self.strict_validation = strict_validation
+
+	def get_sample_dirs(self, sample):
+
+		return [Path(self.fastq_dir).joinpath('Data', sample)]
 
 	def demultiplex_run_is_complete(self):
 
 		results_path = Path(self.fastq_dir)
 
-		marker = results_path.glob(self.run_complete_marker)
+		marker = self.glob(results_path, self.run_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -40,6 +50,9 @@ class IlluminaQC:
 
 		fastq_data_path = Path(self.fastq_dir)
 
+		# checked together at the end in strict mode
+		fastqs = []
+
 		fastq_data_path = fastq_data_path.joinpath('Data')
 
 		for sample in self.sample_names:
@@ -58,32 +71,34 @@ class IlluminaQC:
 			# check fastqs created
 			for lane in range(1,self.n_lanes+1):
 
-				fastq_r1 = sample_fastq_path.glob(f'{sample}*L00{lane}_R1_001.fastq.gz')
-				fastq_r2 = sample_fastq_path.glob(f'{sample}*L00{lane}_R2_001.fastq.gz')
-				variables = sample_fastq_path.glob(f'{sample}.variables')
+				fastq_r1 = self.glob(sample_fastq_path, f'{sample}*L00{lane}_R1_001.fastq.gz')
+				fastq_r2 = self.glob(sample_fastq_path, f'{sample}*L00{lane}_R2_001.fastq.gz')
+				variables = self.glob(sample_fastq_path, f'{sample}.variables')
 
-				if len(list(fastq_r1)) != 1:
+				if len(fastq_r1) != 1:
 
 					return False
 
-				elif len(list(fastq_r2)) != 1:
+				elif len(fastq_r2) != 1:
 					return False
 
-				elif len(list(variables)) != 1:
+				elif len(variables) != 1:
 					return False
 
-				fastq_r1 = sample_fastq_path.glob(f'{sample}*L00{lane}_R1_001.fastq.gz')
-				fastq_r2 = sample_fastq_path.glob(f'{sample}*L00{lane}_R2_001.fastq.gz')
-				
-				fastq_r1 = list(fastq_r1)[0]
-				fastq_r2 = list(fastq_r2)[0]
+				fastq_r1 = fastq_r1[0]
+				fastq_r2 = fastq_r2[0]
 
-				if fastq_r1.stat().st_size < self.min_fastq_size and is_negative_control == False:
+				if self.stat(fastq_r1).st_size < self.min_fastq_size and is_negative_control == False:
 					return False
 
-				elif fastq_r2.stat().st_size < self.min_fastq_size  and is_negative_control == False:
+				elif self.stat(fastq_r2).st_size < self.min_fastq_size  and is_negative_control == False:
 					return False
 
+				fastqs.extend([fastq_r1, fastq_r2])
+
+		if self.strict_validation == True:
+
+			return self.files_are_intact(fastqs)
 
 		return True
 
@@ -92,6 +107,10 @@ class IlluminaQC:
 
 class DragenQC(IlluminaQC):
 
+	def get_sample_dirs(self, sample):
+
+		return [Path(self.fastq_dir).joinpath('Data', self.analysis_type, sample)]
+
 	def demultiplex_run_is_complete(self):
 
 		if self.demultiplex_run_is_valid() == True:
@@ -107,6 +126,9 @@ class DragenQC(IlluminaQC):
 
 		fastq_data_path = Path(self.fastq_dir)
 
+		# checked together at the end in strict mode
+		fastqs = []
+
 		fastq_data_path = fastq_data_path.joinpath('Data', self.analysis_type)
 
 		for sample in self.sample_names:
@@ -125,31 +147,33 @@ class DragenQC(IlluminaQC):
 			# check fastqs created
 			for lane in range(1,self.n_lanes+1):
 
-				fastq_r1 = sample_fastq_path.glob(f'{sample}*L00{lane}_R1_001.fastq.gz')
-				fastq_r2 = sample_fastq_path.glob(f'{sample}*L00{lane}_R2_001.fastq.gz')
-				variables = sample_fastq_path.glob(f'{sample}.variables')
+				fastq_r1 = self.glob(sample_fastq_path, f'{sample}*L00{lane}_R1_001.fastq.gz')
+				fastq_r2 = self.glob(sample_fastq_path, f'{sample}*L00{lane}_R2_001.fastq.gz')
+				variables = self.glob(sample_fastq_path, f'{sample}.variables')
 
-				if len(list(fastq_r1)) != 1:
+				if len(fastq_r1) != 1:
 
 					return False
 
-				elif len(list(fastq_r2)) != 1:
+				elif len(fastq_r2) != 1:
 					return False
 
-				elif len(list(variables)) != 1:
+				elif len(variables) != 1:
 					return False
 
-				fastq_r1 = sample_fastq_path.glob(f'{sample}*L00{lane}_R1_001.fastq.gz')
-				fastq_r2 = sample_fastq_path.glob(f'{sample}*L00{lane}_R2_001.fastq.gz')
-				
-				fastq_r1 = list(fastq_r1)[0]
-				fastq_r2 = list(fastq_r2)[0]
+				fastq_r1 = fastq_r1[0]
+				fastq_r2 = fastq_r2[0]
 
-				if fastq_r1.stat().st_size < self.min_fastq_size and is_negative_control == False:
+				if self.stat(fastq_r1).st_size < self.min_fastq_size and is_negative_control == False:
 					return False
 
-				elif fastq_r2.stat().st_size < self.min_fastq_size  and is_negative_control == False:
+				elif self.stat(fastq_r2).st_size < self.min_fastq_size  and is_negative_control == False:
 					return False
 
+				fastqs.extend([fastq_r1, fastq_r2])
+
+		if self.strict_validation == True:
+
+			return self.files_are_intact(fastqs)
 
 		return True
\ No newline at end of file
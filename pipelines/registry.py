@@ -0,0 +1,51 @@
+"""
+The pipeline classes ingestion knows how to check.
+
+Each pipeline class declares how it is checked and which metrics to load with \
+class attributes and is added with @register_pipeline:
+
+pipeline_ids - the class handles any pipeline id containing one of these
+config_keys - config values passed to the constructor if they are all set
+sample_checks - whether to call sample_is_complete and sample_is_valid for each sample
+run_includes_samples - the run is only complete/valid once every sample is as well
+metric_steps - MetricStep(getter on the pipeline object, loader in management_utils, extra loader args, only load on first completion)
+ingest - set to False to recognise a pipeline but not check it
+
+"""
+
+from collections import namedtuple
+
+MetricStep = namedtuple('MetricStep', ['getter', 'loader', 'loader_args', 'first_completion_only'])
+
+PIPELINE_REGISTRY = []
+
+
+def metric_step(getter, loader, loader_args=(), first_completion_only=False):
+
+	return MetricStep(getter, loader, tuple(loader_args), first_completion_only)
+
+
+def register_pipeline(pipeline_class):
+
+	if pipeline_class not in PIPELINE_REGISTRY:
+
+		PIPELINE_REGISTRY.append(pipeline_class)
+
+	return pipeline_class
+
+
+def get_pipeline_class(pipeline_id):
+	"""
+	The registered pipeline class for a pipeline id e.g. GermlineEnrichment-2.5.3 or None.
+
+	"""
+
+	for pipeline_class in PIPELINE_REGISTRY:
+
+		for match in pipeline_class.pipeline_ids:
+
+			if match in pipeline_id:
+
+				return pipeline_class
+
+	return None
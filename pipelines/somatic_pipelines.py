@@ -3,9 +3,27 @@ import glob
 import re
 import os
 from pipelines import parsers
-
-class SomaticEnrichment:
-
+from pipelines.base_pipeline import BasePipeline
+from pipelines.registry import register_pipeline, metric_step
+
+@register_pipeline
+class SomaticEnrichment(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['SomaticEnrichment']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_sample_expected_files', 'run_expected_files', 'run_not_expected_files']
+	sample_checks = True
+	run_includes_samples = True
+	metric_steps = [
+		metric_step('get_fastqc_data', 'add_fastqc_data'),
+		metric_step('get_hs_metrics', 'add_hs_metrics'),
+		metric_step('get_depth_metrics', 'add_depth_of_coverage_metrics'),
+		metric_step('get_duplication_metrics', 'add_duplication_metrics'),
+		metric_step('get_calculated_sex', 'add_sex_metrics', ['gender']),
+		metric_step('get_alignment_metrics', 'add_alignment_metrics'),
+		metric_step('get_insert_metrics', 'add_insert_metrics'),
+		metric_step('get_variant_count', 'add_variant_count_metrics'),
+	]
 
 	def __init__(self,
 				results_dir,
@@ -52,7 +70,7 @@ class SomaticEnrichment:
 
 		sample_path = results_path.joinpath(sample)
 
-		marker = sample_path.glob(self.sample_complete_marker)
+		marker = self.glob(sample_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -76,7 +94,7 @@ class SomaticEnrichment:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -86,7 +104,7 @@ class SomaticEnrichment:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -107,12 +125,12 @@ class SomaticEnrichment:
 
 			
 			#get the total number of reads in the sample
-			hs_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_HsMetrics.txt')
+			hs_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_HsMetrics.txt')
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
-			total_reads = int(parsed_hs_metrics_data.get('total_reads'))
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
+			total_reads = parsed_hs_metrics_data.get('total_reads')
 	
 			#CNVKit will not run if number of reads is less than 2 million
 			if total_reads < 2000000:
@@ -133,7 +151,7 @@ class SomaticEnrichment:
 
 			for marker in self.run_complete_markers:
 
-				globbed_marker = results_path.joinpath(sample).glob(marker)
+				globbed_marker = self.glob(results_path.joinpath(sample), marker)
 
 		
 				if len(list(globbed_marker)) < 1:
@@ -158,13 +176,13 @@ class SomaticEnrichment:
 			skip_sample = False
 
 			#get the total number of reads in the sample
-			hs_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_HsMetrics.txt')
+			hs_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_HsMetrics.txt')
 
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
-			total_reads=int(parsed_hs_metrics_data.get('total_reads'))
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
+			total_reads = parsed_hs_metrics_data.get('total_reads')
 
 			#CNVKit will not run for the sample if number of reads is less than 2 million
 			if total_reads < 2000000:
@@ -185,7 +203,7 @@ class SomaticEnrichment:
 
 			for file in self.run_sample_expected_files:
 
-				found_file = results_path.joinpath(sample).glob(file)
+				found_file = self.glob(results_path.joinpath(sample), file)
 
 				if len(list(found_file)) != 1:
 
@@ -193,7 +211,7 @@ class SomaticEnrichment:
 
 		for file in self.run_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -202,7 +220,7 @@ class SomaticEnrichment:
 		# check file we do not want to be there are not there
 		for file in self.run_not_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -258,7 +276,7 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.joinpath(sample, 'FASTQC').glob(f'*{sample}*_fastqc.txt')
+			fastqc_data_files = self.glob(results_path.joinpath(sample, 'FASTQC'), f'*{sample}*_fastqc.txt')
 
 			sample_fastqc_list = []
 
@@ -268,7 +286,7 @@ class SomaticEnrichment:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file(fastqc_data)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file, fastqc_data)
 
 				file_fastqc_dict = {} 
 				file_fastqc_dict['lane'] = lane
@@ -303,11 +321,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			hs_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_HsMetrics.txt')
+			hs_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_HsMetrics.txt')
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
 
 			run_hs_metrics_dict[sample] = parsed_hs_metrics_data
 
@@ -321,11 +339,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_depth_summary_file = results_path.joinpath(sample).glob(f'*{sample}*_DepthOfCoverage.sample_summary')
+			sample_depth_summary_file = self.glob(results_path.joinpath(sample), f'*{sample}*_DepthOfCoverage.sample_summary')
 
 			sample_depth_summary_file = list(sample_depth_summary_file)[0]	
 
-			parsed_depth_metrics = parsers.parse_gatk_depth_summary_file(sample_depth_summary_file)
+			parsed_depth_metrics = self.parse(parsers.parse_gatk_depth_summary_file, sample_depth_summary_file)
 
 			run_depth_metrics_dict[sample] = parsed_depth_metrics
 
@@ -340,11 +358,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			sample_duplication_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_markDuplicatesMetrics.txt')
+			sample_duplication_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_markDuplicatesMetrics.txt')
 
 			sample_duplication_metrics_file = list(sample_duplication_metrics_file)[0]	
 
-			parsed_duplication_metrics = parsers.parse_duplication_metrics_file(sample_duplication_metrics_file)
+			parsed_duplication_metrics = self.parse(parsers.parse_duplication_metrics_file, sample_duplication_metrics_file)
 
 			run_duplication_metrics_dict[sample] = parsed_duplication_metrics
 
@@ -359,11 +377,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			qc_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_QC.txt')
+			qc_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_QC.txt')
 
 			qc_metrics_file = list(qc_metrics_file)[0]
 
-			parsed_qc_metrics_file = parsers.parse_qc_metrics_file(qc_metrics_file)
+			parsed_qc_metrics_file = self.parse(parsers.parse_qc_metrics_file, qc_metrics_file)
 
 			calculated_sex_dict[sample] = parsed_qc_metrics_file
 
@@ -378,11 +396,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			alignment_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_AlignmentSummaryMetrics.txt')
+			alignment_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_AlignmentSummaryMetrics.txt')
 
 			alignment_metrics_file = list(alignment_metrics_file)[0]
 
-			parsed_alignment_metrics_file = parsers.parse_alignment_metrics_file(alignment_metrics_file)
+			parsed_alignment_metrics_file = self.parse(parsers.parse_alignment_metrics_file, alignment_metrics_file)
 
 			alignment_metrics_dict[sample] = parsed_alignment_metrics_file
 
@@ -396,11 +414,11 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			insert_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_InsertMetrics.txt')
+			insert_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_InsertMetrics.txt')
 
 			insert_metrics_file = list(insert_metrics_file)[0]
 
-			parsed_insert_metrics_file = parsers.parse_insert_metrics_file(insert_metrics_file)
+			parsed_insert_metrics_file = self.parse(parsers.parse_insert_metrics_file, insert_metrics_file)
 
 			insert_metrics_dict[sample] = parsed_insert_metrics_file
 
@@ -414,18 +432,31 @@ class SomaticEnrichment:
 
 		for sample in self.sample_names:
 
-			vcf_file = results_path.joinpath(sample).glob(f'*{sample}*_filteredStrLeftAligned_annotated.vcf')
+			vcf_file = self.glob(results_path.joinpath(sample), f'*{sample}*_filteredStrLeftAligned_annotated.vcf')
 
 			vcf_file = list(vcf_file)[0]	
 
-			vcf_count_metrics = parsers.get_passing_variant_count(vcf_file, [sample])
+			vcf_count_metrics = self.parse(parsers.get_passing_variant_count, vcf_file, [sample])
 
 			sample_variant_count_dict[sample] = vcf_count_metrics
 
 		return sample_variant_count_dict
 
 
-class SomaticAmplicon:
+@register_pipeline
+class SomaticAmplicon(BasePipeline):
+
+	# how ingestion checks this pipeline - see pipelines.registry
+	pipeline_ids = ['SomaticAmplicon']
+	config_keys = ['sample_expected_files', 'sample_not_expected_files', 'run_expected_files', 'run_not_expected_files']
+	sample_checks = True
+	run_includes_samples = False
+	metric_steps = [
+		metric_step('get_fastqc_data', 'add_fastqc_data'),
+		metric_step('get_hs_metrics', 'add_hs_metrics'),
+		metric_step('get_depth_metrics', 'add_depth_of_coverage_metrics'),
+		metric_step('get_variant_count', 'add_variant_count_metrics'),
+	]
 
 	def __init__(self,
 				results_dir,
@@ -467,7 +498,7 @@ class SomaticAmplicon:
 
 		sample_path = results_path.joinpath(sample)
 
-		marker = sample_path.glob(self.sample_complete_marker)
+		marker = self.glob(sample_path, self.sample_complete_marker)
 
 		if len(list(marker)) >= 1:
 
@@ -491,7 +522,7 @@ class SomaticAmplicon:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -500,7 +531,7 @@ class SomaticAmplicon:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -538,7 +569,7 @@ class SomaticAmplicon:
 				return False
 
 		for file in self.run_expected_files:
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 			if len(list(found_file)) == 0:
 				return False
 		return True
@@ -551,7 +582,7 @@ class SomaticAmplicon:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.joinpath(sample).glob(f'*{sample}*fastqc/summary.txt')
+			fastqc_data_files = self.glob(results_path.joinpath(sample), f'*{sample}*fastqc/summary.txt')
 
 			sample_fastqc_list = []
 
@@ -561,7 +592,7 @@ class SomaticAmplicon:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file(fastqc_data)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file, fastqc_data)
 
 				file_fastqc_dict = {} 
 				file_fastqc_dict['lane'] = lane
@@ -596,11 +627,11 @@ class SomaticAmplicon:
 
 		for sample in self.sample_names:
 
-			hs_metrics_file = results_path.joinpath(sample).glob(f'*{sample}*_hs_metrics.txt')
+			hs_metrics_file = self.glob(results_path.joinpath(sample), f'*{sample}*_hs_metrics.txt')
 
 			hs_metrics_file = list(hs_metrics_file)[0]
 
-			parsed_hs_metrics_data  = parsers.parse_hs_metrics_file(hs_metrics_file)
+			parsed_hs_metrics_data  = self.parse(parsers.parse_hs_metrics_file, hs_metrics_file)
 
 			run_hs_metrics_dict[sample] = parsed_hs_metrics_data
 
@@ -614,11 +645,11 @@ class SomaticAmplicon:
 
 		for sample in self.sample_names:
 
-			sample_depth_summary_file = results_path.joinpath(sample).glob(f'*{sample}*_DepthOfCoverage.sample_summary')
+			sample_depth_summary_file = self.glob(results_path.joinpath(sample), f'*{sample}*_DepthOfCoverage.sample_summary')
 
 			sample_depth_summary_file = list(sample_depth_summary_file)[0]	
 
-			parsed_depth_metrics = parsers.parse_gatk_depth_summary_file(sample_depth_summary_file)
+			parsed_depth_metrics = self.parse(parsers.parse_gatk_depth_summary_file, sample_depth_summary_file)
 
 			run_depth_metrics_dict[sample] = parsed_depth_metrics
 
@@ -633,18 +664,23 @@ class SomaticAmplicon:
 
 		for sample in self.sample_names:
 
-			vcf_file = results_path.joinpath(sample).glob(f'*{sample}*_filtered_meta_annotated.vcf')
+			vcf_file = self.glob(results_path.joinpath(sample), f'*{sample}*_filtered_meta_annotated.vcf')
 
 			vcf_file = list(vcf_file)[0]	
 
-			vcf_count_metrics = parsers.get_passing_variant_count(vcf_file, [sample])
+			vcf_count_metrics = self.parse(parsers.get_passing_variant_count, vcf_file, [sample])
 
 			sample_variant_count_dict[sample] = vcf_count_metrics
 
 		return sample_variant_count_dict
 
 
-class Cruk:
+@register_pipeline
+class Cruk(BasePipeline):
+
+	# removed from ingestion as causing errors
+	pipeline_ids = ['CRUK']
+	ingest = False
 
 	def __init__(self,
 				results_dir,
@@ -714,7 +750,7 @@ class Cruk:
 
 		sample_path = results_path.joinpath(sample)
 
-		marker = sample_path.glob(self.sample_complete_marker)
+		marker = self.glob(sample_path, self.sample_complete_marker)
 
 		if len(list(marker)) < 1: 
 
@@ -759,12 +795,12 @@ class Cruk:
 		# Path to results
 		res_path = results_path.joinpath(cruk_worksheet)
 
-		if res_path.exists() == False:
+		if self.exists(res_path) == False:
 
 			return False
 
 		# Directories containing results
-		samples_results_dir = os.listdir(res_path)
+		samples_results_dir = self.listdir(res_path)
 
 		# Check samples in directory match all DNA samples- if absent directory for a DNA sample, sample is invalid
 		# This check cannot be done for RNA samples
@@ -779,7 +815,7 @@ class Cruk:
 
 		if sample in cruk_dna_samples:
 
-			directory_list = os.listdir(os.path.join(res_path, sample))
+			directory_list = self.listdir(res_path.joinpath(sample))
 
 			for f_dna in self.sample_run_dna_expected_files:
 
@@ -799,7 +835,7 @@ class Cruk:
 		# check files we want to be there are there
 		for file in self.sample_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -808,7 +844,7 @@ class Cruk:
 		# check file we do not want to be there are not there
 		for file in self.sample_not_expected_files:
 
-			found_file = sample_path.glob(file)
+			found_file = self.glob(sample_path, file)
 
 			if len(list(found_file)) > 0:
 
@@ -832,7 +868,7 @@ class Cruk:
 		# check files we want to be there are there
 		for file in self.run_complete_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -850,19 +886,17 @@ class Cruk:
 
 		marker_path = results_path.joinpath(self.run_valid_extra_marker)
 
-		if marker_path.exists() == False:
+		if self.exists(marker_path) == False:
 
 			return False
 
-		with open(marker_path) as f:
+		lines = self.read_lines(marker_path)
 
-			lines = f.read().splitlines()
+		last_line = lines[-1]
 
-			last_line = lines[-1]
+		if last_line != 'CRUK workflow completed':
 
-			if last_line != 'CRUK workflow completed':
-
-				return False
+			return False
 
 		for sample in self.sample_names:
 
@@ -873,7 +907,7 @@ class Cruk:
 		# check files we want to be there are there
 		for file in self.run_valid_expected_files:
 
-			found_file = results_path.glob(file)
+			found_file = self.glob(results_path, file)
 
 			if len(list(found_file)) != 1:
 
@@ -896,7 +930,7 @@ class Cruk:
 
 				sample_path = results_path.joinpath(sample)
 
-				fastqcs = sample_path.glob('*_fastqc.txt')
+				fastqcs = self.glob(sample_path, '*_fastqc.txt')
 
 				if len(list(fastqcs)) == 0:
 
@@ -917,7 +951,7 @@ class Cruk:
 
 		for sample in self.sample_names:
 
-			fastqc_data_files = results_path.joinpath(sample).glob(f'*{sample}*fastqc.txt')
+			fastqc_data_files = self.glob(results_path.joinpath(sample), f'*{sample}*fastqc.txt')
 
 			sample_fastqc_list = []
 
@@ -928,7 +962,7 @@ class Cruk:
 				read_number = file.split('_')[-2]
 				lane = file.split('_')[-3]
 
-				parsed_fastqc_data = parsers.parse_fastqc_file_cruk(fastqc_data, self.run_id)
+				parsed_fastqc_data = self.parse(parsers.parse_fastqc_file_cruk, fastqc_data, self.run_id)
 
 				file_fastqc_dict = {}
 				file_fastqc_dict['lane'] = lane
@@ -4,12 +4,15 @@ from .models import *
 # Register your models here.
 admin.site.register(Instrument)
 admin.site.register(Run)
+admin.site.register(RunFolderScan)
+admin.site.register(RunFileChecksum)
 admin.site.register(InteropRunQuality)
 admin.site.register(WorkSheet)
 admin.site.register(Sample)
 admin.site.register(Pipeline)
 admin.site.register(AnalysisType)
 admin.site.register(RunAnalysis)
+admin.site.register(RunAnalysisSummary)
 admin.site.register(SampleAnalysis)
 admin.site.register(SampleFastqcData)
 admin.site.register(SampleHsMetrics)
@@ -0,0 +1,663 @@
+from qc_database.models import *
+
+
+def memoize(method):
+	"""
+	Cache the result of a SampleQC method - the templates call the same getters many times.
+
+	"""
+
+	def wrapper(self):
+
+		if method.__name__ not in self.results:
+
+			self.results[method.__name__] = method(self)
+
+		return self.results[method.__name__]
+
+	wrapper.__name__ = method.__name__
+	wrapper.__doc__ = method.__doc__
+
+	return wrapper
+
+
+class RunAnalysisQC():
+	"""
+	Evaluate the auto QC checks for a RunAnalysis in memory.
+
+	The sample analyses, interop data and each metric table are loaded once for the \
+	whole run analysis so the number of queries does not depend on the number of samples.
+
+	This is where the auto QC rules live - RunAnalysis.passes_auto_qc() and the \
+	RunAnalysis sample counts use it too.
+
+	"""
+
+	def __init__(self, run_analysis):
+
+		self.run_analysis = run_analysis
+
+		self.sample_analyses = list(SampleAnalysis.objects.filter(run = run_analysis.run_id,
+																pipeline = run_analysis.pipeline_id,
+																analysis_type = run_analysis.analysis_type_id
+																).select_related('sample', 'worksheet').order_by('pk'))
+
+		self.sample_qcs = {}
+
+		for sample_analysis in self.sample_analyses:
+
+			self.sample_qcs[sample_analysis.pk] = SampleQC(self, sample_analysis)
+
+		self.metrics = {}
+		self.interop_qualities = None
+
+	def get_metrics(self, model, sample_analysis):
+		"""
+		Get the rows of a metric table for a sample analysis - the table is fetched \
+		for all samples the first time it is needed.
+
+		"""
+
+		if model not in self.metrics:
+
+			rows_by_sample = {}
+
+			rows = model.objects.filter(sample_analysis__in = [sample.pk for sample in self.sample_analyses]).order_by('pk')
+
+			for row in rows:
+
+				rows_by_sample.setdefault(row.sample_analysis_id, []).append(row)
+
+			self.metrics[model] = rows_by_sample
+
+		return self.metrics[model].get(sample_analysis.pk, [])
+
+	def get_metric(self, model, sample_analysis):
+		"""
+		Equivalent of model.objects.get(sample_analysis=sample_analysis) against the cached rows.
+
+		"""
+
+		rows = self.get_metrics(model, sample_analysis)
+
+		if len(rows) == 0:
+
+			raise model.DoesNotExist(f'No {model.__name__} for {sample_analysis.pk}')
+
+		elif len(rows) > 1:
+
+			raise model.MultipleObjectsReturned(f'More than one {model.__name__} for {sample_analysis.pk}')
+
+		return rows[0]
+
+	def get_sample_qc(self, sample_analysis):
+
+		return self.sample_qcs[sample_analysis.pk]
+
+	def get_sample_analyses(self):
+		"""
+		Get the sample analyses sorted for display with the QC results attached as .qc
+
+		"""
+
+		sample_analyses = sorted(self.sample_analyses, key = lambda sample: (sample.worksheet_id, sample.sample_id))
+
+		for sample_analysis in sample_analyses:
+
+			sample_analysis.qc = self.get_sample_qc(sample_analysis)
+
+		return sample_analyses
+
+	def get_ntc_sample(self, worksheet_id):
+
+		ntc_samples = []
+
+		for sample in self.sample_analyses:
+
+			if sample.worksheet_id != worksheet_id:
+
+				continue
+
+			for ntc_marker in ['ntc', 'NTC']:
+
+				if ntc_marker in sample.sample_id:
+
+					ntc_samples.append(sample)
+
+		return ntc_samples
+
+	def get_n_samples_completed(self):
+
+		completed = [x.results_completed for x in self.sample_analyses]
+
+		return completed.count(True), len(completed)
+
+	def get_n_samples_valid(self):
+
+		valid = [x.results_valid for x in self.sample_analyses]
+
+		return valid.count(True), len(valid)
+
+	def get_worksheets(self):
+
+		worksheets = [sample.worksheet_id for sample in self.sample_analyses]
+
+		return '|'.join(list(set(worksheets)))
+
+	def passes_run_level_qc(self):
+
+		if self.interop_qualities == None:
+
+			self.interop_qualities = list(InteropRunQuality.objects.filter(run = self.run_analysis.run_id))
+
+		for interop_quality in self.interop_qualities:
+
+			if interop_quality.percent_q30 < (self.run_analysis.min_q30_score*100):
+
+				return False
+
+		return True
+
+	def passes_auto_qc(self):
+		"""
+		Check whether the run analysis passes all QC checks.
+
+		Reads the checks to do from the run analysis - set from the config file.
+
+		"""
+
+		run_analysis = self.run_analysis
+
+		checks_to_do = run_analysis.auto_qc_checks
+
+		if checks_to_do == None:
+
+			return False, ['No Configuration For this Pipeline.']
+
+		checks_to_do = checks_to_do.split(',')
+
+		new_samples_list = []
+
+		reasons_to_fail = []
+
+		if run_analysis.demultiplexing_completed == False:
+
+			reasons_to_fail.append('Demultiplexing not complete for some samples')
+
+		if run_analysis.demultiplexing_valid == False:
+
+			reasons_to_fail.append( 'Demultiplexing not valid for some samples')
+
+		if run_analysis.results_completed == False:
+
+			return False,['Run results not completed']
+
+		if run_analysis.results_valid == False:
+
+			return False,['Run results not valid']
+
+		for sample in self.sample_analyses:
+
+			if sample.results_completed == False:
+
+				reasons_to_fail.append('Results not complete for some samples')
+
+			if sample.results_valid == False:
+
+				reasons_to_fail.append('Results not valid for some samples')
+
+			if sample.sample.is_ntc() == False:
+
+				new_samples_list.append(self.get_sample_qc(sample))
+
+		if 'pct_q30' in checks_to_do:
+
+			if self.passes_run_level_qc() == False:
+
+				reasons_to_fail.append('Q30 Fail')
+
+		if 'contamination' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_contamination() == False:
+
+					reasons_to_fail.append('Contamination Fail')
+
+		if 'ntc_contamination' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_ntc_contamination() != True:
+
+					reasons_to_fail.append('NTC Contamination Fail')
+
+		if 'sex_match' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_sex_check() == False:
+
+					reasons_to_fail.append('Sex Match Fail')
+
+		if 'variant_check' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_variant_count_check() == False:
+
+					reasons_to_fail.append('Variant Count Fail')
+
+		if 'sensitivity' in checks_to_do:
+
+			if run_analysis.passes_sensitivity() == False:
+
+				reasons_to_fail.append('Low Sensitivity')
+
+		if 'coverage' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_region_coverage_over_20() == False:
+
+					reasons_to_fail.append('Low Coverage >20x')
+
+		if 'titv' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_titv() == False:
+
+					reasons_to_fail.append('Titv Ratio out of range for at least one sample')
+
+		if 'fastqc' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_fastqc() == False:
+
+					reasons_to_fail.append('FASTQC Fail')
+
+		if 'fusion_contamination' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_fusion_contamination() == False:
+
+					reasons_to_fail.append('Fusion Contamination Fail')
+
+		if 'fusion_alignment' in checks_to_do:
+
+			for sample in new_samples_list:
+
+				if sample.passes_fusion_aligned_reads_duplicates() == False:
+
+					reasons_to_fail.append('Fusion Aligned Reads Unique Fail')
+
+		if len(reasons_to_fail) ==0:
+
+			return True, ['All Pass']
+
+		else:
+
+			return False, list(set(reasons_to_fail))
+
+
+class SampleQC():
+	"""
+	The QC results for one SampleAnalysis, calculated from the metrics cached on a RunAnalysisQC.
+
+	The templates get it as sample_analysis.qc - see RunAnalysisQC.get_sample_analyses()
+
+	"""
+
+	def __init__(self, run_analysis_qc, sample_analysis):
+
+		self.run_analysis_qc = run_analysis_qc
+		self.sample_analysis = sample_analysis
+		self.results = {}
+
+	def is_dragen_wgs(self):
+
+		return 'DragenWGS' in self.run_analysis_qc.run_analysis.pipeline_id
+
+	def get_metric(self, model):
+
+		return self.run_analysis_qc.get_metric(model, self.sample_analysis)
+
+	def get_metrics(self, model):
+
+		return self.run_analysis_qc.get_metrics(model, self.sample_analysis)
+
+	def get_run_analysis(self):
+
+		return self.run_analysis_qc.run_analysis
+
+	def get_sex(self):
+
+		return self.sample_analysis.get_sex()
+
+	@memoize
+	def passes_fastqc(self):
+		"""
+		Does the sample have a PASS for the key FASTQC metrics?
+		"""
+
+		fastqc_objs = self.get_metrics(SampleFastqcData)
+
+		if len(fastqc_objs) == 0:
+
+			return None
+
+		for fastqc in fastqc_objs:
+
+			if fastqc.basic_statistics == 'FAIL':
+
+				return False
+
+			elif fastqc.per_base_sequencing_quality == 'FAIL':
+
+				return False
+
+			elif fastqc.per_tile_sequence_quality == 'FAIL':
+
+				return False
+
+			elif fastqc.per_sequence_quality_scores == 'FAIL':
+
+				return False
+
+			elif fastqc.per_base_n_content == 'FAIL':
+
+				return False
+
+		return True
+
+	@memoize
+	def get_total_reads(self):
+
+		try:
+
+			return self.get_metric(SampleHsMetrics).total_reads
+
+		except:
+
+			try:
+
+				return self.get_metric(DragenAlignmentMetrics).total_input_reads
+
+			except:
+
+				pass
+
+		return None
+
+	@memoize
+	def get_contamination(self):
+
+		if self.is_dragen_wgs():
+
+			return self.get_metric(DragenAlignmentMetrics).estimated_sample_contamination
+
+		try:
+
+			contamination_obj = self.get_metric(ContaminationMetrics)
+
+		except:
+
+			return 'NA'
+
+		return contamination_obj.freemix
+
+	def passes_contamination(self):
+
+		try:
+			contamination = self.get_contamination()
+		except:
+			return None
+
+		if contamination > self.sample_analysis.contamination_cutoff:
+
+			return False
+
+		return True
+
+	@memoize
+	def passes_ntc_contamination(self):
+
+		total_reads = self.get_total_reads()
+
+		if total_reads == None:
+
+			return 'Cannot count reads for sample.'
+
+		ntc_objs = self.run_analysis_qc.get_ntc_sample(self.sample_analysis.worksheet_id)
+
+		if len(ntc_objs) == 0:
+
+			return False
+
+		for ntc in ntc_objs:
+
+			ntc_reads = self.run_analysis_qc.get_sample_qc(ntc).get_total_reads()
+
+			if self.sample_analysis == ntc:
+
+				return 'NA'
+
+			if ntc_reads == None:
+
+				return 'Cannot count reads for sample.'
+
+			if (ntc_reads * self.sample_analysis.ntc_contamination_cutoff) > total_reads:
+
+				return False
+
+		return True
+
+	@memoize
+	def get_calculated_sex(self):
+
+		if self.is_dragen_wgs():
+
+			wgs_obj = self.get_metric(DragenWGSCoverageMetrics)
+
+			if wgs_obj.predicted_sex_chromosome_ploidy is None:
+
+				ploidy_obj = self.get_metric(DragenPloidyMetrics)
+
+				if ploidy_obj.ploidy_estimation == 'XX':
+
+					return 'female'
+
+				elif ploidy_obj.ploidy_estimation == 'XY':
+
+					return 'male'
+
+				else:
+
+					return 'unknown'
+
+			elif wgs_obj.predicted_sex_chromosome_ploidy == 'XX':
+
+				return 'female'
+
+			elif wgs_obj.predicted_sex_chromosome_ploidy == 'XY':
+
+				return 'male'
+
+			else:
+
+				return 'unknown'
+
+		try:
+			sex_obj = self.get_metric(CalculatedSexMetrics)
+		except:
+			return 'NA'
+
+		return sex_obj.calculated_sex.lower()
+
+	def passes_sex_check(self):
+
+		if self.get_calculated_sex() == 'unknown':
+
+			return False
+
+		if self.get_calculated_sex() == self.get_sex():
+
+			return True
+
+		return False
+
+	@memoize
+	def get_variant_count(self):
+
+		if self.is_dragen_wgs():
+
+			return self.get_metric(DragenVariantCallingMetrics).total
+
+		try:
+
+			variant_calling_metrics = self.get_metric(VariantCallingMetrics)
+
+			return variant_calling_metrics.total_snps + variant_calling_metrics.total_indels + variant_calling_metrics.total_complex_indels
+
+		except:
+
+			try:
+
+				return self.get_metric(VCFVariantCount).variant_count
+
+			except:
+
+				pass
+
+		return 'NA'
+
+	def passes_variant_count_check(self):
+
+		run_analysis = self.get_run_analysis()
+
+		variant_count = self.get_variant_count()
+
+		if variant_count == 'NA':
+
+			return False
+
+		if variant_count > run_analysis.min_variants and variant_count < run_analysis.max_variants:
+
+			return True
+
+		return False
+
+	@memoize
+	def get_region_coverage_over_20(self):
+
+		try:
+			return self.get_metric(DragenRegionCoverageMetrics).pct_of_qc_coverage_region_with_coverage_20x_inf
+		except:
+			pass
+
+		coverage = self.get_metrics(CustomCoverageMetrics)
+
+		if len(coverage) != 1:
+
+			return None
+
+		return coverage[0].pct_greater_20x
+
+	def passes_region_coverage_over_20(self):
+
+		cov_gtr_20 = self.get_region_coverage_over_20()
+
+		if cov_gtr_20 == None:
+
+			return False
+
+		if cov_gtr_20 >= self.get_run_analysis().min_coverage:
+
+			return True
+
+		return False
+
+	def get_titv(self):
+
+		titv = self.get_metrics(DragenVariantCallingMetrics)
+
+		if len(titv) != 1:
+
+			return None
+
+		return titv[0].titv_ratio
+
+	def passes_titv(self):
+
+		titv = self.get_titv()
+
+		run_analysis = self.get_run_analysis()
+
+		if titv < run_analysis.min_titv:
+
+			return False
+
+		if titv > run_analysis.max_titv:
+
+			return False
+
+		return True
+
+	def get_aligned_reads_fusion(self):
+
+		alignment_metrics = self.get_metrics(FusionAlignmentMetrics)
+
+		if len(alignment_metrics) != 1:
+
+			return None
+
+		return alignment_metrics[0]
+
+	def get_contamination_fusion(self):
+
+		contamination_metrics = self.get_metrics(FusionContamination)
+
+		if len(contamination_metrics) != 1:
+
+			return None
+
+		return contamination_metrics[0].contamination
+
+	def get_contamination_referral_fusion(self):
+
+		contamination_metrics = self.get_metrics(FusionContamination)
+
+		if len(contamination_metrics) != 1:
+
+			return None
+
+		return contamination_metrics[0].contamination_referral
+
+	def passes_fusion_contamination(self):
+
+		if self.get_contamination_fusion() == True:
+
+			return False
+
+		elif self.get_contamination_referral_fusion() == True:
+
+			return False
+
+		return True
+
+	def passes_fusion_aligned_reads_duplicates(self):
+
+		aligned_reads = self.get_aligned_reads_fusion()
+
+		if aligned_reads == None:
+
+			return False
+
+		if aligned_reads.unique_reads_aligned < self.get_run_analysis().min_fusion_aligned_reads_unique:
+
+			return False
+
+		return True
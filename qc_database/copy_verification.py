@@ -0,0 +1,299 @@
+"""
+Checking a copied run folder against the checksum manifest written by the copy job.
+
+The manifest is in md5sum/sha1sum/sha256sum format (or xxh64sum if the optional \
+xxhash package is installed) with paths relative to the run folder. Only the \
+files update_database and the pipelines rely on are checked - RunInfo.xml, \
+RunParameters.xml, InterOp and the BCL/CBCL files under Data/Intensities/BaseCalls.
+
+Each file's result is saved as a RunFileChecksum as soon as it has been hashed so \
+an interrupted check carries on where it stopped, and files which haven't changed \
+since they were checked aren't read again. Each read has the deadline of the run \
+folder's mount so a hung mount doesn't stall the check - see pipelines.mount_guard.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import hashlib
+import logging
+import os
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+from qc_database.models import *
+from pipelines.mount_guard import get_mount_guard, MountUnavailable
+
+logger = logging.getLogger(__name__)
+
+# files and directories in the run folder which are checked
+VERIFIED_FILES = ['RunInfo.xml', 'RunParameters.xml', 'runParameters.xml']
+VERIFIED_DIRS = ['InterOp/', 'Data/Intensities/BaseCalls/']
+
+# read files in chunks so memory use doesn't depend on file size
+CHUNK_SIZE = 1024 * 1024
+
+VERIFIED = 'verified'
+FAILED = 'failed'
+NO_MANIFEST = 'no_manifest'
+
+
+def get_hasher(expected):
+	"""
+	The hash the manifest used, worked out from the length of the checksum.
+
+	"""
+
+	length = len(expected)
+
+	if length == 32:
+
+		return hashlib.md5()
+
+	if length == 40:
+
+		return hashlib.sha1()
+
+	if length == 64:
+
+		return hashlib.sha256()
+
+	if length == 16 and xxhash != None:
+
+		return xxhash.xxh64()
+
+	return None
+
+
+def is_verified_path(path):
+
+	return path in VERIFIED_FILES or any(path.startswith(directory) for directory in VERIFIED_DIRS)
+
+
+def parse_manifest(manifest, run_id):
+	"""
+	Return a dictionary of relative path to checksum for the files we check.
+
+	"""
+
+	checksums = {}
+
+	with open(str(manifest), 'r') as f:
+
+		for line in f:
+
+			line = line.strip()
+
+			if line == '' or line.startswith('#'):
+
+				continue
+
+			expected, path = line.split(None, 1)
+
+			# binary mode marker
+			path = path.lstrip('*')
+
+			if path.startswith('./'):
+
+				path = path[2:]
+
+			# manifests written from the archive directory include the run folder
+			if path.startswith(run_id + '/'):
+
+				path = path[len(run_id) + 1:]
+
+			if is_verified_path(path):
+
+				checksums[path] = expected.lower()
+
+	return checksums
+
+
+def hash_file(path, expected, mount_guard):
+	"""
+	Stream a file through the manifest's hash. Returns the checksum or None if it can't be read.
+
+	"""
+
+	hasher = get_hasher(expected)
+
+	if hasher == None:
+
+		return None
+
+	try:
+
+		# unbuffered - closing a buffered file waits on a read stuck on a hung mount
+		f = mount_guard.probe(path, open, str(path), 'rb', 0)
+
+	except MountUnavailable:
+
+		raise
+
+	except OSError:
+
+		return None
+
+	try:
+
+		# the deadline is for each chunk rather than the whole file
+		for chunk in iter(lambda: mount_guard.probe(path, f.read, CHUNK_SIZE), b''):
+
+			hasher.update(chunk)
+
+	except MountUnavailable:
+
+		# not closed as a read may still be stuck on it
+		raise
+
+	except OSError:
+
+		f.close()
+		return None
+
+	f.close()
+
+	return hasher.hexdigest()
+
+
+def verify_run_folder(raw_data, manifest_name, workers=4, mount_guard=None):
+	"""
+	Check the files in a run folder against its manifest.
+
+	Returns VERIFIED, FAILED or NO_MANIFEST. Raises MountUnavailable if the run \
+	folder's mount stops responding.
+
+	"""
+
+	if mount_guard == None:
+
+		mount_guard = get_mount_guard()
+
+	raw_data = Path(raw_data)
+	manifest = raw_data.joinpath(manifest_name)
+
+	if mount_guard.probe(manifest, manifest.exists) == False:
+
+		return NO_MANIFEST
+
+	try:
+
+		checksums = mount_guard.probe(manifest, parse_manifest, manifest, raw_data.name)
+
+	except MountUnavailable:
+
+		raise
+
+	except (OSError, ValueError) as e:
+
+		logger.warning(f'Could not read checksum manifest {manifest}: {e}')
+		return FAILED
+
+	stored = {row.path: row for row in RunFileChecksum.objects.filter(run_folder=str(raw_data))}
+
+	results = {}
+	to_hash = []
+
+	for path, expected in checksums.items():
+
+		try:
+
+			stat = mount_guard.probe(raw_data, os.stat, str(raw_data.joinpath(path)))
+
+		except MountUnavailable:
+
+			raise
+
+		except OSError:
+
+			logger.warning(f'{path} is in the manifest but not in {raw_data}')
+			results[path] = False
+			continue
+
+		row = stored.get(path)
+
+		# already checked and unchanged since
+		if row != None and row.expected == expected and row.size == stat.st_size and row.mtime == stat.st_mtime_ns:
+
+			results[path] = row.ok
+			continue
+
+		to_hash.append((path, expected, stat))
+
+	if len(to_hash) > 0:
+
+		logger.info(f'Checking {len(to_hash)} files in {raw_data} against {manifest_name}')
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+
+			futures = {executor.submit(hash_file, raw_data.joinpath(path), expected, mount_guard): (path, expected, stat) for path, expected, stat in to_hash}
+
+			# save each one as it finishes so an interrupted check can carry on
+			for future in as_completed(futures):
+
+				path, expected, stat = futures[future]
+
+				actual = future.result()
+				ok = actual == expected
+
+				if ok == False:
+
+					logger.warning(f'Checksum of {raw_data.joinpath(path)} does not match the manifest')
+
+				RunFileChecksum.objects.update_or_create(run_folder=str(raw_data),
+														path=path,
+														defaults={
+															'size': stat.st_size,
+															'mtime': stat.st_mtime_ns,
+															'expected': expected,
+															'actual': actual,
+															'ok': ok,
+														})
+
+				results[path] = ok
+
+	if len(results) > 0 and all(results.values()):
+
+		return VERIFIED
+
+	return FAILED
+
+
+def is_ready(raw_data):
+
+	return raw_data.joinpath('SampleSheet.csv').exists() == True and raw_data.joinpath('run_copy_complete.txt').exists() == True
+
+
+def verify_run_folders(run_folders, copy_verification, mount_guard=None):
+	"""
+	Verify the copied run folders about to be ingested.
+
+	Returns a dictionary of run folder to status - folders on a mount which stops \
+	responding are left out.
+
+	"""
+
+	if mount_guard == None:
+
+		mount_guard = get_mount_guard()
+
+	statuses = {}
+
+	for raw_data, mtime in run_folders:
+
+		try:
+
+			if mount_guard.probe(raw_data, is_ready, raw_data) == False:
+
+				continue
+
+			statuses[raw_data] = verify_run_folder(raw_data, copy_verification['manifest'], copy_verification['workers'], mount_guard)
+
+		except MountUnavailable as e:
+
+			logger.warning(f'Could not verify the copy of {raw_data}: {e}')
+
+	return statuses
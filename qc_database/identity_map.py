@@ -0,0 +1,236 @@
+"""
+Creating the rows for a sample sheet in a fixed number of queries.
+
+Sample, Pipeline, WorkSheet and AnalysisType only have their id as a primary \
+key so the IdentityMap keeps the ones seen this cycle and creates any missing \
+ones together with bulk_create. The SampleAnalysis rows for a run are then \
+upserted together. Bulk writes don't send the signals auditlog uses so the \
+log entries are written in bulk as well.
+
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry
+from django.utils.encoding import smart_text
+import json
+import logging
+
+from qc_database.models import *
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityMap:
+	"""
+	The lookup rows seen this cycle keyed on model and id.
+
+	Create one per update_database cycle - rows are only looked up in the database \
+	the first time their id is asked for.
+
+	"""
+
+	def __init__(self):
+
+		self.objects = {}
+
+	def get_many(self, model, ids):
+		"""
+		Return a dictionary of id to object, creating any rows which don't exist.
+
+		"""
+
+		known = self.objects.setdefault(model, {})
+
+		missing = set(ids) - set(known)
+
+		if len(missing) > 0:
+
+			for obj in model.objects.filter(pk__in=missing):
+
+				known[obj.pk] = obj
+
+			to_create = [model(pk=pk) for pk in missing if pk not in known]
+
+			if len(to_create) > 0:
+
+				# another process may have created some in the meantime
+				model.objects.bulk_create(to_create, ignore_conflicts=True)
+
+				for obj in to_create:
+
+					obj._state.adding = False
+					known[obj.pk] = obj
+
+		return {pk: known[pk] for pk in ids}
+
+	def get(self, model, pk):
+
+		return self.get_many(model, [pk])[pk]
+
+
+def bulk_log_entries(objects, action, changes_list):
+	"""
+	Write the auditlog entries save() would have written for objects written in bulk.
+
+	"""
+
+	if len(objects) == 0:
+
+		return
+
+	content_type = ContentType.objects.get_for_model(objects[0])
+
+	log_entries = []
+
+	for obj, changes in zip(objects, changes_list):
+
+		log_entries.append(LogEntry(content_type=content_type,
+									object_pk=smart_text(obj.pk),
+									object_id=obj.pk,
+									object_repr=smart_text(obj),
+									action=action,
+									changes=json.dumps(changes)))
+
+	LogEntry.objects.bulk_create(log_entries)
+
+
+def get_sample_analysis_key(sample_analysis):
+
+	return (sample_analysis.sample_id, sample_analysis.pipeline_id, sample_analysis.analysis_type_id, sample_analysis.worksheet_id)
+
+
+def upsert_sample_analyses(run_obj, rows, identity_map, update_fields=()):
+	"""
+	Create or update the SampleAnalysis objects for a run.
+
+	Each row is a dictionary with sample, pipeline, analysis_type and worksheet ids \
+	and any other field values. New sample analyses get all the values and existing \
+	ones only have update_fields changed.
+
+	Returns a dictionary of (sample, pipeline, analysis_type, worksheet) to SampleAnalysis.
+
+	"""
+
+	samples = identity_map.get_many(Sample, {row['sample'] for row in rows})
+	pipelines = identity_map.get_many(Pipeline, {row['pipeline'] for row in rows})
+	analysis_types = identity_map.get_many(AnalysisType, {row['analysis_type'] for row in rows})
+	worksheets = identity_map.get_many(WorkSheet, {row['worksheet'] for row in rows})
+
+	existing = {}
+
+	for sample_analysis in SampleAnalysis.objects.filter(run=run_obj):
+
+		existing[get_sample_analysis_key(sample_analysis)] = sample_analysis
+
+	to_create = {}
+	to_update = {}
+	update_changes = {}
+
+	for row in rows:
+
+		key = (row['sample'], row['pipeline'], row['analysis_type'], row['worksheet'])
+
+		values = {field: value for field, value in row.items() if field not in ['sample', 'pipeline', 'analysis_type', 'worksheet']}
+
+		if key in existing:
+
+			sample_analysis = existing[key]
+
+			for field in update_fields:
+
+				if field in values and getattr(sample_analysis, field) != values[field]:
+
+					changes = update_changes.setdefault(key, {})
+					changes[field] = [smart_text(getattr(sample_analysis, field)), smart_text(values[field])]
+
+					setattr(sample_analysis, field, values[field])
+					to_update[key] = sample_analysis
+
+			if key in to_update:
+
+				sample_analysis.sample = samples[row['sample']]
+				sample_analysis.run = run_obj
+				sample_analysis.pipeline = pipelines[row['pipeline']]
+				sample_analysis.analysis_type = analysis_types[row['analysis_type']]
+				sample_analysis.worksheet = worksheets[row['worksheet']]
+
+		else:
+
+			# related objects from the identity map so the log entries don't look them up
+			to_create[key] = SampleAnalysis(sample = samples[row['sample']],
+											run = run_obj,
+											pipeline = pipelines[row['pipeline']],
+											analysis_type = analysis_types[row['analysis_type']],
+											worksheet = worksheets[row['worksheet']],
+											**values)
+
+	if len(to_create) > 0:
+
+		SampleAnalysis.objects.bulk_create(to_create.values(), ignore_conflicts=True)
+
+		# the new primary keys aren't returned with ignore_conflicts
+		created = []
+
+		for sample_analysis in SampleAnalysis.objects.filter(run=run_obj):
+
+			key = get_sample_analysis_key(sample_analysis)
+
+			if key in to_create:
+
+				new_sample_analysis = to_create[key]
+				new_sample_analysis.pk = sample_analysis.pk
+				new_sample_analysis._state.adding = False
+				new_sample_analysis.store_loaded_values()
+
+				created.append(new_sample_analysis)
+				existing[key] = new_sample_analysis
+
+		bulk_log_entries(created, LogEntry.Action.CREATE, [model_instance_diff(None, sample_analysis) for sample_analysis in created])
+
+	if len(to_update) > 0:
+
+		SampleAnalysis.objects.bulk_update(to_update.values(), list(update_fields))
+
+		for sample_analysis in to_update.values():
+
+			sample_analysis.store_loaded_values()
+
+		bulk_log_entries(list(to_update.values()), LogEntry.Action.UPDATE, [update_changes[key] for key in to_update])
+
+	return existing
+
+
+def remove_sample_analyses(run_obj, sample_analyses):
+	"""
+	Delete sample analyses which are no longer on the run's sample sheet.
+
+	Those on a run analysis which has been signed off are kept.
+
+	Returns the (pipeline, analysis_type) ids of the run analyses affected.
+
+	"""
+
+	signed_off = set(RunAnalysis.objects.filter(run=run_obj, signoff_user__isnull=False).values_list('pipeline_id', 'analysis_type_id'))
+
+	to_delete = []
+	affected = set()
+
+	for sample_analysis in sample_analyses:
+
+		run_analysis_key = (sample_analysis.pipeline_id, sample_analysis.analysis_type_id)
+
+		if run_analysis_key in signed_off:
+
+			logger.warning(f'{sample_analysis.sample_id} is no longer on the sample sheet for {run_obj} but the run analysis has been signed off')
+			continue
+
+		to_delete.append(sample_analysis.pk)
+		affected.add(run_analysis_key)
+
+	if len(to_delete) > 0:
+
+		# not a bulk delete so auditlog records each one
+		SampleAnalysis.objects.filter(pk__in=to_delete).delete()
+
+	return affected
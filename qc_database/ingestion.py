@@ -0,0 +1,963 @@
+"""
+Finding new runs and checking watched run analyses for update_database and watch_runs.
+
+The work for each run analysis is split in two:
+
+check_run_analysis - filesystem validation and metric file parsing. Takes and returns \
+plain data so it can run in a worker process.
+
+apply_run_analysis_result - writes the result to the database in its own short transaction.
+
+"""
+
+from django.conf import settings
+from django.db import transaction, connections
+from django.utils import timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import traceback
+import os
+import datetime
+import logging
+
+from qc_database.models import *
+from qc_database.utils.slack import message_slack
+from qc_database import management_utils, copy_verification
+from qc_database.identity_map import IdentityMap, upsert_sample_analyses, remove_sample_analyses
+from pipelines import parsers
+# importing the pipeline modules registers their pipeline classes
+from pipelines import dragen_pipelines, fusion_pipelines, germline_pipelines, quality_pipelines, somatic_pipelines, nextflow_pipelines
+from pipelines import registry, integrity
+from pipelines.config import SCHEDULER_DEFAULTS
+from pipelines.directory_snapshot import SnapshotCache
+from pipelines.metrics_cache import get_metrics_cache, clear_metrics_caches
+from pipelines.mount_guard import get_mount_guard, MountUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+# stop doubling well before the interval could overflow a timedelta
+MAX_CHECK_BACKOFF = 20
+
+
+def record_copy_verification(run_id, status):
+	"""
+	Set the copy verification status on the run if it exists and message slack when a copy first fails.
+
+	"""
+
+	previous = Run.objects.filter(run_id=run_id).values_list('copy_verification', flat=True).first()
+
+	Run.objects.filter(run_id=run_id).update(copy_verification=status, copy_verified_at=timezone.now())
+
+	if status == copy_verification.FAILED and previous != copy_verification.FAILED and settings.MESSAGE_SLACK:
+
+		message_slack(
+			f':warning: *run copy does not match its checksum manifest*\n' +
+			f'```Run ID:          {run_id}```'
+		)
+
+
+def ingest_new_runs(archives, config, full_scan=False):
+	"""
+	Look for new or changed run folders in the archives and create the Run, \
+	SampleAnalysis and RunAnalysis objects for any with a sample sheet and a \
+	completed copy.
+
+	Each archive is written in its own transaction. Filesystem probes go through the \
+	mount guard so an archive on a hung mount is given up on and the others carry on.
+
+	"""
+
+	mount_guard = get_mount_guard(config.mount_probes)
+
+	degraded_mounts = mount_guard.get_degraded_mounts()
+
+	if len(degraded_mounts) > 0:
+
+		logger.warning(f'Skipping degraded mounts: {", ".join(degraded_mounts)}')
+
+	# don't process existing runs
+	existing_runs = set(Run.objects.values_list('run_id', flat=True))
+
+	# get new or changed runs in all the archives at once
+	changed_archives = management_utils.get_changed_run_folders_in_archives(archives, full_scan, mount_guard)
+
+	# lookup rows seen this cycle
+	identity_map = IdentityMap()
+
+	for archive, run_folders in changed_archives:
+
+		raw_data_dir = archive['path']
+
+		logger.info(f'{len(run_folders)} new or changed folders found in {raw_data_dir} ({archive["instrument"]})')
+
+		# outside the archive's transaction so the checksums are kept if it is interrupted
+		copy_statuses = {}
+
+		if config.copy_verification['enabled'] == True:
+
+			copy_statuses = copy_verification.verify_run_folders(run_folders, config.copy_verification, mount_guard)
+
+		# the top of each run folder is listed once
+		snapshot_cache = SnapshotCache(mount_guard)
+
+		try:
+
+			with transaction.atomic():
+
+				# for each new or changed folder in archive directory
+				for raw_data, mtime in run_folders:
+
+					run_folder = snapshot_cache.snapshot(raw_data)
+
+					sample_sheet = raw_data.joinpath('SampleSheet.csv')
+					copy_complete = run_folder.exists('run_copy_complete.txt')
+
+					# skip if no sample sheet
+					if run_folder.exists('SampleSheet.csv') == False:
+
+						logger.info(f'Could not find sample sheet for {raw_data}')
+						management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+						continue
+
+					if copy_complete == False:
+
+						management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+						continue
+
+					run_id = raw_data.name
+
+					copy_status = copy_statuses.get(raw_data)
+
+					if copy_status != None and copy_status != copy_verification.VERIFIED and config.copy_verification['required'] == True:
+
+						logger.warning(f'Copy of {raw_data} could not be verified ({copy_status}) - not ingesting it yet')
+						record_copy_verification(run_id, copy_status)
+						management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+						continue
+
+					run_obj, created = Run.objects.get_or_create(run_id=run_id)
+
+					if copy_status != None:
+
+						record_copy_verification(run_id, copy_status)
+
+						# add_run_log_info saves the whole run
+						run_obj.refresh_from_db(fields=['copy_verification', 'copy_verified_at'])
+		
+					if run_id not in existing_runs:
+
+						logger.info (f'A new run has been detected: {run_id}')
+
+						# parse runlog data 
+						run_info = raw_data.joinpath('RunInfo.xml')
+						run_parameters = raw_data.joinpath('runParameters.xml')
+
+						if run_folder.exists(run_parameters.name) == False:
+
+							run_parameters = raw_data.joinpath('RunParameters.xml')
+
+							if run_folder.exists(run_parameters.name) == False:
+
+								logger.warn (f'Can\'t find run parameters file for {run_id}')
+								management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+								continue
+
+						if run_folder.exists(run_info.name) == False or run_folder.exists(run_parameters.name) == False:
+
+							logger.warn (f'Can\'t find required XML files for {run_id}')
+							management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+							continue
+
+
+						# add runlog stats to database
+						interop_data = management_utils.add_run_log_info(run_info, run_parameters, run_obj, raw_data, mount_guard)
+
+						# the interop cache has just been written into the run folder - record its mtime after that so the run isn't scanned again
+						mtime = mount_guard.probe(raw_data, os.stat, str(raw_data)).st_mtime
+
+						# in case the same run turns up in another archive
+						existing_runs.add(run_id)
+
+					else:
+
+						interop_data = None
+
+					# only parse the sample sheet if it has changed since it was ingested
+					sample_sheet_fingerprint = mount_guard.probe(sample_sheet, management_utils.get_sample_sheet_fingerprint, sample_sheet, run_obj)
+
+					if run_obj.sample_sheet_is_unchanged(sample_sheet_fingerprint):
+
+						if sample_sheet_fingerprint[1] != run_obj.sample_sheet_mtime:
+
+							# touched but not changed - don't read it again next time
+							run_obj.set_sample_sheet_fingerprint(sample_sheet_fingerprint)
+
+						management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, True)
+						continue
+
+					try:
+						# parse sample sheet
+						sample_sheet_data = mount_guard.probe(sample_sheet, parsers.sample_sheet_parser, sample_sheet)
+
+					except MountUnavailable:
+
+						raise
+
+					except Exception as e:
+
+						logger.exception(e)
+
+						logger.warn(f'Could not parse sample sheet for run {run_id}')
+						management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, False)
+						continue
+			
+					# set to hold different pipeline combinations
+					run_analyses_to_create = set()
+
+					# create sample analysis objects for all the samples at once
+					sample_analysis_rows = []
+
+					for sample in sample_sheet_data:
+
+						pipeline = sample_sheet_data[sample]['pipelineName']
+						pipeline_version = sample_sheet_data[sample]['pipelineVersion']
+						panel = sample_sheet_data[sample]['panel']
+						sex = sample_sheet_data[sample].get('sex', None)
+
+						worksheet = sample_sheet_data[sample].get('Sample_Plate', 'Unknown')
+
+						pipeline_and_version = pipeline + '-' + pipeline_version
+
+						pipeline_config = config.get_pipeline(pipeline_and_version + '-' + panel)
+
+						sample_analysis_rows.append({
+							'sample': sample,
+							'pipeline': pipeline_and_version,
+							'analysis_type': panel,
+							'worksheet': worksheet,
+							'sex': sex,
+							'contamination_cutoff': pipeline_config.contamination_cutoff,
+							'ntc_contamination_cutoff': pipeline_config.ntc_contamination_cutoff,
+						})
+
+						run_analyses_to_create.add((pipeline_and_version, panel ))
+
+					# the cutoffs are only set on new sample analyses
+					sample_analyses = upsert_sample_analyses(run_obj, sample_analysis_rows, identity_map, update_fields=['sex'])
+
+					# samples taken off a changed sheet
+					sheet_keys = {(row['sample'], row['pipeline'], row['analysis_type'], row['worksheet']) for row in sample_analysis_rows}
+
+					removed = [sample_analysis for key, sample_analysis in sample_analyses.items() if key not in sheet_keys]
+
+					if len(removed) > 0 and run_obj.sample_sheet_hash == None:
+
+						# the first time the sheet has been fingerprinted so we can't tell what was taken off it
+						logger.info(f'{len(removed)} samples are not on the sample sheet for {run_id} - keeping them as it has not been fingerprinted before')
+
+					elif len(removed) > 0 and config.remove_missing_samples == False:
+
+						logger.info(f'{len(removed)} samples have been removed from the sample sheet for {run_id} - keeping them as remove_missing_samples is off')
+
+					elif len(removed) > 0:
+
+						logger.info(f'{len(removed)} samples have been removed from the sample sheet for {run_id}')
+
+						for pipeline, analysis_type in remove_sample_analyses(run_obj, removed):
+
+							for run_analysis in RunAnalysis.objects.filter(run=run_obj, pipeline_id=pipeline, analysis_type_id=analysis_type):
+
+								if SampleAnalysis.objects.filter(run=run_obj, pipeline_id=pipeline, analysis_type_id=analysis_type).exists() == False:
+
+									# nothing left to check or sign off
+									logger.info(f'Run analysis {run_analysis.pk} has no samples left - no longer watching it')
+
+									run_analysis.watching = False
+									run_analysis.next_check_at = None
+									run_analysis.save()
+
+								run_analysis.refresh_summary()
+
+					# needs the sample objects so do after they are created
+					if interop_data != None:
+
+						management_utils.add_interop_index_metrics(interop_data, run_obj)
+
+					# now create a corresponding run analysis object
+					for run_analysis in run_analyses_to_create:
+
+						pipeline = run_analysis[0]
+						analysis_type = run_analysis[1]
+
+						pipeline_obj = identity_map.get(Pipeline, pipeline)
+						analysis_type_obj = identity_map.get(AnalysisType, analysis_type)
+
+						pipeline_config = config.get_pipeline(pipeline_obj.pipeline_id + '-' + analysis_type_obj.analysis_type_id)
+
+						new_run_analysis_obj, created = RunAnalysis.objects.get_or_create(run = run_obj,
+																				pipeline = pipeline_obj,
+																				analysis_type = analysis_type_obj)
+
+
+						if created == True:
+
+							new_run_analysis_obj.auto_qc_checks = pipeline_config.auto_qc_checks
+							new_run_analysis_obj.min_variants = pipeline_config.min_variants
+							new_run_analysis_obj.max_variants = pipeline_config.max_variants
+							new_run_analysis_obj.min_q30_score = pipeline_config.min_q30_score
+							new_run_analysis_obj.start_date = datetime.datetime.now()
+							new_run_analysis_obj.min_sensitivity = pipeline_config.min_sensitivity
+							new_run_analysis_obj.min_titv = pipeline_config.min_titv
+							new_run_analysis_obj.max_titv = pipeline_config.max_titv
+							new_run_analysis_obj.min_coverage = pipeline_config.min_coverage
+							new_run_analysis_obj.min_fusion_aligned_reads_unique = pipeline_config.min_fusion_aligned_reads_unique
+
+							# message slack
+
+							if settings.MESSAGE_SLACK:
+								message_slack(
+									f':information_source: *{new_run_analysis_obj.analysis_type} run {new_run_analysis_obj.get_worksheets()} has finished sequencing*\n' +
+									f'```Run ID:          {new_run_analysis_obj.run}```'
+								)
+
+						new_run_analysis_obj.save()
+						new_run_analysis_obj.refresh_summary()
+
+					run_obj.set_sample_sheet_fingerprint(sample_sheet_fingerprint)
+
+					management_utils.record_run_folder_scan(raw_data, mtime, copy_complete, True)
+
+		except MountUnavailable as e:
+
+			# nothing from the archive is kept so it is all looked at again once the mount is back
+			logger.warning(f'Stopped ingesting runs from {raw_data_dir}: {e}')
+
+			# forget rows created in the rolled back transaction
+			existing_runs = set(Run.objects.values_list('run_id', flat=True))
+			identity_map = IdentityMap()
+
+
+def get_check_state(run_analysis):
+
+	return (run_analysis.demultiplexing_completed,
+			run_analysis.demultiplexing_valid,
+			run_analysis.results_completed,
+			run_analysis.results_valid)
+
+
+def is_finished_checking(run_analysis):
+	"""
+	Complete and valid runs don't need looking at again until they are reset.
+
+	"""
+
+	return get_check_state(run_analysis) == (True, True, True, True)
+
+
+def schedule_next_check(run_analysis, progressed, n_samples_completed, scheduler_config, now=None):
+	"""
+	Set when a run analysis should next be checked.
+
+	Runs which have finished demultiplexing and have some samples complete are \
+	checked every active_interval, others every idle_interval. The interval doubles \
+	each time a check finds nothing has changed, up to max_interval.
+
+	"""
+
+	if now == None:
+
+		now = timezone.now()
+
+	if is_finished_checking(run_analysis):
+
+		run_analysis.next_check_at = None
+		run_analysis.check_backoff = 0
+		return
+
+	if progressed == True:
+
+		run_analysis.check_backoff = 0
+
+	else:
+
+		run_analysis.check_backoff = min(run_analysis.check_backoff + 1, MAX_CHECK_BACKOFF)
+
+	# pipelines only checked at run level don't have sample counts
+	if run_analysis.demultiplexing_completed == True and (n_samples_completed == None or n_samples_completed > 0):
+
+		interval = scheduler_config['active_interval']
+
+	else:
+
+		interval = scheduler_config['idle_interval']
+
+	interval = min(interval * 2 ** run_analysis.check_backoff, scheduler_config['max_interval'])
+
+	run_analysis.next_check_at = now + datetime.timedelta(seconds=interval)
+
+
+def get_due_run_analyses(now=None):
+	"""
+	Watched run analyses whose next check is due.
+
+	"""
+
+	if now == None:
+
+		now = timezone.now()
+
+	return RunAnalysis.objects.filter(watching=True, next_check_at__lte=now).select_related('run', 'pipeline', 'analysis_type').order_by('pk')
+
+
+def get_run_config_key(run_analysis):
+
+	return run_analysis.pipeline.pipeline_id + '-' + run_analysis.analysis_type.analysis_type_id
+
+
+def get_run_analysis_job(run_analysis, config):
+	"""
+	Collect everything check_run_analysis needs as plain data.
+
+	"""
+
+	run_config_key = get_run_config_key(run_analysis)
+
+	samples = SampleAnalysis.objects.filter(run = run_analysis.run,
+											pipeline= run_analysis.pipeline,
+											analysis_type= run_analysis.analysis_type).order_by('pk')
+
+	return {
+		'pk': run_analysis.pk,
+		'run_id': run_analysis.run.run_id,
+		'pipeline_id': run_analysis.pipeline.pipeline_id,
+		'analysis_type_id': run_analysis.analysis_type.analysis_type_id,
+		'run_config_key': run_config_key,
+		'lanes': run_analysis.run.lanes,
+		'sample_ids': [sample.sample_id for sample in samples],
+		'sample_states': {sample.sample_id: (sample.results_fingerprint, sample.results_completed, sample.results_valid) for sample in samples},
+		'pipeline_config': config.get_pipeline(run_config_key),
+		'metric_workers': config.metric_workers,
+		'metrics_cache_path': config.metrics_cache_path,
+		'mount_probes': config.mount_probes,
+		'probe_concurrency': config.probe_concurrency,
+		'results_completed': run_analysis.results_completed,
+		'results_valid': run_analysis.results_valid,
+	}
+
+
+def get_run_analysis_dirs(job):
+	"""
+	The results directory and fastq directory (None if not configured) for a run analysis job.
+
+	"""
+
+	pipeline_config = job['pipeline_config']
+
+	results_dir = pipeline_config.results_dir or '/data/results/'
+
+	run_data_dir = Path(results_dir).joinpath(job['run_id'], job['analysis_type_id'])
+
+	# have we configured a fastq folder
+	if pipeline_config.fastq_dir == None:
+
+		return run_data_dir, None
+
+	return run_data_dir, Path(pipeline_config.fastq_dir).joinpath(job['run_id'])
+
+
+def check_run_analysis(job):
+	"""
+	Check the filesystem for a run analysis and parse any metrics which need loading.
+
+	Errors are returned rather than raised so one bad run analysis can't stop the others. \
+	Run analyses on a mount which isn't responding are returned as unavailable.
+
+	"""
+
+	metrics_cache = get_metrics_cache(job['metrics_cache_path'])
+	mount_guard = get_mount_guard(job['mount_probes'])
+
+	counts_before = metrics_cache.get_counts()
+
+	try:
+
+		result = _check_run_analysis(job, metrics_cache, mount_guard)
+
+	except MountUnavailable as e:
+
+		result = {'pk': job['pk'], 'error': None, 'unavailable': str(e)}
+
+	except Exception:
+
+		result = {'pk': job['pk'], 'error': traceback.format_exc()}
+
+	result['metrics_cache_counts'] = {name: count - counts_before[name] for name, count in metrics_cache.get_counts().items()}
+
+	return result
+
+
+def can_reuse_sample_state(fingerprint, sample_state):
+	"""
+	Whether the stored (fingerprint, complete, valid) of a sample still holds.
+
+	Only samples which were complete and valid are skipped - the rest are checked \
+	every pass so a file turning up somewhere the fingerprint doesn't see isn't missed.
+
+	"""
+
+	if fingerprint == None or sample_state == None:
+
+		return False
+
+	stored_fingerprint, stored_complete, stored_valid = sample_state
+
+	return fingerprint == stored_fingerprint and stored_complete == True and stored_valid == True
+
+
+def _check_run_analysis(job, metrics_cache, mount_guard):
+
+	run_id = job['run_id']
+	run_config_key = job['run_config_key']
+	sample_ids = job['sample_ids']
+
+	pipeline_config = job['pipeline_config']
+
+	result = {
+		'pk': job['pk'],
+		'error': None,
+		'samples': None,
+		'run_completed': None,
+		'run_valid': None,
+		'metrics_load': None,
+		'metrics': [],
+	}
+
+	if pipeline_config.results_dir == None:
+
+		logger.warn(f'No results directory configured for this pipeline {run_config_key}')
+
+	run_data_dir, fastq_dir = get_run_analysis_dirs(job)
+
+	# every directory is listed once and shared by the fastq and results checks
+	snapshot_cache = SnapshotCache(mount_guard)
+
+	# if we have not given a directory for fastqs then pretend everything is ok
+	if fastq_dir == None:
+
+		result['demultiplexing_completed'] = True
+		result['demultiplexing_valid'] = True
+
+	else:
+
+		if 'Dragen' in run_config_key:
+
+			qc_class = quality_pipelines.DragenQC
+
+		else:
+
+			qc_class = quality_pipelines.IlluminaQC
+
+		illumina_qc = qc_class(fastq_dir= fastq_dir,
+								sample_names = sample_ids,
+								n_lanes = job['lanes'],
+								analysis_type = job['analysis_type_id'],
+								min_fastq_size = pipeline_config.min_fastq_size,
+								run_id = run_id,
+								strict_validation = pipeline_config.strict_validation).use_snapshot_cache(snapshot_cache).use_metrics_cache(metrics_cache)
+
+		# list every sample's fastq directory at once rather than one at a time
+		illumina_qc.prefetch_sample_dirs(sample_ids, job['probe_concurrency'])
+
+		result['demultiplexing_completed'] = illumina_qc.demultiplex_run_is_complete()
+		result['demultiplexing_valid'] = illumina_qc.demultiplex_run_is_valid()
+
+	pipeline_class = registry.get_pipeline_class(job['pipeline_id'])
+
+	if pipeline_class == None or pipeline_class.ingest == False:
+
+		return result
+
+	pipeline_kwargs = pipeline_config.get_pipeline_kwargs(pipeline_class)
+
+	pipeline = pipeline_class(results_dir = run_data_dir,
+									sample_names = sample_ids,
+									run_id = run_id,
+									**pipeline_kwargs).use_snapshot_cache(snapshot_cache).use_metrics_cache(metrics_cache)
+
+	pipeline.strict_validation = pipeline_config.strict_validation
+
+	# just say all samples are valid for pipelines we only check at run level
+	samples = {}
+
+	fingerprint_settings = repr(sorted(pipeline_kwargs.items()))
+
+	if pipeline.strict_validation == True:
+
+		fingerprint_settings = fingerprint_settings + ' strict'
+
+	# samples which have just been found valid - their files are checked together below
+	newly_valid = []
+
+	if pipeline_class.sample_checks == True:
+
+		# stat every sample's directories at once, then list those which have changed at once
+		pipeline.prefetch_sample_fingerprints(sample_ids, job['probe_concurrency'])
+
+		fingerprints = {sample: pipeline.get_sample_fingerprint(sample, fingerprint_settings) for sample in sample_ids}
+
+		changed = [sample for sample in sample_ids if can_reuse_sample_state(fingerprints[sample], job['sample_states'].get(sample)) == False]
+
+		pipeline.prefetch_sample_dirs(changed, job['probe_concurrency'])
+
+	for sample in sample_ids:
+
+		if pipeline_class.sample_checks == True:
+
+			# only re-validate samples whose directories have changed since the stored state
+			fingerprint = fingerprints[sample]
+
+			if can_reuse_sample_state(fingerprint, job['sample_states'].get(sample)) == True:
+
+				samples[sample] = (True, True, fingerprint)
+
+			else:
+
+				samples[sample] = (pipeline.sample_is_complete(sample), pipeline.sample_is_valid(sample), fingerprint)
+
+				if samples[sample][1] == True:
+
+					newly_valid.append(sample)
+
+		else:
+
+			samples[sample] = (True, True, None)
+
+	if pipeline.strict_validation == True and len(newly_valid) > 0:
+
+		sample_files = {sample: pipeline.get_sample_integrity_files(sample) for sample in newly_valid}
+
+		intact = integrity.check_files([path for paths in sample_files.values() for path in paths], metrics_cache, probe=snapshot_cache.probe)
+
+		for sample, paths in sample_files.items():
+
+			if all(intact[path] for path in paths) == False:
+
+				logger.warning(f'{run_id} {sample} has truncated files')
+
+				# no fingerprint so it is checked again once the files are complete
+				samples[sample] = (samples[sample][0], False, None)
+
+	result['samples'] = samples
+
+	if pipeline_class.run_includes_samples == True:
+
+		# roll up from the sample states rather than checking every sample again
+		run_complete = all(sample_state[0] for sample_state in samples.values()) and pipeline.run_is_complete()
+		run_valid = all(sample_state[1] for sample_state in samples.values()) and pipeline.run_is_valid()
+
+	else:
+
+		run_complete = pipeline.run_is_complete()
+		run_valid = pipeline.run_is_valid()
+
+	result['run_completed'] = run_complete
+	result['run_valid'] = run_valid
+
+	if job['results_completed'] == False and run_complete == True:
+
+		if run_valid == True:
+
+			result['metrics_load'] = 'first'
+
+	elif job['results_valid'] == False and run_valid == True and run_complete == True:
+
+		result['metrics_load'] = 'later'
+
+	if result['metrics_load'] != None:
+
+		steps = [step for step in pipeline_class.metric_steps if step.first_completion_only == False or result['metrics_load'] == 'first']
+
+		result['metrics'] = run_metric_getters(pipeline, steps, job['metric_workers'])
+
+	return result
+
+
+def run_metric_getters(pipeline, steps, workers=1):
+	"""
+	Parse the metric files for each step, with the getters running in a thread pool.
+
+	Returns (loader, metrics, loader args) in the same order as the steps.
+
+	"""
+
+	if workers > 1 and len(steps) > 1:
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+
+			metrics = list(executor.map(lambda step: getattr(pipeline, step.getter)(), steps))
+
+	else:
+
+		metrics = [getattr(pipeline, step.getter)() for step in steps]
+
+	return [(step.loader, step_metrics, step.loader_args) for step, step_metrics in zip(steps, metrics)]
+
+
+def apply_run_analysis_result(run_analysis, result, scheduler_config=None):
+	"""
+	Write the result of check_run_analysis to the database in one transaction.
+
+	Slack messages are written to the outbox in the same transaction so they can't be lost.
+
+	"""
+
+	if scheduler_config == None:
+
+		scheduler_config = dict(SCHEDULER_DEFAULTS)
+
+	# anything moving on resets the backoff
+	state_before = get_check_state(run_analysis)
+	progressed = result['metrics_load'] != None
+	n_samples_completed = None
+
+	run_id = run_analysis.run.run_id
+
+	qc_link = f'QC link:          http://10.59.210.245:5000/run_analysis/{run_analysis.pk}/```'
+
+	with transaction.atomic():
+
+		has_completed = result['demultiplexing_completed']
+		is_valid = result['demultiplexing_valid']
+
+		if run_analysis.demultiplexing_completed == False and has_completed == True:
+
+			if is_valid == True:
+
+				logger.info(f'Run {run_analysis} {run_analysis.analysis_type.analysis_type_id} has now completed demultiplexing')
+
+				# set slack status message
+				status_message = f':information_source: *{run_analysis.analysis_type} run {run_analysis.get_worksheets()} has generated FASTQs successfully*\n'
+
+			else:
+
+				logger.info(f'Run {run_id} {run_analysis.analysis_type.analysis_type_id} has now failed demultiplexing')
+
+				# set slack status message
+				status_message = f':heavy_exclamation_mark: *{run_analysis.analysis_type} run {run_analysis.get_worksheets()} has failed FASTQ generation*\n'
+
+			if settings.MESSAGE_SLACK:
+
+				message_slack(status_message + f'```Run ID:          {run_analysis.run}\n' + qc_link)
+
+		run_analysis.demultiplexing_completed = has_completed
+		run_analysis.demultiplexing_valid = is_valid
+
+		if result['samples'] != None:
+
+			pipeline_id = run_analysis.pipeline.pipeline_id
+
+			sample_analyses = SampleAnalysis.objects.filter(run = run_analysis.run,
+															pipeline = run_analysis.pipeline,
+															analysis_type = run_analysis.analysis_type)
+
+			sample_analyses = {sample_analysis.sample_id: sample_analysis for sample_analysis in sample_analyses}
+
+			n_samples_completed = 0
+
+			for sample, (sample_complete, sample_valid, fingerprint) in result['samples'].items():
+
+				sample_analysis_obj = sample_analyses[sample]
+
+				if sample_complete == True:
+
+					n_samples_completed = n_samples_completed + 1
+
+				sample_changed = (sample_analysis_obj.results_completed, sample_analysis_obj.results_valid) != (sample_complete, sample_valid)
+
+				if sample_changed == True:
+
+					progressed = True
+
+				# nothing to write for samples which haven't changed
+				if sample_changed == False and sample_analysis_obj.results_fingerprint == fingerprint:
+
+					continue
+
+				if sample_analysis_obj.results_completed == False and sample_complete == True:
+
+					if sample_valid == True:
+
+						logger.info(f'Sample {sample} on run {run_id} has finished {pipeline_id} successfully.')
+
+					else:
+						logger.info(f'Sample {sample} on run {run_id} has failed {pipeline_id}.')
+
+				elif sample_analysis_obj.results_valid == False and sample_valid == True and sample_complete == True:
+
+					logger.info(f'Sample {sample} on run {run_id} has now completed successfully.')
+
+				sample_analysis_obj.results_completed = sample_complete
+				sample_analysis_obj.results_valid = sample_valid
+				sample_analysis_obj.results_fingerprint = fingerprint
+				sample_analysis_obj.save()
+
+			if result['metrics_load'] == 'first':
+
+				logger.info(f'Run {run_id} {run_analysis.analysis_type.analysis_type_id} has now successfully completed pipeline {pipeline_id}')
+
+			elif result['metrics_load'] == 'later':
+
+				logger.info(f'Run {run_id} {run_analysis.analysis_type.analysis_type_id} now successfully completed pipeline {pipeline_id}')
+
+			elif run_analysis.results_completed == False and result['run_completed'] == True:
+
+				logger.info(f'Run {run_id} {run_analysis.analysis_type.analysis_type_id} has failed pipeline {pipeline_id}')
+
+			# the loaders share the sample analyses we already have rather than each querying for them
+			run_analysis.sample_analysis_map = sample_analyses
+
+			for loader, metrics_dict, loader_args in result['metrics']:
+
+				logger.info(f'Putting {loader[4:]} into db for run {run_id}')
+				getattr(management_utils, loader)(metrics_dict, run_analysis, *loader_args)
+
+			run_analysis.sample_analysis_map = None
+
+			run_analysis.results_completed = result['run_completed']
+			run_analysis.results_valid = result['run_valid']
+
+			if result['metrics_load'] != None and settings.MESSAGE_SLACK:
+
+				message_slack(
+					f':heavy_exclamation_mark: *{run_analysis.analysis_type} run {run_analysis.get_worksheets()} is ready for QC*\n' +
+					f'```Run ID:          {run_analysis.run}\n' + qc_link
+				)
+
+		if get_check_state(run_analysis) != state_before:
+
+			progressed = True
+
+		schedule_next_check(run_analysis, progressed, n_samples_completed, scheduler_config)
+
+		run_analysis.save()
+
+		run_analysis.refresh_summary()
+
+
+def process_run_analyses(run_analyses, config, workers=1):
+	"""
+	Check each run analysis and write the results to the database.
+
+	With more than one worker the filesystem checks run in a process pool. Results \
+	are still applied one run analysis at a time in the order given, each in its own \
+	transaction, and a failure only affects the run analysis it happened in.
+
+	"""
+
+	run_analyses = list(run_analyses)
+
+	jobs = [get_run_analysis_job(run_analysis, config) for run_analysis in run_analyses]
+
+	scheduler_config = config.scheduler
+
+	# parsed metrics are kept in memory for one pass - files can change before the next
+	clear_metrics_caches()
+
+	metrics_cache_counts = {}
+
+	if workers > 1 and len(jobs) > 1:
+
+		# don't share the parent's database connections with the worker processes
+		connections.close_all()
+
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+
+			for run_analysis, result in zip(run_analyses, executor.map(check_run_analysis, jobs)):
+
+				add_metrics_cache_counts(metrics_cache_counts, result)
+				apply_and_notify(run_analysis, result, scheduler_config)
+
+	else:
+
+		for run_analysis, job in zip(run_analyses, jobs):
+
+			result = check_run_analysis(job)
+
+			add_metrics_cache_counts(metrics_cache_counts, result)
+			apply_and_notify(run_analysis, result, scheduler_config)
+
+	if len(metrics_cache_counts) > 0:
+
+		logger.info(f'Metrics cache: {metrics_cache_counts.get("memory_hits", 0)} hits in memory, {metrics_cache_counts.get("store_hits", 0)} from the store, {metrics_cache_counts.get("misses", 0)} parsed')
+
+
+def refresh_missing_summaries():
+	"""
+	Create the summary for any run analysis that hasn't got one yet e.g. created before summaries existed.
+
+	"""
+
+	run_analyses = RunAnalysis.objects.filter(summary__isnull=True).select_related('run', 'pipeline', 'analysis_type').order_by('pk')
+
+	for run_analysis in run_analyses:
+
+		logger.info(f'Creating the summary for run analysis {run_analysis.pk}')
+
+		with transaction.atomic():
+
+			run_analysis.refresh_summary()
+
+
+def add_metrics_cache_counts(totals, result):
+
+	for name, count in result.get('metrics_cache_counts', {}).items():
+
+		totals[name] = totals.get(name, 0) + count
+
+
+def postpone_check(run_analysis, scheduler_config=None):
+	"""
+	Back off a run analysis whose check failed so it isn't retried on every pass.
+
+	"""
+
+	if scheduler_config == None:
+
+		scheduler_config = dict(SCHEDULER_DEFAULTS)
+
+	# no samples completed so it is retried at the idle interval
+	schedule_next_check(run_analysis, False, 0, scheduler_config)
+
+	with transaction.atomic():
+
+		run_analysis.save(update_fields=['next_check_at', 'check_backoff'])
+
+
+def apply_and_notify(run_analysis, result, scheduler_config=None):
+
+	if result['error'] != None:
+
+		logger.error(f'Could not check run analysis {run_analysis}:\n{result["error"]}')
+		postpone_check(run_analysis, scheduler_config)
+		return
+
+	# left due so it is checked again once the mount is back
+	if result.get('unavailable') != None:
+
+		logger.warning(f'Skipped run analysis {run_analysis}: {result["unavailable"]}')
+		return
+
+	try:
+
+		apply_run_analysis_result(run_analysis, result, scheduler_config)
+
+	except Exception as e:
+
+		logger.exception(e)
+		logger.error(f'Could not update run analysis {run_analysis}')
+
+		# the failed update was rolled back so start from the stored row
+		run_analysis.refresh_from_db()
+		postpone_check(run_analysis, scheduler_config)
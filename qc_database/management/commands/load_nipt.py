@@ -6,6 +6,7 @@ from pathlib import Path
 import csv
 import datetime
 from qc_database.models import *
+from qc_database.identity_map import IdentityMap, upsert_sample_analyses
 from pipelines.parsers import *
 
 def add_run_log_info(run_info, run_parameters, run_obj, raw_data_dir):
@@ -118,7 +119,8 @@ class Command(BaseCommand):
 		# get runs in existing archive directory
 		raw_data_dir = list(Path(raw_data_dir).glob('*/'))
 
-		sample_sheet_dict = {}
+		# lookup rows seen while loading
+		identity_map = IdentityMap()
 
 		with transaction.atomic():
 
@@ -175,8 +177,6 @@ class Command(BaseCommand):
 					# parse sample sheet
 					sample_sheet_data = sample_sheet_parser_nipt(sample_sheet)
 
-					sample_sheet_dict[run_id] = sample_sheet_data
-
 				except Exception as e:
 					print(e)
 					print(f'Could not parse sample sheet for run {run_id}')
@@ -185,41 +185,38 @@ class Command(BaseCommand):
 				# set to hold different pipeline combinations
 				run_analyses_to_create = set()
 
-				# create sample analysis objects for each sample
+				# create sample analysis objects for all the samples at once
+				sample_analysis_rows = []
+
 				for sample in sample_sheet_data:
 
-					sample_obj, created = Sample.objects.get_or_create(sample_id=sample)
 					pipeline = 'NIPT'
 					pipeline_version = 'NIPT'
 					panel = 'NIPT'
-					sex = sample_sheet_data[sample].get('sex', None)
 
 					worksheet = sample_sheet_data[sample].get('Sample_Project', 'Unknown')
 
 					pipeline_and_version = pipeline + '-' + pipeline_version
 
-					pipeline_obj, created = Pipeline.objects.get_or_create(pipeline_id= pipeline_and_version)
-					worksheet_obj, created = WorkSheet.objects.get_or_create(worksheet_id= worksheet)
-					analysis_type_obj, created = AnalysisType.objects.get_or_create(analysis_type_id=panel)
-
-					new_sample_analysis_obj, created = SampleAnalysis.objects.get_or_create(sample=sample_obj,
-																			run = run_obj,
-																			pipeline = pipeline_obj,
-																			analysis_type = analysis_type_obj,
-																			worksheet = worksheet_obj,
-																			)
-					new_sample_analysis_obj.save()
+					sample_analysis_rows.append({
+						'sample': sample,
+						'pipeline': pipeline_and_version,
+						'analysis_type': panel,
+						'worksheet': worksheet,
+					})
 
 					run_analyses_to_create.add((pipeline_and_version, panel ))
 
+				upsert_sample_analyses(run_obj, sample_analysis_rows, identity_map)
+
 				# now create a corresponding run analysis object
 				for run_analysis in run_analyses_to_create:
 
 					pipeline = run_analysis[0]
 					analysis_type = run_analysis[1]
 
-					pipeline_obj = Pipeline.objects.get(pipeline_id=pipeline)
-					analysis_type_obj = AnalysisType.objects.get(analysis_type_id=analysis_type)
+					pipeline_obj = identity_map.get(Pipeline, pipeline)
+					analysis_type_obj = identity_map.get(AnalysisType, analysis_type)
 
 					new_run_analysis_obj, created = RunAnalysis.objects.get_or_create(run = run_obj,
 																			pipeline = pipeline_obj,
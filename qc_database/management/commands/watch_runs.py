@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+import logging
+
+from qc_database.watcher import RunWatcher, FileWatcher
+from qc_database.utils import slack
+
+class Command(BaseCommand):
+
+	def add_arguments(self, parser):
+
+		parser.add_argument('--raw_data_dir', nargs ='+', type = str, help='One or more archive directories to watch for new runs - defaults to the archives in the config')
+
+		parser.add_argument('--config', nargs =1, type = str, required=True)
+
+		parser.add_argument('--poll_interval', type = float, default=30, help='Seconds to wait for changes each cycle - also how often directories on NFS etc are polled')
+
+		parser.add_argument('--sweep_interval', type = float, default=300, help='Seconds between sweeps of the archives and the run analyses due a check')
+
+		parser.add_argument('--workers', type = int, default=1, help='Number of processes to check changed run analyses with')
+
+		parser.add_argument('--no_inotify', action='store_true', help='Poll every directory rather than using inotify')
+
+		parser.add_argument('--max_cycles', type = int, default=None, help='Stop after this many cycles - runs forever by default')
+
+	def handle(self, *args, **options):
+
+		logging.basicConfig(level=logging.INFO)
+		logger = logging.getLogger(__name__)
+
+		# the watcher sends the slack messages at the end of each cycle
+		slack.disable_background_sender()
+
+		file_watcher = FileWatcher(use_inotify= options['no_inotify'] == False)
+
+		run_watcher = RunWatcher(options['config'][0],
+								raw_data_dirs = options['raw_data_dir'],
+								poll_interval = options['poll_interval'],
+								sweep_interval = options['sweep_interval'],
+								workers = options['workers'],
+								file_watcher = file_watcher)
+
+		if run_watcher.config == None:
+
+			raise CommandError(f'Could not read config {options["config"][0]}')
+
+		if len(run_watcher.archives) == 0:
+
+			raise CommandError('No archives to watch - pass --raw_data_dir or add archives to the config')
+
+		logger.info(f'Watching {len(run_watcher.archives)} archives')
+
+		run_watcher.run(options['max_cycles'])
@@ -1,16 +1,221 @@
 from pipelines import parsers
+from pipelines.mount_guard import get_mount_guard
 from qc_database.models import *
 from django.contrib.auth.models import User
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
 
+logger = logging.getLogger(__name__)
+
+
+def load_scan_manifest(raw_data_dir):
+	"""
+	Get the RunFolderScan manifest entries for an archive directory in one query.
+
+	Returns a dictionary keyed by folder path.
+
+	"""
+
+	archive_prefix = os.path.join(str(raw_data_dir), '')
+
+	scan_manifest = {}
+
+	for scan in RunFolderScan.objects.filter(path__startswith=archive_prefix):
+
+		scan_manifest[scan.path] = scan
+
+	return scan_manifest
+
+
+def list_changed_run_folders(raw_data_dir, scan_manifest):
+	"""
+	List an archive directory once and compare each folder's mtime against the scan manifest.
+
+	Only touches the filesystem so it is safe to run in a thread.
+
+	"""
+
+	changed_folders = []
+
+	with os.scandir(str(raw_data_dir)) as entries:
+
+		for entry in entries:
+
+			# skip non directory items
+			if entry.is_dir() == False:
+				continue
+
+			mtime = entry.stat().st_mtime
+
+			scan = scan_manifest.get(entry.path)
+
+			if scan != None and scan.is_unchanged(mtime):
+				continue
+
+			changed_folders.append((Path(entry.path), mtime))
+
+	return sorted(changed_folders, key=lambda folder: folder[0].name)
+
+
+def get_changed_run_folders(raw_data_dir, full_scan=False):
+	"""
+	Get the folders in an archive directory which are new or have changed since the last scan.
+
+	The archive is listed once and each folder's mtime is compared against the
+	RunFolderScan manifest (loaded in one query) so folders which are unchanged and
+	already ingested are skipped without looking at any of the files inside them.
+
+	Returns a list of (folder path, mtime) tuples sorted by folder name.
+
+	"""
+
+	scan_manifest = {}
+
+	if full_scan == False:
+
+		scan_manifest = load_scan_manifest(raw_data_dir)
+
+	return list_changed_run_folders(raw_data_dir, scan_manifest)
+
+
+def get_archives(raw_data_dirs, config):
+	"""
+	Get the archive directories to look for new runs in.
+
+	Directories given on the command line are used if there are any, otherwise the \
+	archives list in the config. Each archive is a dictionary with a path and an \
+	optional instrument tag e.g. {'path': '/data/archive/miseq', 'instrument': 'miseq'}
+
+	"""
+
+	config_archives = config.archives
+
+	instrument_tags = {}
+
+	for archive in config_archives:
+
+		instrument_tags[os.path.normpath(archive['path'])] = archive.get('instrument')
+
+	if raw_data_dirs:
+
+		paths = raw_data_dirs
+
+	else:
+
+		paths = [archive['path'] for archive in config_archives]
+
+	archives = []
+	seen = set()
+
+	for path in paths:
+
+		path = os.path.normpath(path)
+
+		if path in seen:
+			continue
+
+		seen.add(path)
+
+		archives.append({'path': path, 'instrument': instrument_tags.get(path)})
+
+	return archives
+
+
+def get_changed_run_folders_in_archives(archives, full_scan=False, mount_guard=None):
+	"""
+	Find new or changed run folders in several archives at once.
+
+	The scan manifests are loaded here, and the directory listings (slow on network \
+	mounts) run concurrently, one thread per archive, each with its mount's deadline. \
+	An archive which can't be listed in time is logged and skipped so the others \
+	still get processed.
+
+	Returns a list of (archive, run folders) tuples in the same order as archives.
 
-def add_run_log_info(run_info, run_parameters, run_obj, raw_data_dir):
+	"""
+
+	scan_manifests = []
+
+	for archive in archives:
+
+		if full_scan == True:
+
+			scan_manifests.append({})
+
+		else:
+
+			scan_manifests.append(load_scan_manifest(archive['path']))
+
+	if mount_guard == None:
+
+		mount_guard = get_mount_guard()
+
+	results = []
+
+	with ThreadPoolExecutor(max_workers=max(len(archives), 1)) as executor:
+
+		futures = [executor.submit(mount_guard.probe, archive['path'], list_changed_run_folders, archive['path'], scan_manifest) for archive, scan_manifest in zip(archives, scan_manifests)]
+
+		for archive, future in zip(archives, futures):
+
+			try:
+
+				results.append((archive, future.result()))
+
+			except OSError as e:
+
+				logger.warning(f'Could not list archive {archive["path"]}: {e}')
+
+	return results
+
+
+def get_sample_sheet_fingerprint(sample_sheet, run_obj):
+	"""
+	The (size, mtime, sha1) of a sample sheet.
+
+	The sheet is only read if its size or mtime differ from the fingerprint stored on the run.
+
+	"""
+
+	stat = sample_sheet.stat()
+
+	if run_obj.sample_sheet_hash != None and stat.st_size == run_obj.sample_sheet_size and stat.st_mtime_ns == run_obj.sample_sheet_mtime:
+
+		return stat.st_size, stat.st_mtime_ns, run_obj.sample_sheet_hash
+
+	return stat.st_size, stat.st_mtime_ns, hashlib.sha1(sample_sheet.read_bytes()).hexdigest()
+
+
+def record_run_folder_scan(raw_data, mtime, copy_complete, ingested):
+	"""
+	Update the scan manifest entry for a run folder.
+
+	"""
+
+	RunFolderScan.objects.update_or_create(path=str(raw_data),
+										defaults={
+											'run_id': raw_data.name,
+											'mtime': mtime,
+											'copy_complete': copy_complete,
+											'ingested': ingested
+										})
+
+
+def add_run_log_info(run_info, run_parameters, run_obj, raw_data_dir, mount_guard=None):
 	"""
 	parse data from the xml files and put into run_obj
 
 	"""
 
-	run_params_dict = parsers.get_run_parameters_dict(run_parameters)
-	run_info_dict = parsers.get_run_info_dict(run_info)
+	if mount_guard == None:
+
+		mount_guard = get_mount_guard()
+
+	run_params_dict = mount_guard.probe(run_parameters, parsers.get_run_parameters_dict, run_parameters)
+	run_info_dict = mount_guard.probe(run_info, parsers.get_run_info_dict, run_info)
 
 	processed_run_info_dict = parsers.extract_data_from_run_info_dict(run_info_dict)
 
@@ -57,7 +262,9 @@ def add_run_log_info(run_info, run_parameters, run_obj, raw_data_dir):
 	run_obj.length_index1 = length_index1
 	run_obj.length_index2 = length_index2
 	
-	interop_dict = parsers.parse_interop_data(str(raw_data_dir), int(num_reads) + int(num_indexes), int(lane_count))
+	interop_dict = mount_guard.probe(raw_data_dir, parsers.parse_interop_data, str(raw_data_dir), int(num_reads) + int(num_indexes), int(lane_count))
+
+	new_interop_quality_objs = []
 
 	for read in interop_dict['read_summaries']:
 
@@ -85,403 +292,362 @@ def add_run_log_info(run_info, run_parameters, run_obj, raw_data_dir):
 					reads_pf = lane_read_summary['reads_pf'],
 					yield_g = lane_read_summary['yield_g']
 				)
-			new_interop_quality_obj.save()
+			new_interop_quality_objs.append(new_interop_quality_obj)
 
+	InteropRunQuality.objects.bulk_create(new_interop_quality_objs)
 
 	run_obj.save()
 
 	return interop_dict
 
 
-def add_fastqc_data(fastqc_dict, run_analysis_obj):
+def add_interop_index_metrics(interop_dict, run_obj):
 	"""
-	Add data from fastqc files to database.
+	Add the percentage of reads identified for each sample from the interop index summary.
+
+	Needs to run after the Sample objects for the run have been created.
 
 	"""
 
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	index_summaries = interop_dict.get('index_summaries', {})
 
-	for key in fastqc_dict:
+	existing_samples = set(InteropIndexMetrics.objects.filter(run=run_obj).values_list('sample_id', flat=True))
+	run_samples = set(Sample.objects.filter(sample_id__in=list(index_summaries.keys())).values_list('sample_id', flat=True))
 
-		sample_obj = Sample.objects.get(sample_id=key)
+	new_index_objs = []
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+	for sample_id in sorted(index_summaries):
 
-		sample_data = fastqc_dict[key]
+		if sample_id in existing_samples or sample_id not in run_samples:
 
-		for read in sample_data:
+			continue
 
-			existing_data = SampleFastqcData.objects.filter(sample_analysis= sample_analysis_obj,
-													read_number = read['read_number'],
-													lane = read['lane'])
-			
-			if len(existing_data) < 1:
+		new_index_objs.append(InteropIndexMetrics(sample_id=sample_id,
+												run=run_obj,
+												pct_reads_identified=round(index_summaries[sample_id], 3)))
 
-				read['sample_analysis'] = sample_analysis_obj
-				
-				new_fastqc_obj = SampleFastqcData(**read)
-				new_fastqc_obj.save()
+	InteropIndexMetrics.objects.bulk_create(new_index_objs)
 
-def add_hs_metrics(hs_metrics_dict, run_analysis_obj):
+	return new_index_objs
+
+
+def get_sample_analysis_map(run_analysis_obj):
 	"""
-	Add data from picard hs metrics files to database.
+	Get all the SampleAnalysis objects for a run analysis in one query.
+
+	Returns a dictionary keyed by sample id. Ingestion sets sample_analysis_map on the \
+	run analysis while it loads several metrics so they can share one query.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in hs_metrics_dict:
+	if getattr(run_analysis_obj, 'sample_analysis_map', None) != None:
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		return run_analysis_obj.sample_analysis_map
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+	sample_analyses = SampleAnalysis.objects.filter(run=run_analysis_obj.run,
+													pipeline=run_analysis_obj.pipeline,
+													analysis_type=run_analysis_obj.analysis_type)
 
-		existing_data = SampleHsMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-			
-		if len(existing_data) < 1:
+	return {sample_analysis.sample_id: sample_analysis for sample_analysis in sample_analyses}
 
-			sample_data = hs_metrics_dict[key]
 
-			del sample_data['sample']
-			del sample_data['library']
-			del sample_data['read_group']
+def get_sample_analysis(sample_analysis_map, sample_id):
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+	try:
 
-			for key in sample_data:
+		return sample_analysis_map[sample_id]
 
-				if sample_data[key] == '?' or sample_data[key] == '':
+	except KeyError:
 
-					sample_data[key] = None
-					
-			new_hsmetrics_obj = SampleHsMetrics(**sample_data)
-			new_hsmetrics_obj.save()
+		raise SampleAnalysis.DoesNotExist(f'No SampleAnalysis found for sample {sample_id}')
 
-def add_depth_of_coverage_metrics(depth_metrics_dict, run_analysis_obj):
+
+def set_null_values(sample_data, null_values=('?', '')):
 	"""
-	Add data from depth of coverage summary files to database.
+	Replace values which mean missing data with None.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in depth_metrics_dict:
+	for key in sample_data:
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		if sample_data[key] in null_values:
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+			sample_data[key] = None
 
-		existing_data = SampleDepthofCoverageMetrics.objects.filter(sample_analysis= sample_analysis_obj)
+	return sample_data
 
-		if len(existing_data) < 1:
 
-			sample_data = depth_metrics_dict[key]
-			del sample_data['sample_id']
+def get_existing_keys(model, sample_analyses, lookup_fields=()):
+	"""
+	Get the (sample analysis pk, lookup fields...) keys already in the database with a single IN query.
+
+	"""
 
-			sample_data['sample_analysis'] = sample_analysis_obj
-			new_depth_obj = SampleDepthofCoverageMetrics(**sample_data)
-			new_depth_obj.save()
+	existing_keys = model.objects.filter(sample_analysis__in=sample_analyses).values_list('sample_analysis_id', *lookup_fields)
 
+	return set(existing_keys)
 
 
-def add_duplication_metrics(duplication_metrics_dict, run_analysis_obj):
+def bulk_add_metrics(model, new_rows, sample_analyses, lookup_fields=()):
 	"""
-	Add data from picard mark duplicates summary files to database.
+	Add rows for a metrics model.
+
+	new_rows is a list of (sample analysis, lookup values, function returning the model kwargs).
+
+	Rows which already exist (matched on the sample analysis plus the lookup fields)
+	are skipped and the kwargs function is never called for them - the rest are written
+	with a single bulk_create.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in duplication_metrics_dict:
+	existing_keys = get_existing_keys(model, sample_analyses, lookup_fields)
 
-		sample_obj = Sample.objects.get(sample_id=key)
+	new_objs = []
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = DuplicationMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	for sample_analysis_obj, lookup_values, get_sample_data in new_rows:
 
-			sample_data = duplication_metrics_dict[key]
+		key = (sample_analysis_obj.pk,) + tuple(lookup_values)
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+		if key in existing_keys:
 
-			for key in sample_data:
+			continue
 
-				if sample_data[key] == '?' or sample_data[key] == '':
+		existing_keys.add(key)
 
-					sample_data[key] = None
+		new_objs.append(model(**get_sample_data()))
 
-			new_duplication_obj = DuplicationMetrics(**sample_data)
-			new_duplication_obj.save()
-		
-def add_contamination_metrics(contamination_metrics_dict, run_analysis_obj):
+	if len(new_objs) > 0:
+
+		model.objects.bulk_create(new_objs)
+
+	return new_objs
+
+
+def add_fastqc_data(fastqc_dict, run_analysis_obj):
 	"""
-	Add data from contamination summary files to database.
+	Add data from fastqc files to database.
 
 	"""
 
+	sample_analysis_map = get_sample_analysis_map(run_analysis_obj)
 
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	new_rows = []
+	sample_analyses = []
 
-	for key in contamination_metrics_dict:
+	for key in fastqc_dict:
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		sample_analysis_obj = get_sample_analysis(sample_analysis_map, key)
+		sample_analyses.append(sample_analysis_obj)
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+		for read in fastqc_dict[key]:
 
+			def get_sample_data(read=read, sample_analysis_obj=sample_analysis_obj):
 
-		existing_data = ContaminationMetrics.objects.filter(sample_analysis= sample_analysis_obj)
+				read['sample_analysis'] = sample_analysis_obj
 
-		if len(existing_data) < 1:
-			
-			sample_data = contamination_metrics_dict[key]
+				return read
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+			new_rows.append((sample_analysis_obj, (str(read['read_number']), str(read['lane'])), get_sample_data))
 
-			for key in sample_data:
+	bulk_add_metrics(SampleFastqcData, new_rows, sample_analyses, ('read_number', 'lane'))
 
-				if sample_data[key] == '?' or sample_data[key] == '':
 
-					sample_data[key] = None
+def add_per_sample_metrics(model, metrics_dict, run_analysis_obj, get_sample_data):
+	"""
+	Add metrics where each sample analysis has a single row.
 
-			new_contamination_obj = ContaminationMetrics(**sample_data)
-			new_contamination_obj.save()
+	get_sample_data takes the sample analysis and the parsed sample data and returns the model kwargs.
 
-def add_sex_metrics(qc_metrics_dict, run_analysis_obj, sex_key):
 	"""
-	Add data from sex calculation files to database.
 
-	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	sample_analysis_map = get_sample_analysis_map(run_analysis_obj)
 
-	for key in qc_metrics_dict:
+	new_rows = []
+	sample_analyses = []
 
-		sample_obj = Sample.objects.get(sample_id=key)
+	for key in metrics_dict:
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = CalculatedSexMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+		sample_analysis_obj = get_sample_analysis(sample_analysis_map, key)
+		sample_analyses.append(sample_analysis_obj)
 
-			sample_data = qc_metrics_dict[key]
+		def get_row(sample_analysis_obj=sample_analysis_obj, key=key):
 
-			new_depth_obj = CalculatedSexMetrics(sample_analysis = sample_analysis_obj,
-												calculated_sex = sample_data[sex_key])
-			new_depth_obj.save()
+			return get_sample_data(sample_analysis_obj, metrics_dict[key])
 
+		new_rows.append((sample_analysis_obj, (), get_row))
 
-def add_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
+	return bulk_add_metrics(model, new_rows, sample_analyses)
+
+
+def add_hs_metrics(hs_metrics_dict, run_analysis_obj):
 	"""
-	Add data from picard alignment metrics files to database.
+	Add data from picard hs metrics files to database.
 
 	"""
 
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-	for key in alignment_metrics_dict:
+		del sample_data['sample']
+		del sample_data['library']
+		del sample_data['read_group']
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+		return sample_data
 
-		for metric in alignment_metrics_dict[key]:
+	add_per_sample_metrics(SampleHsMetrics, hs_metrics_dict, run_analysis_obj, get_sample_data)
 
+def add_depth_of_coverage_metrics(depth_metrics_dict, run_analysis_obj):
+	"""
+	Add data from depth of coverage summary files to database.
 
-			existing_data = AlignmentMetrics.objects.filter(sample_analysis= sample_analysis_obj,
-															category = metric['category'])
+	"""
 
-			if len(existing_data) < 1:
-				
-				sample_data = metric
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-				sample_data['sample_analysis'] = sample_analysis_obj
+		del sample_data['sample_id']
 
-				for key in sample_data:
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-					if sample_data[key] == '?' or sample_data[key] == '':
+		return sample_data
 
-						sample_data[key] = None
+	add_per_sample_metrics(SampleDepthofCoverageMetrics, depth_metrics_dict, run_analysis_obj, get_sample_data)
 
-				new_alignment_obj = AlignmentMetrics(**sample_data)
-				new_alignment_obj.save()
 
+def add_duplication_metrics(duplication_metrics_dict, run_analysis_obj):
+	"""
+	Add data from picard mark duplicates summary files to database.
 
-def add_dragen_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
 	"""
-	Add data from dragen mapping metrics files to database.
 
+	def get_sample_data(sample_analysis_obj, sample_data):
+
+		sample_data['sample_analysis'] = sample_analysis_obj
+
+		return sample_data
+
+	add_per_sample_metrics(DuplicationMetrics, duplication_metrics_dict, run_analysis_obj, get_sample_data)
+		
+def add_contamination_metrics(contamination_metrics_dict, run_analysis_obj):
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	Add data from contamination summary files to database.
 
-	for key in alignment_metrics_dict:
+	"""
 
-		sample_obj = Sample.objects.get(sample_id=key)
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-		existing_data = DragenAlignmentMetrics.objects.filter(sample_analysis= sample_analysis_obj)
+		return set_null_values(sample_data)
 
-		if len(existing_data) < 1:
+	add_per_sample_metrics(ContaminationMetrics, contamination_metrics_dict, run_analysis_obj, get_sample_data)
 
-			sample_data = alignment_metrics_dict[key]
-			
-			sample_data['sample_analysis'] = sample_analysis_obj
+def add_sex_metrics(qc_metrics_dict, run_analysis_obj, sex_key):
+	"""
+	Add data from sex calculation files to database.
+
+	"""
 
-			for key in sample_data:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-				if sample_data[key] == 'NA' or sample_data[key] == '':
+		return {'sample_analysis': sample_analysis_obj, 'calculated_sex': sample_data[sex_key]}
 
-					sample_data[key] = None
+	add_per_sample_metrics(CalculatedSexMetrics, qc_metrics_dict, run_analysis_obj, get_sample_data)
 
-			new_dragen_alignment_obj = DragenAlignmentMetrics(**sample_data)
-			new_dragen_alignment_obj.save()
 
-def add_variant_calling_metrics(variant_metrics_dict, run_analysis_obj):
+def add_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
 	"""
-	Add data from picard variant calling metrics files to database.
+	Add data from picard alignment metrics files to database.
 
 	"""
 
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	sample_analysis_map = get_sample_analysis_map(run_analysis_obj)
 
+	new_rows = []
+	sample_analyses = []
 
-	for key in variant_metrics_dict:
+	for key in alignment_metrics_dict:
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		sample_analysis_obj = get_sample_analysis(sample_analysis_map, key)
+		sample_analyses.append(sample_analysis_obj)
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = VariantCallingMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+		for metric in alignment_metrics_dict[key]:
 
-			sample_data = variant_metrics_dict[key]
+			def get_sample_data(metric=metric, sample_analysis_obj=sample_analysis_obj):
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+				metric['sample_analysis'] = sample_analysis_obj
 
-			for key in sample_data:
+				return metric
 
-				if sample_data[key] == '?' or sample_data[key] == '':
+			new_rows.append((sample_analysis_obj, (metric['category'],), get_sample_data))
 
-					sample_data[key] = None
+	bulk_add_metrics(AlignmentMetrics, new_rows, sample_analyses, ('category',))
 
-			new_variant_obj = VariantCallingMetrics(**sample_data)
-			new_variant_obj.save()
 
-def add_insert_metrics(insert_metrics_dict, run_analysis_obj):
+def add_dragen_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
 	"""
-	Add data from picard insert metrics files to database.
+	Add data from dragen mapping metrics files to database.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in insert_metrics_dict:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = InsertMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-			sample_data = insert_metrics_dict[key]
+		return set_null_values(sample_data, ('NA', ''))
 
-			sample_data['sample_analysis'] = sample_analysis_obj
-			
-			for key in sample_data:
+	add_per_sample_metrics(DragenAlignmentMetrics, alignment_metrics_dict, run_analysis_obj, get_sample_data)
 
-				if sample_data[key] == '?' or sample_data[key] == '':
+def add_variant_calling_metrics(variant_metrics_dict, run_analysis_obj):
+	"""
+	Add data from picard variant calling metrics files to database.
 
-					sample_data[key] = None
+	"""
 
-			new_insert_obj = InsertMetrics(**sample_data)
-			new_insert_obj.save()
+	def get_sample_data(sample_analysis_obj, sample_data):
 
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-def add_variant_count_metrics(variant_count_metrics_dict, run_analysis_obj):
+		return sample_data
 
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
+	add_per_sample_metrics(VariantCallingMetrics, variant_metrics_dict, run_analysis_obj, get_sample_data)
 
-	for key in variant_count_metrics_dict:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
+def add_insert_metrics(insert_metrics_dict, run_analysis_obj):
+	"""
+	Add data from picard insert metrics files to database.
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = VCFVariantCount.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	"""
+
+	def get_sample_data(sample_analysis_obj, sample_data):
+
+		sample_data['sample_analysis'] = sample_analysis_obj
+
+		return sample_data
+
+	add_per_sample_metrics(InsertMetrics, insert_metrics_dict, run_analysis_obj, get_sample_data)
+
+
+def add_variant_count_metrics(variant_count_metrics_dict, run_analysis_obj):
+
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-			sample_data = variant_count_metrics_dict[key][key]
+		return {'sample_analysis': sample_analysis_obj, 'variant_count': sample_data[sample_analysis_obj.sample_id]}
 
-			new_count_obj = VCFVariantCount(sample_analysis = sample_analysis_obj, variant_count= sample_data)
-			new_count_obj.save()
+	add_per_sample_metrics(VCFVariantCount, variant_count_metrics_dict, run_analysis_obj, get_sample_data)
 
 def add_dragen_variant_calling_metrics(variant_metrics_dict, run_analysis_obj):
 	"""
 	Add data from the Dragen Variant Calling metrics files to database.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in variant_metrics_dict:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
-
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = DragenVariantCallingMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-			sample_data = variant_metrics_dict[key]
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-			sample_data['sample_analysis'] = sample_analysis_obj
-			
-			for key in sample_data:
+		return set_null_values(sample_data, ('NA', ''))
 
-				if sample_data[key] == 'NA' or sample_data[key] == '':
-
-					sample_data[key] = None
-
-			new_dragen_vc_obj = DragenVariantCallingMetrics(**sample_data)
-			new_dragen_vc_obj.save()
+	add_per_sample_metrics(DragenVariantCallingMetrics, variant_metrics_dict, run_analysis_obj, get_sample_data)
 
 def add_sensitivity_metrics(sensitivity_metrics, run_analysis_obj):
 	"""
@@ -501,33 +667,14 @@ def add_dragen_wgs_coverage_metrics(dragen_wgs_coverage_metrics, run_analysis_ob
 	Add data from the Dragen Variant Calling WGS coverage files to database.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
-
-	for key in dragen_wgs_coverage_metrics:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = DragenWGSCoverageMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
-
-			sample_data = dragen_wgs_coverage_metrics[key]
-
-			sample_data['sample_analysis'] = sample_analysis_obj
-			
-			for key in sample_data:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-				if sample_data[key] == 'NA' or sample_data[key] == ''  or sample_data[key] == 'inf':
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-					sample_data[key] = None
+		return set_null_values(sample_data, ('NA', '', 'inf'))
 
-			new_dragen_wgs_cov_obj = DragenWGSCoverageMetrics(**sample_data)
-			new_dragen_wgs_cov_obj.save()
+	add_per_sample_metrics(DragenWGSCoverageMetrics, dragen_wgs_coverage_metrics, run_analysis_obj, get_sample_data)
 
 def add_dragen_exonic_coverage_metrics(dragen_exonic_coverage_metrics, run_analysis_obj):
 
@@ -535,33 +682,14 @@ def add_dragen_exonic_coverage_metrics(dragen_exonic_coverage_metrics, run_analy
 	Add data from the Dragen Variant Calling WGS coverage files to database.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in dragen_exonic_coverage_metrics:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
-
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = DragenRegionCoverageMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-			sample_data = dragen_exonic_coverage_metrics[key]
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-			sample_data['sample_analysis'] = sample_analysis_obj
-			
-			for key in sample_data:
+		return set_null_values(sample_data, ('NA', '', 'inf'))
 
-				if sample_data[key] == 'NA' or sample_data[key] == ''  or sample_data[key] == 'inf':
-
-					sample_data[key] = None
-
-			new_dragen_region_cov_obj = DragenRegionCoverageMetrics(**sample_data)
-			new_dragen_region_cov_obj.save()
+	add_per_sample_metrics(DragenRegionCoverageMetrics, dragen_exonic_coverage_metrics, run_analysis_obj, get_sample_data)
 
 
 def add_dragen_ploidy_metrics(dragen_ploidy_metrics, run_analysis_obj):
@@ -570,43 +698,14 @@ def add_dragen_ploidy_metrics(dragen_ploidy_metrics, run_analysis_obj):
 	Add data from the Dragen ploidy files to database.
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
-
-	for key in dragen_ploidy_metrics:
-		
-		sample_obj = Sample.objects.get(sample_id=key)
-
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = DragenPloidyMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
-
-			sample_data = dragen_ploidy_metrics[key]
-
-			sample_data['sample_analysis'] = sample_analysis_obj
-			
-			for key in sample_data:
-
-				if sample_data[key] == 'NA' or sample_data[key] == ''  or sample_data[key] == 'inf':
-
-					sample_data[key] = None
-
-			new_dragen_ploidy_metrics_obj = DragenPloidyMetrics(sample_analysis=sample_analysis_obj, ploidy_estimation=sample_data['ploidy_estimation'])
-			new_dragen_ploidy_metrics_obj.save()
-
-
-
-
-
-
 
+	def get_sample_data(sample_analysis_obj, sample_data):
 
+		sample_data = set_null_values(sample_data, ('NA', '', 'inf'))
 
+		return {'sample_analysis': sample_analysis_obj, 'ploidy_estimation': sample_data['ploidy_estimation']}
 
+	add_per_sample_metrics(DragenPloidyMetrics, dragen_ploidy_metrics, run_analysis_obj, get_sample_data)
 
 
 def add_fusion_contamination_metrics(contamination_metrics_dict, run_analysis_obj):
@@ -614,27 +713,14 @@ def add_fusion_contamination_metrics(contamination_metrics_dict, run_analysis_ob
 	Add data from fusion contamination file to database
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
-
-	for key in contamination_metrics_dict:
-
-		sample_obj = Sample.objects.get(sample_id=key)
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = FusionContamination.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-			sample_data = contamination_metrics_dict[key]
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+		return sample_data
 
-			new_fusion_contamination_obj = FusionContamination(**sample_data)
-			new_fusion_contamination_obj.save()
+	add_per_sample_metrics(FusionContamination, contamination_metrics_dict, run_analysis_obj, get_sample_data)
 
 
 def add_fusion_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
@@ -642,27 +728,14 @@ def add_fusion_alignment_metrics(alignment_metrics_dict, run_analysis_obj):
 	Add data from fusion alignments file to database
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
 
-	for key in alignment_metrics_dict:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-		sample_obj = Sample.objects.get(sample_id=key)
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = FusionAlignmentMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
-
-			sample_data = alignment_metrics_dict[key]
+		return sample_data
 
-			sample_data['sample_analysis'] = sample_analysis_obj
-
-			new_fusion_alignments_obj = FusionAlignmentMetrics(**sample_data)
-			new_fusion_alignments_obj.save()
+	add_per_sample_metrics(FusionAlignmentMetrics, alignment_metrics_dict, run_analysis_obj, get_sample_data)
 
 
 def add_custom_coverage_metrics(coverage_metrics_dict, run_analysis_obj):
@@ -670,24 +743,11 @@ def add_custom_coverage_metrics(coverage_metrics_dict, run_analysis_obj):
 	Add data from custom coverage metrics file to database
 
 	"""
-	pipeline = run_analysis_obj.pipeline
-	run = run_analysis_obj.run
-
-	for key in coverage_metrics_dict:
 
-		sample_obj = Sample.objects.get(sample_id=key)
-
-		sample_analysis_obj = SampleAnalysis.objects.get(sample=sample_obj,
-														run=run,
-														pipeline = pipeline)
-		
-		existing_data = CustomCoverageMetrics.objects.filter(sample_analysis= sample_analysis_obj)
-		
-		if len(existing_data) < 1:
+	def get_sample_data(sample_analysis_obj, sample_data):
 
-			sample_data = coverage_metrics_dict[key]
+		sample_data['sample_analysis'] = sample_analysis_obj
 
-			sample_data['sample_analysis'] = sample_analysis_obj
+		return sample_data
 
-			new_custom_coverage_obj = CustomCoverageMetrics(**sample_data)
-			new_custom_coverage_obj.save()
\ No newline at end of file
+	add_per_sample_metrics(CustomCoverageMetrics, coverage_metrics_dict, run_analysis_obj, get_sample_data)
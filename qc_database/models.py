@@ -1,9 +1,98 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.utils import timezone
 from auditlog.registry import auditlog
 from auditlog.models import AuditlogHistoryField
 
 
+class ChangeTrackingMixin:
+	"""
+	Remembers the field values an object was loaded with so save() can skip \
+	the UPDATE when nothing has changed and otherwise only write the changed columns.
+
+	Saves with update_fields given, and saves of new objects, work as normal.
+
+	Set track_changes = False on the class to always save every field.
+
+	"""
+
+	track_changes = True
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+
+		instance = super().from_db(db, field_names, values)
+		instance.store_loaded_values()
+
+		return instance
+
+	def store_loaded_values(self, fields=None):
+
+		if getattr(self, '_loaded_values', None) == None:
+
+			self._loaded_values = {}
+
+		deferred = self.get_deferred_fields()
+
+		for field in self._meta.concrete_fields:
+
+			if field.attname in deferred:
+
+				continue
+
+			if fields == None or field.attname in fields or field.name in fields:
+
+				self._loaded_values[field.attname] = getattr(self, field.attname)
+
+	def get_changed_fields(self):
+
+		loaded_values = getattr(self, '_loaded_values', None) or {}
+
+		changed = []
+
+		for field in self._meta.concrete_fields:
+
+			if field.primary_key or field.attname not in loaded_values:
+
+				continue
+
+			if getattr(self, field.attname) != loaded_values[field.attname]:
+
+				changed.append(field.attname)
+
+		return changed
+
+	def save(self, *args, **kwargs):
+
+		if self.track_changes == True and self._state.adding == False and kwargs.get('update_fields') == None and getattr(self, '_loaded_values', None):
+
+			changed = self.get_changed_fields()
+
+			if len(changed) == 0:
+
+				return
+
+			# auto_now fields are only set by save so won't show up as changed
+			for field in self._meta.concrete_fields:
+
+				if getattr(field, 'auto_now', False) == True and field.attname not in changed:
+
+					changed.append(field.attname)
+
+			kwargs['update_fields'] = changed
+
+		super().save(*args, **kwargs)
+
+		self.store_loaded_values(kwargs.get('update_fields'))
+
+	def refresh_from_db(self, *args, **kwargs):
+
+		super().refresh_from_db(*args, **kwargs)
+
+		self.store_loaded_values(kwargs.get('fields'))
+
+
 class Instrument(models.Model):
 	"""
 	Model to hold a sequencer
@@ -43,10 +132,95 @@ class Run(models.Model):
 	num_indexes = models.IntegerField(blank=True, null=True)
 	length_index1 = models.IntegerField(blank=True, null=True)
 	length_index2 = models.IntegerField(blank=True, null=True)
+
+	# the sample sheet when it was last ingested - unchanged sheets aren't parsed again
+	sample_sheet_size = models.BigIntegerField(blank=True, null=True)
+	sample_sheet_mtime = models.BigIntegerField(blank=True, null=True)
+	sample_sheet_hash = models.CharField(max_length=40, blank=True, null=True)
+
+	# result of checking the copied run folder against its checksum manifest - see copy_verification
+	copy_verification = models.CharField(max_length=20, blank=True, null=True)
+	copy_verified_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			# ngs_kpis view - runs between two dates
+			models.Index(fields=['instrument_date'], name='run_instrument_date_idx'),
+		]
 	
 	def __str__(self):
 		return str(self.run_id)
-	
+
+	def sample_sheet_is_unchanged(self, fingerprint):
+		"""
+		Is the (size, mtime, hash) fingerprint the same sample sheet we last ingested.
+
+		"""
+
+		return self.sample_sheet_hash != None and self.sample_sheet_hash == fingerprint[2]
+
+	def set_sample_sheet_fingerprint(self, fingerprint):
+
+		self.sample_sheet_size, self.sample_sheet_mtime, self.sample_sheet_hash = fingerprint
+		self.save(update_fields=['sample_sheet_size', 'sample_sheet_mtime', 'sample_sheet_hash'])
+
+
+class RunFolderScan(models.Model):
+	"""
+	An entry in the scan manifest for a folder in one of the raw data archives.
+
+	Records the folder mtime and copy complete state seen on the last scan so
+	update_database can skip folders which have not changed since they were ingested.
+
+	"""
+
+	path = models.CharField(max_length=1000, primary_key=True)
+	run_id = models.CharField(max_length=50)
+	mtime = models.FloatField()
+	copy_complete = models.BooleanField(default=False)
+	ingested = models.BooleanField(default=False)
+	last_scanned = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return self.path
+
+	def is_unchanged(self, mtime):
+		"""
+		Can we skip this folder? - the folder must not have changed and either
+		be ingested already or still be waiting for the copy to complete.
+		"""
+
+		if self.mtime != mtime:
+
+			return False
+
+		return self.ingested == True or self.copy_complete == False
+
+
+class RunFileChecksum(models.Model):
+	"""
+	The checksum of a file in a copied run folder compared with the copy's manifest.
+
+	Kept so a check which is interrupted carries on where it stopped and files \
+	which haven't changed aren't hashed again.
+
+	"""
+
+	run_folder = models.CharField(max_length=1000)
+	path = models.CharField(max_length=1000)
+	size = models.BigIntegerField()
+	mtime = models.BigIntegerField()
+	expected = models.CharField(max_length=128)
+	actual = models.CharField(max_length=128, blank=True, null=True)
+	ok = models.BooleanField(default=False)
+	checked_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		unique_together = [['run_folder', 'path']]
+
+	def __str__(self):
+		return f'{self.run_folder}/{self.path}'
+
 
 class InteropRunQuality(models.Model):
 	"""
@@ -71,6 +245,11 @@ class InteropRunQuality(models.Model):
 	reads_pf = models.BigIntegerField()
 	yield_g = models.DecimalField(max_digits=10, decimal_places=3)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['run', 'read_number', 'lane_number'], name='interop_run_read_lane_idx'),
+		]
+
 	def __str__(self):
 		return str(self.run.run_id) + '_' + str(self.read_number) + '_' + str(self.lane_number)
 
@@ -139,7 +318,7 @@ class AnalysisType(models.Model):
 		return self.analysis_type_id
 
 
-class RunAnalysis(models.Model):
+class RunAnalysis(ChangeTrackingMixin, models.Model):
 	"""
 	A run analysis is a Run object which has been analysed with \
 	specific Pipeline and a specific AnalysisType.
@@ -175,90 +354,50 @@ class RunAnalysis(models.Model):
 	min_sensitivity = models.DecimalField(max_digits=6, decimal_places=3, null=True, blank=True)
 	min_fusion_aligned_reads_unique = models.IntegerField(null=True, blank=True)
 
+	# when update_database should next look at the filesystem - None once the run is complete and valid
+	next_check_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+	check_backoff = models.IntegerField(default=0)
+
 	history = AuditlogHistoryField()
 
 	class Meta:
 		unique_together = [['run', 'pipeline', 'analysis_type']]
+		indexes = [
+			# home and archive pages - filter on watching and order by run
+			models.Index(fields=['watching', 'run'], name='runanalysis_watching_run_idx'),
+			models.Index(fields=['signoff_date'], name='runanalysis_signoff_date_idx'),
+			# run analyses due a check
+			models.Index(fields=['watching', 'next_check_at'], name='runanalysis_next_check_idx'),
+		]
 
 	def __str__(self):
 		return self.run.run_id + '_' + self.pipeline.pipeline_id + '_' + self.analysis_type.analysis_type_id
 
-	def get_n_samples_completed(self):
-
-		count = 0
+	def reset_check_schedule(self):
+		"""
+		Check the filesystem again on the next update_database pass.
+		"""
 
-		sample_analyses = SampleAnalysis.objects.filter(run = self.run,
-														pipeline = self.pipeline,
-														analysis_type = self.analysis_type
-														)
+		self.next_check_at = timezone.now()
+		self.check_backoff = 0
 
-		completed = [x.results_completed for x in sample_analyses]
+	def get_n_samples_completed(self):
 
-		return completed.count(True), len(completed)
+		from qc_database.auto_qc import RunAnalysisQC
 
+		return RunAnalysisQC(self).get_n_samples_completed()
 
 	def get_n_samples_valid(self):
 
-		count = 0
-
-		sample_analyses = SampleAnalysis.objects.filter(run = self.run,
-														pipeline = self.pipeline,
-														analysis_type = self.analysis_type
-														)
-
-		completed = [x.results_valid for x in sample_analyses]
-
-		return completed.count(True), len(completed)
-
-
-	def passes_run_level_qc(self):
-
-		interop_qualities = InteropRunQuality.objects.filter(run = self.run)
-
-		for interop_quality in interop_qualities:
+		from qc_database.auto_qc import RunAnalysisQC
 
-			if interop_quality.percent_q30 < (self.min_q30_score*100):
-
-				return False
-
-		return True
-
-	def get_ntc_sample(self, worksheet):
-
-		samples = SampleAnalysis.objects.filter(run = self.run,
-												pipeline = self.pipeline,
-												analysis_type = self.analysis_type,
-												worksheet = worksheet
-												)
-
-		ntc_samples = []
-
-		for sample in samples:
-
-			for ntc_marker in ['ntc', 'NTC']:
-
-				if ntc_marker in sample.sample_id:
-
-					ntc_samples.append(sample)
-
-		return ntc_samples
+		return RunAnalysisQC(self).get_n_samples_valid()
 
 	def get_worksheets(self):
 
-		worksheets = []
-
-		samples = SampleAnalysis.objects.filter(
-			run = self.run,
-			pipeline = self.pipeline,
-			analysis_type = self.analysis_type
-			)
-
-		for sample in samples:
-
-			worksheets.append(sample.worksheet.worksheet_id)
-
-		return '|'.join(list(set(worksheets)))
+		from qc_database.auto_qc import RunAnalysisQC
 
+		return RunAnalysisQC(self).get_worksheets()
 
 	def passes_sensitivity(self):
 
@@ -289,161 +428,65 @@ class RunAnalysis(models.Model):
 				return False
 
 
-	def passes_auto_qc(self):
+	def refresh_summary(self, run_analysis_qc=None):
 		"""
-		Check whether the run analysis passes all QC checks.
+		Update the RunAnalysisSummary row used by the home and archive pages.
 
-		Reads from config file to find out which checks to complete.
+		Call whenever the sample analyses or metrics for this run analysis change.
 
 		"""
 
-		checks_to_do = self.auto_qc_checks
-
-		if checks_to_do == None:
-
-			return False, ['No Configuration For this Pipeline.']
-
-		checks_to_do = checks_to_do.split(',')
-
-		samples = SampleAnalysis.objects.filter(run = self.run,
-												pipeline = self.pipeline,
-												analysis_type = self.analysis_type)
-
-
-		# check is complete and valid
-
-		new_samples_list = []
-
-		reasons_to_fail = []
-
-		if self.demultiplexing_completed == False:
-
-			reasons_to_fail.append('Demultiplexing not complete for some samples')
-
-		if self.demultiplexing_valid == False:
-
-			reasons_to_fail.append( 'Demultiplexing not valid for some samples')
-
-		if self.results_completed == False:
-
-			return False,['Run results not completed']
-
-		if self.results_valid == False:
-
-			return False,['Run results not valid']
-
-		for sample in samples:
-
-			if sample.results_completed == False:
-
-				reasons_to_fail.append('Results not complete for some samples')
-
-			if sample.results_valid == False:
-
-				reasons_to_fail.append('Results not valid for some samples')
-
-
-			if sample.sample.is_ntc() == False:
-
-				new_samples_list.append(sample)
-
-		if 'pct_q30' in checks_to_do:
-
-			if self.passes_run_level_qc() == False:
-
-				reasons_to_fail.append('Q30 Fail')
-
-		if 'contamination' in checks_to_do:
-
-			for sample in new_samples_list:
-
-				if sample.passes_contamination() == False:
-
-					reasons_to_fail.append('Contamination Fail')
-
-		if 'ntc_contamination' in checks_to_do:
-
-			for sample in new_samples_list:
-
-				if sample.passes_ntc_contamination() != True:
-
-					reasons_to_fail.append('NTC Contamination Fail')
-
-		if 'sex_match' in checks_to_do:
-
-			for sample in new_samples_list:
-
-				if sample.passes_sex_check() == False:
-
-					reasons_to_fail.append('Sex Match Fail')
-
-		if 'variant_check' in checks_to_do:
-
-			for sample in new_samples_list:
-
-				if sample.passes_variant_count_check() == False:
-
-					reasons_to_fail.append('Variant Count Fail')
-
-		if 'sensitivity' in checks_to_do:
-
-			if self.passes_sensitivity() == False:
-
-				reasons_to_fail.append('Low Sensitivity')
-
-		if 'coverage' in checks_to_do:
-			
-			for sample in new_samples_list:
-
-				if sample.passes_region_coverage_over_20() == False:
-
-					reasons_to_fail.append('Low Coverage >20x')
-
-		if 'titv' in checks_to_do:
-
-			for sample in new_samples_list:
+		from qc_database.auto_qc import RunAnalysisQC
 
-				if sample.passes_titv() == False:
+		if run_analysis_qc == None:
 
-					reasons_to_fail.append('Titv Ratio out of range for at least one sample')
+			run_analysis_qc = RunAnalysisQC(self)
 
-		if 'fastqc' in checks_to_do:
+		n_samples_completed, n_samples = run_analysis_qc.get_n_samples_completed()
+		n_samples_valid, n_samples = run_analysis_qc.get_n_samples_valid()
 
-			for sample in new_samples_list:
-
-				if sample.passes_fastqc() == False:
-
-					reasons_to_fail.append('FASTQC Fail')
+		try:
 
+			auto_qc_pass, auto_qc_reasons = run_analysis_qc.passes_auto_qc()
 
-		if 'fusion_contamination' in checks_to_do:
+		# missing or duplicated metrics - database errors are left to abort the caller's transaction
+		except (ObjectDoesNotExist, MultipleObjectsReturned, TypeError):
 
-			for sample in new_samples_list:
+			auto_qc_pass, auto_qc_reasons = None, ['Could not evaluate auto QC']
 
-				if sample.passes_fusion_contamination() == False:
+		summary, created = RunAnalysisSummary.objects.get_or_create(run_analysis = self)
 
-					reasons_to_fail.append('Fusion Contamination Fail')
+		summary.n_samples = n_samples
+		summary.n_samples_completed = n_samples_completed
+		summary.n_samples_valid = n_samples_valid
+		summary.worksheets = run_analysis_qc.get_worksheets()
+		summary.auto_qc_pass = auto_qc_pass
+		summary.auto_qc_reasons = '|'.join(sorted(auto_qc_reasons))
 
-		if 'fusion_alignment' in checks_to_do:
+		# only written if something has changed
+		summary.save()
 
-			for sample in new_samples_list:
+		return summary
 
-				if sample.passes_fusion_aligned_reads_duplicates() == False:
+	def passes_auto_qc(self):
+		"""
+		Check whether the run analysis passes all QC checks.
 
-					reasons_to_fail.append('Fusion Aligned Reads Unique Fail')	
+		Reads from config file to find out which checks to complete.
 
-		if len(reasons_to_fail) ==0:
+		The checks are evaluated by RunAnalysisQC which loads all the metrics for the \
+		run analysis up front - use it directly if you also need the per sample results.
 
-			return True, ['All Pass']
+		"""
 
-		else:
+		from qc_database.auto_qc import RunAnalysisQC
 
-			return False, list(set(reasons_to_fail))
+		return RunAnalysisQC(self).passes_auto_qc()
 
 
 
 
-class SampleAnalysis(models.Model):
+class SampleAnalysis(ChangeTrackingMixin, models.Model):
 	"""
 	A SampleAnalysis object is a Sample analysed on a specific Run with a specific Pipeline on \
 	a specific AnalysisType.
@@ -457,6 +500,8 @@ class SampleAnalysis(models.Model):
 	worksheet = models.ForeignKey(WorkSheet, on_delete=models.CASCADE)
 	results_completed = models.BooleanField(default = False)
 	results_valid = models.BooleanField(default=False)
+	# fingerprint of the sample's result directories when results_completed and results_valid were last worked out
+	results_fingerprint = models.CharField(max_length=40, null=True, blank=True)
 	sex = models.CharField(max_length=10, null=True, blank=True)
 	contamination_cutoff = models.DecimalField(max_digits=6, decimal_places=3, default=0.15, null=True, blank=True)
 	ntc_contamination_cutoff = models.DecimalField(max_digits=6, decimal_places=3, default=10.0, null=True, blank=True)
@@ -464,143 +509,16 @@ class SampleAnalysis(models.Model):
 	history = AuditlogHistoryField()
 
 	class Meta:
+		# the unique_together index also covers lookups on (sample, run, pipeline) as it is a prefix of it
 		unique_together = [['sample', 'run', 'pipeline', 'analysis_type', 'worksheet']]
+		indexes = [
+			# all the sample analyses for a run analysis
+			models.Index(fields=['run', 'pipeline', 'analysis_type'], name='sampleanalysis_run_pipe_idx'),
+		]
 
 	def __str__(self):
 		return f'{self.run.run_id}_{self.pipeline.pipeline_id}_{self.analysis_type.analysis_type_id}_{self.sample.sample_id}'
 
-	def passes_fastqc(self):
-		"""
-		Does the sample have a PASS for the key FASTQC metrics?
-		"""
-
-		fastqc_objs = SampleFastqcData.objects.filter(sample_analysis=self)
-
-		if len(fastqc_objs) == 0:
-
-			return None
-
-		for fastqc in fastqc_objs:
-
-			if fastqc.basic_statistics == 'FAIL':
-
-				return False
-
-			elif fastqc.per_base_sequencing_quality == 'FAIL':
-
-				return False
-
-			elif fastqc.per_tile_sequence_quality == 'FAIL': 
-
-				return False
-
-			elif fastqc.per_sequence_quality_scores == 'FAIL': 
-
-				return False
-
-			elif fastqc.per_base_n_content == 'FAIL': 
-
-				return False
-
-		return True
-
-	def get_total_reads(self):
-
-		try:
-
-			hs_metrics_obj = SampleHsMetrics.objects.get(sample_analysis= self)
-			return hs_metrics_obj.total_reads
-
-		except:
-
-			try:
-
-				dragen_alignment_metrics = DragenAlignmentMetrics.objects.get(sample_analysis= self)
-				return dragen_alignment_metrics.total_input_reads
-
-			except:
-
-				pass
-
-		return None
-
-	def get_contamination(self):
-
-
-		if 'DragenWGS' in self.pipeline.pipeline_id:
-
-			contamination_obj = DragenAlignmentMetrics.objects.get(sample_analysis=self)
-
-			return contamination_obj.estimated_sample_contamination
-
-		else:
-
-			try:
-
-				contamination_obj = ContaminationMetrics.objects.get(sample_analysis=self)
-
-			except:
-
-				return 'NA'
-
-
-		return contamination_obj.freemix
-
-	def passes_contamination(self):
-
-		try:
-			contamination = self.get_contamination()
-		except:
-			return None
-
-		if contamination > self.contamination_cutoff:
-
-				return False
-
-		return True
-
-	def passes_ntc_contamination(self):
-
-		run_analysis = RunAnalysis.objects.get(run = self.run,
-											pipeline = self.pipeline,
-											analysis_type = self.analysis_type
-												)
-
-		total_reads = self.get_total_reads()
-
-		if total_reads == None:
-
-			return 'Cannot count reads for sample.'
-
-		ntc_objs = run_analysis.get_ntc_sample(self.worksheet)
-
-		if len(ntc_objs) == 0:
-
-			return False
-
-		for ntc in ntc_objs:
-
-			ntc_reads = ntc.get_total_reads()
-
-			if self == ntc:
-
-				return 'NA'
-
-			if ntc_reads == None:
-
-				return 'Cannot count reads for sample.'
-
-			if ntc_reads == None:
-
-				return False
-
-			if (ntc_reads * self.ntc_contamination_cutoff) > total_reads:
-
-				return False
-
-
-		return True
-
 	def get_sex(self):
 
 		sex = self.sex
@@ -622,297 +540,31 @@ class SampleAnalysis(models.Model):
 			return 'NA'
 
 
-	def get_calculated_sex(self):
-
-		if 'DragenWGS' in self.pipeline.pipeline_id:
-
-			wgs_obj = DragenWGSCoverageMetrics.objects.get(sample_analysis=self)
-
-			if wgs_obj.predicted_sex_chromosome_ploidy is None:
-
-				wgs_obj = DragenPloidyMetrics.objects.get(sample_analysis=self)
-				
-				if wgs_obj.ploidy_estimation == 'XX':
-
-					return 'female'
-
-				elif wgs_obj.ploidy_estimation == 'XY':
-
-					return 'male'
-
-				else:
-
-					return 'unknown'
-
-			elif wgs_obj.predicted_sex_chromosome_ploidy == 'XX':
-
-				return 'female'
-
-			elif wgs_obj.predicted_sex_chromosome_ploidy == 'XY':
-
-				return 'male'
-
-			else:
-
-				return 'unknown'
-
-		else:
-
-			try:
-				sex_obj = CalculatedSexMetrics.objects.get(sample_analysis=self)
-			except:
-				return 'NA'
-
-			return sex_obj.calculated_sex.lower()
-
-	def passes_sex_check(self):
-
-		if self.get_calculated_sex() == 'unknown':
-
-			return False
-
-		if self.get_calculated_sex() == self.get_sex():
-
-			return True
-
-		return False
-
-	def get_run_analysis(self):
-
-		try:
-
-			run_analysis = RunAnalysis.objects.get(
-				run = self.run,
-				pipeline = self.pipeline,
-				analysis_type = self.analysis_type
-				)
-
-		except:
-
-			return None
-
-		return run_analysis
-
-	def get_variant_count(self):
-
-		if 'DragenWGS' in self.pipeline.pipeline_id:
-
-			variant_calling_metrics = DragenVariantCallingMetrics.objects.get(sample_analysis=self)
-
-			return variant_calling_metrics.total
-
-		else:
-
-			try:
-
-				variant_calling_metrics = VariantCallingMetrics.objects.get(sample_analysis=self)
-
-				return variant_calling_metrics.total_snps + variant_calling_metrics.total_indels + variant_calling_metrics.total_complex_indels
-
-			except:
-
-				try:
-
-					variant_count_metrics = VCFVariantCount.objects.get(sample_analysis=self)
-
-					return variant_count_metrics.variant_count
-
-				except:
-
-					pass
-
-			return 'NA'
-
-	def passes_variant_count_check(self):
-
-		run_analysis = self.get_run_analysis()
-
-		if run_analysis == None:
-
-			return False
-
-		min_variants = run_analysis.min_variants
-		max_variants = run_analysis.max_variants
-
-		variant_count = self.get_variant_count()
-
-		if variant_count == 'NA':
-
-			return False
-
-		else:
-
-			if variant_count > min_variants and variant_count < max_variants:
-
-				return True
-
-		return False
-
-	def get_region_coverage_over_20(self):
-
-		try:
-			coverage = DragenRegionCoverageMetrics.objects.get(sample_analysis = self)
-		except:
-			
-			try:
-				coverage = CustomCoverageMetrics.objects.filter(sample_analysis = self)
-
-				if len(coverage) != 1:
-
-					return None
-
-				else:
-
-					return coverage[0].pct_greater_20x
-
-			except:
-				return None
-
-
-
-
-
-		return coverage.pct_of_qc_coverage_region_with_coverage_20x_inf
-
-	def passes_region_coverage_over_20(self):
-
-		run_analysis = self.get_run_analysis()
-
-		if run_analysis == None:
-
-			return False
-
-		min_cov = run_analysis.min_coverage
-
-		cov_gtr_20 = self.get_region_coverage_over_20()
-
-		if cov_gtr_20 == None:
-
-			return False
-
-		else:
-
-			if cov_gtr_20 >= min_cov:
-
-				return True
-
-		return False
-
-	def get_titv(self):
-
-		try:
-			titv = DragenVariantCallingMetrics.objects.filter(sample_analysis = self)
-		except:
-			return None
-
-		if len(titv) != 1:
-
-			return None
-
-		else:
-
-			return titv[0].titv_ratio
-
-
-	def passes_titv(self):
-
-		titv = self.get_titv()
-
-		run_analysis = self.get_run_analysis()
-
-		if run_analysis == None:
-
-			return False
-
-		min_titv = run_analysis.min_titv
-		max_titv = run_analysis.max_titv
-
-		if titv < min_titv:
-
-			return False
-
-		if titv > max_titv:
-
-			return False
-
-		return True
-
-
-	def get_aligned_reads_fusion(self):
-
-		try:
-			alignment_metrics = FusionAlignmentMetrics.objects.filter(sample_analysis = self)
-		except:
-			return None
-
-		if len(alignment_metrics) != 1:
-
-			return None
-
-		else:
-
-			return alignment_metrics[0]
-
-
-	def get_contamination_fusion(self):
-
-		try:
-			contamination_metrics = FusionContamination.objects.filter(sample_analysis = self)
-		except:
-			return None
-
-		if len(contamination_metrics) != 1:
-
-			return None
-
-		else:
-
-			return contamination_metrics[0].contamination
-
-	def get_contamination_referral_fusion(self):
-
-		try:
-			contamination_metrics = FusionContamination.objects.filter(sample_analysis = self)
-		except:
-			return None
-
-		if len(contamination_metrics) != 1:
-
-			return None
-
-		else:
-
-			return contamination_metrics[0].contamination_referral
-
-	def passes_fusion_contamination(self):
-
-		if self.get_contamination_fusion() == True:
-
-			return False
-
-		elif self.get_contamination_referral_fusion() == True:
-
-			return False
-
-		else:
-
-			return True
-
-	def passes_fusion_aligned_reads_duplicates(self):
+class RunAnalysisSummary(ChangeTrackingMixin, models.Model):
+	"""
+	Denormalised counts and auto QC result for a RunAnalysis so the list pages \
+	don't have to query the sample analyses for every row.
 
-		run_analysis = self.get_run_analysis()
+	Kept up to date by RunAnalysis.refresh_summary()
 
-		aligned_reads = self.get_aligned_reads_fusion()
+	"""
 
-		if aligned_reads == None:
+	run_analysis = models.OneToOneField(RunAnalysis, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+	n_samples = models.IntegerField(default=0)
+	n_samples_completed = models.IntegerField(default=0)
+	n_samples_valid = models.IntegerField(default=0)
+	worksheets = models.TextField(blank=True)
+	auto_qc_pass = models.BooleanField(null=True, blank=True)
+	auto_qc_reasons = models.TextField(blank=True)
+	last_updated = models.DateTimeField(auto_now=True)
 
-			return False
+	def __str__(self):
+		return str(self.run_analysis_id)
 
-		if aligned_reads.unique_reads_aligned < run_analysis.min_fusion_aligned_reads_unique:
+	def get_auto_qc_reasons(self):
 
-			return False
+		return self.auto_qc_reasons.split('|')
 
-		return True
 
 class SampleFastqcData(models.Model):
 	"""
@@ -935,6 +587,11 @@ class SampleFastqcData(models.Model):
 	adapter_content = models.CharField(max_length=10)
 	kmer_content = models.CharField(max_length=10, null=True, blank=True)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['sample_analysis', 'read_number', 'lane'], name='fastqc_sa_read_lane_idx'),
+		]
+
 	def __str__(self):
 		return f'{self.sample_analysis}_{self.read_number}_{self.lane}'
 
@@ -1112,6 +769,11 @@ class AlignmentMetrics(models.Model):
 	pct_chimeras = models.DecimalField(max_digits=6, decimal_places=4)
 	pct_adapter = models.DecimalField(max_digits=6, decimal_places=4)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['sample_analysis', 'category'], name='alignment_sa_category_idx'),
+		]
+
 	def __str__(self):
 		return str(self.sample_analysis) + '_' + self.category
 
@@ -1202,6 +864,11 @@ class InteropIndexMetrics(models.Model):
 	run = models.ForeignKey(Run, on_delete=models.CASCADE)
 	pct_reads_identified = models.DecimalField(max_digits=10, decimal_places=3)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['run', 'sample'], name='interop_index_run_sample_idx'),
+		]
+
 	def __str__(self):
 		return str(self.run) + '_' + str(self.sample)
 
@@ -1416,5 +1083,34 @@ class CustomCoverageMetrics(models.Model):
 	pct_greater_250x = models.DecimalField(max_digits=5, decimal_places=2, null=True)
 	pct_greater_160x = models.DecimalField(max_digits=5, decimal_places=2, null=True)
 
-auditlog.register(RunAnalysis)
-auditlog.register(SampleAnalysis)
+class SlackMessage(models.Model):
+	"""
+	Outbox for slack messages.
+
+	Messages are written in the same transaction as the change they describe and \
+	sent after it commits by qc_database.utils.slack - see send_pending_messages.
+
+	"""
+
+	text = models.TextField()
+	created = models.DateTimeField(auto_now_add=True)
+	sent = models.DateTimeField(null=True, blank=True)
+	attempts = models.IntegerField(default=0)
+	# None once we have given up
+	next_attempt_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+	last_error = models.TextField(null=True, blank=True)
+	# set while a sender is posting the message so two senders don't send it twice
+	claim = models.CharField(max_length=32, null=True, blank=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['sent', 'next_attempt_at'], name='slackmessage_pending_idx'),
+		]
+
+	def __str__(self):
+		return f'{self.pk} {self.text[:50]}'
+
+
+# scheduling fields change on every check so would flood the history
+auditlog.register(RunAnalysis, exclude_fields=['next_check_at', 'check_backoff'])
+auditlog.register(SampleAnalysis, exclude_fields=['results_fingerprint'])
@@ -1,5 +1,34 @@
 from django.test import TestCase
+from django.core.management import call_command
 from qc_database.models import *
+from qc_database import management_utils, ingestion, watcher, copy_verification
+from pipelines import parsers, quality_pipelines, germline_pipelines, dragen_pipelines, registry
+from pipelines.directory_snapshot import SnapshotCache
+from pipelines.config import compile_config, load_config, ConfigError
+from pipelines.metrics_cache import MetricsCache
+from pipelines.mount_guard import MountGuard, MountUnavailable
+from pipelines import integrity
+from pysam.libcbgzf import BGZFile
+from qc_database.auto_qc import RunAnalysisQC
+from qc_database.identity_map import IdentityMap, upsert_sample_analyses
+from auditlog.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from qc_database.utils.slack import message_slack, send_pending_messages
+from qc_database.utils.slack_stub import SlackStubServer
+from django.db import connection, DatabaseError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pathlib import Path
+import tempfile
+import hashlib
+import json
+import threading
+import gzip
+import time
+import datetime
+import os
+from unittest import mock
+import pandas as pd
 
 class TestAutoQC(TestCase):
 	"""
@@ -130,4 +159,1730 @@ class TestAutoQC(TestCase):
 		sex.calculated_sex = 'FEMALE'
 		sex.save()
 
-		self.assertEqual(run_analysis.passes_auto_qc(), (False, ['Sex Match Fail']))
\ No newline at end of file
+		self.assertEqual(run_analysis.passes_auto_qc(), (False, ['Sex Match Fail']))
+
+	def test_constant_queries(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=17)
+
+		with CaptureQueriesContext(connection) as queries:
+
+			run_analysis_qc = RunAnalysisQC(run_analysis)
+			auto_qc = run_analysis_qc.passes_auto_qc()
+
+		# one query for the samples, one for interop and one per metric table
+		self.assertTrue(len(queries) < 15)
+		self.assertEqual(auto_qc, run_analysis.passes_auto_qc())
+
+	def test_view_run_analysis(self):
+
+		for run_analysis in RunAnalysis.objects.all():
+
+			response = self.client.get(f'/run_analysis/{run_analysis.pk}/')
+
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(response.context['auto_qc'], run_analysis.passes_auto_qc())
+
+	def test_summary_refreshed(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+
+		# the pages only read the summaries and show a placeholder for missing ones
+		response = self.client.get('/')
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(RunAnalysisSummary.objects.count(), 0)
+		self.assertContains(response, 'Summary not made yet')
+		self.assertNotContains(response, 'Fail </td>')
+
+		response = self.client.get('/archived/')
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(RunAnalysisSummary.objects.count(), 0)
+
+		ingestion.refresh_missing_summaries()
+
+		self.assertEqual(RunAnalysisSummary.objects.count(), RunAnalysis.objects.count())
+
+		response = self.client.get('/')
+
+		self.assertNotContains(response, 'Summary not made yet')
+
+		summary = RunAnalysisSummary.objects.get(run_analysis=run_analysis)
+
+		self.assertEqual(summary.auto_qc_pass, True)
+		self.assertEqual(summary.n_samples, run_analysis.get_n_samples_completed()[1])
+		self.assertEqual(summary.worksheets, run_analysis.get_worksheets())
+
+		sex = CalculatedSexMetrics.objects.filter(sample_analysis__run=run_analysis.run, sample_analysis__pipeline=run_analysis.pipeline)[0]
+		sex.calculated_sex = 'FEMALE'
+		sex.save()
+
+		run_analysis.refresh_summary()
+		summary.refresh_from_db()
+
+		self.assertEqual(summary.auto_qc_pass, False)
+		self.assertEqual(summary.get_auto_qc_reasons(), ['Sex Match Fail'])
+
+		# missing metrics are recorded but database errors are not hidden
+		with mock.patch.object(RunAnalysisQC, 'passes_auto_qc', side_effect=TypeError('missing metric')):
+
+			run_analysis.refresh_summary()
+
+		summary.refresh_from_db()
+
+		self.assertEqual(summary.auto_qc_pass, None)
+		self.assertEqual(summary.get_auto_qc_reasons(), ['Could not evaluate auto QC'])
+
+		with mock.patch.object(RunAnalysisQC, 'passes_auto_qc', side_effect=DatabaseError('broken')):
+
+			with self.assertRaises(DatabaseError):
+
+				run_analysis.refresh_summary()
+
+
+class TestRunFolderScan(TestCase):
+	"""
+	Test that the scan manifest skips unchanged run folders
+	"""
+
+	def setUp(self):
+
+		self.archive_dir = tempfile.TemporaryDirectory()
+		self.run_folder = Path(self.archive_dir.name).joinpath('200101_M00766_0001_000000000-ABCDE')
+		self.run_folder.mkdir()
+
+	def tearDown(self):
+
+		self.archive_dir.cleanup()
+
+	def test_unchanged_folder_skipped(self):
+
+		run_folders = management_utils.get_changed_run_folders(self.archive_dir.name)
+
+		self.assertEqual([folder[0] for folder in run_folders], [self.run_folder])
+
+		# copy not complete and nothing changed so skip
+		management_utils.record_run_folder_scan(self.run_folder, run_folders[0][1], False, False)
+
+		self.assertEqual(management_utils.get_changed_run_folders(self.archive_dir.name), [])
+
+		# run_copy_complete.txt appears so the folder changes
+		self.run_folder.joinpath('run_copy_complete.txt').touch()
+		os.utime(self.run_folder, (run_folders[0][1] + 10, run_folders[0][1] + 10))
+
+		run_folders = management_utils.get_changed_run_folders(self.archive_dir.name)
+
+		self.assertEqual([folder[0] for folder in run_folders], [self.run_folder])
+
+		management_utils.record_run_folder_scan(self.run_folder, run_folders[0][1], True, True)
+
+		self.assertEqual(management_utils.get_changed_run_folders(self.archive_dir.name), [])
+		self.assertEqual(len(management_utils.get_changed_run_folders(self.archive_dir.name, full_scan=True)), 1)
+
+	def test_interop_cache_not_rescanned(self):
+
+		for name in ['run_copy_complete.txt', 'RunInfo.xml', 'RunParameters.xml']:
+
+			self.run_folder.joinpath(name).touch()
+
+		self.run_folder.joinpath('SampleSheet.csv').write_text('[Data]\nSample_ID,Sample_Plate,Description\nsample1,ws1,pipelineName=GermlineEnrichment;pipelineVersion=2.5.3;panel=IlluminaTruSightCancer\n')
+
+		def add_run_log_info(run_info, run_parameters, run_obj, raw_data, mount_guard):
+
+			# like the interop cache written into the run folder
+			raw_data.joinpath('.qc_database_interop_cache.json').write_text('{}')
+			os.utime(str(raw_data), (time.time() + 10, time.time() + 10))
+
+			return None
+
+		archives = [{'path': self.archive_dir.name, 'instrument': None}]
+
+		with mock.patch.object(management_utils, 'add_run_log_info', side_effect=add_run_log_info):
+
+			ingestion.ingest_new_runs(archives, compile_config({}))
+
+		self.assertEqual(SampleAnalysis.objects.filter(run_id=self.run_folder.name).count(), 1)
+		self.assertEqual(management_utils.get_changed_run_folders(self.archive_dir.name), [])
+
+	def test_failed_ingestion_retried(self):
+
+		run_folders = management_utils.get_changed_run_folders(self.archive_dir.name)
+
+		management_utils.record_run_folder_scan(self.run_folder, run_folders[0][1], True, False)
+
+		self.assertEqual(len(management_utils.get_changed_run_folders(self.archive_dir.name)), 1)
+
+
+
+class TestDirectorySnapshot(TestCase):
+	"""
+	Test the directory snapshot matches Path.glob and only lists each directory once
+	"""
+
+	def setUp(self):
+
+		self.fastq_dir = tempfile.TemporaryDirectory()
+		self.sample_path = Path(self.fastq_dir.name).joinpath('Data', 'sample1')
+		self.sample_path.mkdir(parents=True)
+
+		for read in ['R1', 'R2']:
+
+			with open(self.sample_path.joinpath(f'sample1_S1_L001_{read}_001.fastq.gz'), 'wb') as f:
+
+				f.write(b'0' * 2000)
+
+		self.sample_path.joinpath('sample1.variables').touch()
+
+	def tearDown(self):
+
+		self.fastq_dir.cleanup()
+
+	def test_glob_matches_pathlib(self):
+
+		snapshot_cache = SnapshotCache()
+
+		for pattern in ['*', '*.fastq.gz', 'sample1*L001_R1_001.fastq.gz', 'sample1.variables', 'Data/*/*_R2_001.fastq.gz', 'missing/*', '*.bam']:
+
+			self.assertEqual(
+				sorted(snapshot_cache.glob(self.fastq_dir.name, pattern)),
+				sorted(Path(self.fastq_dir.name).glob(pattern))
+				)
+
+		self.assertEqual(snapshot_cache.glob(self.sample_path, 'sample1.variables'), list(self.sample_path.glob('sample1.variables')))
+
+	def test_illumina_qc_lists_once(self):
+
+		illumina_qc = quality_pipelines.IlluminaQC(fastq_dir = self.fastq_dir.name,
+												sample_names = ['sample1'],
+												n_lanes = 1,
+												run_id = 'run1',
+												analysis_type = 'panel',
+												min_fastq_size = 1000)
+
+		with mock.patch('pipelines.directory_snapshot.os.scandir', wraps=os.scandir) as scandir:
+
+			self.assertEqual(illumina_qc.demultiplex_run_is_valid(), True)
+			self.assertEqual(illumina_qc.demultiplex_run_is_valid(), True)
+
+		self.assertEqual(scandir.call_count, 1)
+
+		# fastqs too small
+		illumina_qc = quality_pipelines.IlluminaQC(fastq_dir = self.fastq_dir.name,
+												sample_names = ['sample1'],
+												n_lanes = 1,
+												run_id = 'run1',
+												analysis_type = 'panel',
+												min_fastq_size = 5000)
+
+		self.assertEqual(illumina_qc.demultiplex_run_is_valid(), False)
+
+
+class TestIntegrity(TestCase):
+	"""
+	Test truncated BGZF files are spotted from their last few bytes
+	"""
+
+	def setUp(self):
+
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.fastq_dir = Path(self.temp_dir.name).joinpath('fastqs')
+		self.sample_path = self.fastq_dir.joinpath('Data', 'sample1')
+		self.sample_path.mkdir(parents=True)
+
+		for read in ['R1', 'R2']:
+
+			self.write_bgzf(self.sample_path.joinpath(f'sample1_S1_L001_{read}_001.fastq.gz'))
+
+		self.sample_path.joinpath('sample1.variables').touch()
+
+	def tearDown(self):
+
+		self.temp_dir.cleanup()
+
+	def write_bgzf(self, path):
+
+		with BGZFile(str(path), 'wb') as f:
+
+			f.write(b'@read1\nACGT\n+\nIIII\n' * 1000)
+
+	def truncate(self, path):
+
+		data = path.read_bytes()
+		path.write_bytes(data[:-10])
+
+	def test_file_is_intact(self):
+
+		bgzf_file = Path(self.temp_dir.name).joinpath('sample.bam')
+		self.write_bgzf(bgzf_file)
+
+		gzip_file = Path(self.temp_dir.name).joinpath('plain.fastq.gz')
+
+		with gzip.open(str(gzip_file), 'wb') as f:
+
+			f.write(b'@read1\nACGT\n+\nIIII\n')
+
+		not_gzip = Path(self.temp_dir.name).joinpath('not_gzip.fastq.gz')
+		not_gzip.write_bytes(b'0' * 2000)
+
+		self.assertEqual(integrity.file_is_intact(bgzf_file), True)
+		self.assertEqual(integrity.file_is_intact(gzip_file), True)
+		self.assertEqual(integrity.file_is_intact(not_gzip), False)
+		self.assertEqual(integrity.file_is_intact(Path(self.temp_dir.name).joinpath('missing.bam')), False)
+
+		self.truncate(bgzf_file)
+
+		self.assertEqual(integrity.file_is_intact(bgzf_file), False)
+
+		# results are cached until the file changes
+		metrics_cache = MetricsCache()
+
+		self.assertEqual(integrity.check_files([bgzf_file, gzip_file], metrics_cache), {bgzf_file: False, gzip_file: True})
+		self.assertEqual(integrity.check_files([bgzf_file, gzip_file], metrics_cache), {bgzf_file: False, gzip_file: True})
+		self.assertEqual(metrics_cache.get_counts()['misses'], 2)
+
+	def test_strict_demultiplex_validation(self):
+
+		def get_illumina_qc(strict_validation):
+
+			return quality_pipelines.IlluminaQC(fastq_dir = self.fastq_dir,
+												sample_names = ['sample1'],
+												n_lanes = 1,
+												run_id = 'run1',
+												analysis_type = 'panel',
+												min_fastq_size = 100,
+												strict_validation = strict_validation)
+
+		self.assertEqual(get_illumina_qc(True).demultiplex_run_is_valid(), True)
+
+		self.truncate(self.sample_path.joinpath('sample1_S1_L001_R2_001.fastq.gz'))
+
+		self.assertEqual(get_illumina_qc(False).demultiplex_run_is_valid(), True)
+		self.assertEqual(get_illumina_qc(True).demultiplex_run_is_valid(), False)
+
+
+class TestCopyVerification(TestCase):
+	"""
+	Test copied run folders are checked against their checksum manifest
+	"""
+
+	def setUp(self):
+
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.run_folder = Path(self.temp_dir.name).joinpath('200101_M00766_0001_000000000-ABCDE')
+
+		files = {
+			'RunInfo.xml': b'<RunInfo/>',
+			'InterOp/QMetricsOut.bin': b'\x01' * 5000,
+			'Data/Intensities/BaseCalls/L001/C1.1/L001_1.cbcl': b'\x02' * 5000,
+			# not one of the files we check
+			'Logs/copy.log': b'log',
+		}
+
+		lines = []
+
+		for path, data in files.items():
+
+			file_path = self.run_folder.joinpath(path)
+			file_path.parent.mkdir(parents=True, exist_ok=True)
+			file_path.write_bytes(data)
+
+			lines.append(f'{hashlib.md5(data).hexdigest()}  ./{path}')
+
+		self.run_folder.joinpath('md5sum.txt').write_text('\n'.join(lines) + '\n')
+		self.run_folder.joinpath('run_copy_complete.txt').touch()
+
+	def tearDown(self):
+
+		self.temp_dir.cleanup()
+
+	def corrupt(self, path):
+
+		file_path = self.run_folder.joinpath(path)
+		mtime = file_path.stat().st_mtime
+
+		file_path.write_bytes(b'\x00' * 5000)
+		os.utime(str(file_path), (mtime + 10, mtime + 10))
+
+	def test_hung_read_gives_up(self):
+
+		release = threading.Event()
+
+		class HungFile:
+
+			def read(self, size):
+
+				release.wait()
+				return b''
+
+			def close(self):
+
+				raise AssertionError('closed a file with a stuck read')
+
+		def fake_open(path, mode='r', *args):
+
+			if mode == 'rb':
+
+				return HungFile()
+
+			return open(path, mode, *args)
+
+		mount_guard = MountGuard({self.temp_dir.name: 0.2})
+		outcome = {}
+
+		def verify():
+
+			try:
+
+				copy_verification.verify_run_folder(self.run_folder, 'md5sum.txt', mount_guard=mount_guard)
+
+			except MountUnavailable as e:
+
+				outcome['error'] = e
+
+		with mock.patch('qc_database.copy_verification.open', fake_open, create=True):
+
+			thread = threading.Thread(target=verify, daemon=True)
+			thread.start()
+			thread.join(10)
+
+		release.set()
+
+		self.assertFalse(thread.is_alive())
+		self.assertIsInstance(outcome.get('error'), MountUnavailable)
+
+	def test_verify_run_folder(self):
+
+		self.assertEqual(copy_verification.verify_run_folder(self.run_folder, 'md5sum.txt'), copy_verification.VERIFIED)
+		self.assertEqual(RunFileChecksum.objects.filter(run_folder=str(self.run_folder)).count(), 3)
+
+		# unchanged files aren't hashed again
+		with mock.patch.object(copy_verification, 'hash_file') as hash_file:
+
+			self.assertEqual(copy_verification.verify_run_folder(self.run_folder, 'md5sum.txt'), copy_verification.VERIFIED)
+
+		hash_file.assert_not_called()
+
+		self.corrupt('InterOp/QMetricsOut.bin')
+
+		self.assertEqual(copy_verification.verify_run_folder(self.run_folder, 'md5sum.txt'), copy_verification.FAILED)
+		self.assertEqual(RunFileChecksum.objects.get(path='InterOp/QMetricsOut.bin').ok, False)
+
+		self.assertEqual(copy_verification.verify_run_folder(self.run_folder, 'missing.txt'), copy_verification.NO_MANIFEST)
+
+	def test_verification_required(self):
+
+		self.run_folder.joinpath('SampleSheet.csv').write_text('[Data]\nSample_ID,Sample_Plate,Description\n' +
+																'sample1,ws1,pipelineName=GermlineEnrichment;pipelineVersion=2.5.3;panel=IlluminaTruSightCancer;sex=Male\n')
+
+		# a known run so the run log files aren't needed
+		run_obj = Run.objects.create(run_id=self.run_folder.name)
+		archives = [{'path': self.temp_dir.name, 'instrument': None}]
+
+		config = compile_config({'copy_verification': {'enabled': True, 'required': True}})
+
+		self.corrupt('Data/Intensities/BaseCalls/L001/C1.1/L001_1.cbcl')
+
+		ingestion.ingest_new_runs(archives, config, full_scan=True)
+
+		run_obj.refresh_from_db()
+
+		self.assertEqual(run_obj.copy_verification, copy_verification.FAILED)
+		self.assertEqual(SampleAnalysis.objects.filter(run=run_obj).count(), 0)
+
+		# ingested once the copy is fixed
+		self.run_folder.joinpath('Data/Intensities/BaseCalls/L001/C1.1/L001_1.cbcl').write_bytes(b'\x02' * 5000)
+
+		ingestion.ingest_new_runs(archives, config, full_scan=True)
+
+		run_obj.refresh_from_db()
+
+		self.assertEqual(run_obj.copy_verification, copy_verification.VERIFIED)
+		self.assertEqual(SampleAnalysis.objects.filter(run=run_obj).count(), 1)
+
+
+class TestMountGuard(TestCase):
+	"""
+	Test probes of a hung mount are given up on and the mount skipped for the cool down
+	"""
+
+	fixtures = ['test_data']
+
+	def setUp(self):
+
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.mount = Path(self.temp_dir.name).joinpath('mnt')
+		self.mount.mkdir()
+		self.state_path = Path(self.temp_dir.name).joinpath('degraded_mounts.json')
+
+	def tearDown(self):
+
+		self.temp_dir.cleanup()
+
+	def test_probe(self):
+
+		mount_guard = MountGuard({str(self.mount): 0.2}, cooldown=600, state_path=str(self.state_path))
+
+		# errors and paths off the mount are passed through
+		self.assertEqual(mount_guard.probe(self.temp_dir.name, os.path.exists, self.temp_dir.name), True)
+
+		with self.assertRaises(FileNotFoundError):
+
+			mount_guard.probe(self.mount, os.stat, str(self.mount.joinpath('missing')))
+
+		start = time.time()
+
+		with self.assertRaises(MountUnavailable):
+
+			mount_guard.probe(self.mount.joinpath('run1'), time.sleep, 2)
+
+		self.assertLess(time.time() - start, 1)
+
+		# skipped straight away until the cool down has passed - in other processes too
+		with self.assertRaises(MountUnavailable):
+
+			mount_guard.probe(self.mount.joinpath('run2'), os.path.exists, str(self.mount))
+
+		self.assertEqual(MountGuard({str(self.mount): 0.2}, state_path=str(self.state_path)).get_degraded_mounts(), [str(self.mount)])
+
+		self.assertEqual(MountGuard({str(self.mount): 0.2}).get_degraded_mounts(), [])
+
+	def test_hung_archive_is_skipped(self):
+
+		archives = [{'path': str(self.mount), 'instrument': None}, {'path': self.temp_dir.name, 'instrument': None}]
+
+		mount_guard = MountGuard({str(self.mount): 0.2}, cooldown=600)
+
+		def list_changed_run_folders(raw_data_dir, scan_manifest):
+
+			if raw_data_dir == str(self.mount):
+
+				time.sleep(2)
+
+			return []
+
+		with mock.patch.object(management_utils, 'list_changed_run_folders', side_effect=list_changed_run_folders):
+
+			changed_archives = management_utils.get_changed_run_folders_in_archives(archives, True, mount_guard)
+
+		self.assertEqual([archive['path'] for archive, run_folders in changed_archives], [self.temp_dir.name])
+		self.assertEqual(mount_guard.get_degraded_mounts(), [str(self.mount)])
+
+	def test_run_analysis_on_degraded_mount(self):
+
+		config_dict = parsers.parse_config('config/config_local.yaml')
+		results_dir = str(Path('test_data').resolve())
+
+		for run_config_key in config_dict['pipelines']:
+
+			config_dict['pipelines'][run_config_key]['results_dir'] = results_dir
+			config_dict['pipelines'][run_config_key].pop('fastq_dir', None)
+
+		config_dict['mount_probes'] = {'mounts': {results_dir: 5}, 'state': str(self.state_path)}
+
+		self.state_path.write_text(json.dumps({results_dir: time.time() + 600}))
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+		SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline).update(results_completed=False, results_valid=False)
+
+		ingestion.process_run_analyses([run_analysis], compile_config(config_dict))
+
+		# left alone until the mount is back
+		self.assertEqual(SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline, results_completed=True).count(), 0)
+
+
+class TestPrefetch(TestCase):
+	"""
+	Test the sample directories are listed concurrently and the checks then run from memory
+	"""
+
+	def setUp(self):
+
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.fastq_dir = Path(self.temp_dir.name).joinpath('fastqs')
+		self.sample_names = [f'sample{i}' for i in range(1, 21)]
+
+		for sample in self.sample_names:
+
+			sample_path = self.fastq_dir.joinpath('Data', sample)
+			sample_path.mkdir(parents=True)
+
+			for read in ['R1', 'R2']:
+
+				sample_path.joinpath(f'{sample}_S1_L001_{read}_001.fastq.gz').write_bytes(b'0' * 200)
+
+			sample_path.joinpath(f'{sample}.variables').touch()
+
+	def tearDown(self):
+
+		self.temp_dir.cleanup()
+
+	def get_illumina_qc(self, snapshot_cache):
+
+		return quality_pipelines.IlluminaQC(fastq_dir = self.fastq_dir,
+											sample_names = self.sample_names,
+											n_lanes = 1,
+											run_id = 'run1',
+											analysis_type = 'panel',
+											min_fastq_size = 100).use_snapshot_cache(snapshot_cache)
+
+	def test_checks_run_from_memory(self):
+
+		illumina_qc = self.get_illumina_qc(SnapshotCache())
+		illumina_qc.prefetch_sample_dirs(self.sample_names, concurrency=8)
+
+		snapshot = illumina_qc.get_snapshot_cache().snapshot(self.fastq_dir.joinpath('Data', 'sample1'))
+		self.assertEqual(sorted(snapshot.stats), ['sample1_S1_L001_R1_001.fastq.gz', 'sample1_S1_L001_R2_001.fastq.gz'])
+
+		# everything the check needs is already listed and stat'd
+		with mock.patch('pipelines.directory_snapshot.os.scandir', side_effect=AssertionError('listed again')):
+
+			self.assertEqual(illumina_qc.demultiplex_run_is_valid(), True)
+
+	def test_concurrency_is_bounded(self):
+
+		class SlowSnapshotCache(SnapshotCache):
+
+			def __init__(self):
+
+				super().__init__()
+				self.in_flight = 0
+				self.max_in_flight = 0
+				self.counter_lock = threading.Lock()
+
+			def probe(self, path, func, *args):
+
+				with self.counter_lock:
+
+					self.in_flight = self.in_flight + 1
+					self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+				time.sleep(0.05)
+
+				try:
+
+					return func(*args)
+
+				finally:
+
+					with self.counter_lock:
+
+						self.in_flight = self.in_flight - 1
+
+		snapshot_cache = SlowSnapshotCache()
+
+		illumina_qc = self.get_illumina_qc(snapshot_cache)
+
+		start = time.time()
+
+		illumina_qc.prefetch_sample_fingerprints(self.sample_names, concurrency=4)
+		illumina_qc.prefetch_sample_dirs(self.sample_names, concurrency=4)
+
+		# 1 listing for the fingerprints, 20 stats, 20 listings and 40 fastq stats
+		self.assertEqual(snapshot_cache.max_in_flight, 4)
+		self.assertLess(time.time() - start, 81 * 0.05 / 2)
+
+		self.assertEqual(illumina_qc.demultiplex_run_is_valid(), True)
+
+
+class TestBulkLoaders(TestCase):
+	"""
+	Test the metric loaders write in bulk and skip rows which already exist
+	"""
+
+	fixtures = ['test_data']
+
+	def get_fastqc_dict(self, sample_ids):
+
+		fastqc_dict = {}
+
+		for sample_id in sample_ids:
+
+			fastqc_dict[sample_id] = []
+
+			for lane in ['L001', 'L002']:
+
+				for read_number in ['R1', 'R2']:
+
+					read = {'read_number': read_number, 'lane': lane}
+
+					for field in SampleFastqcData._meta.get_fields():
+
+						if field.name not in ['id', 'sample_analysis', 'read_number', 'lane']:
+
+							read[field.name] = 'PASS'
+
+					fastqc_dict[sample_id].append(read)
+
+		return fastqc_dict
+
+	def test_add_fastqc_data(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+
+		sample_analyses = SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline, analysis_type=run_analysis.analysis_type)
+		sample_ids = [sample_analysis.sample_id for sample_analysis in sample_analyses][:3]
+
+		SampleFastqcData.objects.filter(sample_analysis__in=sample_analyses).delete()
+
+		# one query for the sample analyses, one for the existing rows and one insert
+		with self.assertNumQueries(3):
+
+			management_utils.add_fastqc_data(self.get_fastqc_dict(sample_ids), run_analysis)
+
+		self.assertEqual(SampleFastqcData.objects.filter(sample_analysis__sample_id__in=sample_ids, sample_analysis__run=run_analysis.run).count(), len(sample_ids) * 4)
+
+		# nothing new so nothing written
+		with self.assertNumQueries(2):
+
+			management_utils.add_fastqc_data(self.get_fastqc_dict(sample_ids), run_analysis)
+
+		self.assertEqual(SampleFastqcData.objects.filter(sample_analysis__sample_id__in=sample_ids, sample_analysis__run=run_analysis.run).count(), len(sample_ids) * 4)
+
+	def test_add_sex_metrics(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+
+		sample_analyses = SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline, analysis_type=run_analysis.analysis_type)
+		sample_ids = [sample_analysis.sample_id for sample_analysis in sample_analyses]
+
+		CalculatedSexMetrics.objects.filter(sample_analysis__in=sample_analyses).delete()
+		CalculatedSexMetrics.objects.create(sample_analysis=sample_analyses[0], calculated_sex='male')
+
+		management_utils.add_sex_metrics({sample_id: {'sex': 'female'} for sample_id in sample_ids}, run_analysis, 'sex')
+
+		self.assertEqual(CalculatedSexMetrics.objects.get(sample_analysis=sample_analyses[0]).calculated_sex, 'male')
+		self.assertEqual(CalculatedSexMetrics.objects.filter(sample_analysis__in=sample_analyses, calculated_sex='female').count(), len(sample_ids) - 1)
+
+		with self.assertRaises(SampleAnalysis.DoesNotExist):
+
+			management_utils.add_sex_metrics({'not_a_sample': {'sex': 'female'}}, run_analysis, 'sex')
+
+	def test_null_values(self):
+
+		self.assertEqual(management_utils.set_null_values({'a': '?', 'b': '', 'c': '1'}), {'a': None, 'b': None, 'c': '1'})
+		self.assertEqual(management_utils.set_null_values({'a': 'NA', 'b': 'inf'}, ('NA', '', 'inf')), {'a': None, 'b': None})
+
+
+class TestPicardMetrics(TestCase):
+	"""
+	Test the Picard metrics reader
+	"""
+
+	def setUp(self):
+
+		self.metrics_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+
+		self.metrics_file.write(
+			'## htsjdk.samtools.metrics.StringHeader\n'
+			'# CollectInsertSizeMetrics INPUT=sample.bam\n'
+			'\n'
+			'## METRICS CLASS\tpicard.analysis.InsertSizeMetrics\n'
+			'MEDIAN_INSERT_SIZE\tMEAN_INSERT_SIZE\tPAIR_ORIENTATION\tWIDTH_OF_10_PERCENT\tSAMPLE\tLIBRARY\tREAD_GROUP\n'
+			'150\t155.5\tFR\t?\t\t\t\n'
+			'90\t91.2\tRF\t3\t\t\t\n'
+			'\n'
+			'## HISTOGRAM\tjava.lang.Integer\n'
+			'insert_size\tAll_Reads.fr_count\n'
+			'1\t2\n'
+			)
+
+		self.metrics_file.close()
+
+	def tearDown(self):
+
+		os.remove(self.metrics_file.name)
+
+	def test_read_picard_metrics(self):
+
+		rows = parsers.read_picard_metrics(self.metrics_file.name, exclude=['sample', 'library', 'read_group'])
+
+		self.assertEqual(rows, [
+			{'median_insert_size': 150, 'mean_insert_size': 155.5, 'pair_orientation': 'FR', 'width_of_10_percent': None},
+			{'median_insert_size': 90, 'mean_insert_size': 91.2, 'pair_orientation': 'RF', 'width_of_10_percent': 3},
+			])
+
+		self.assertEqual(parsers.parse_insert_metrics_file(self.metrics_file.name), rows[0])
+
+		self.assertEqual(parsers.read_picard_metrics(self.metrics_file.name, string_columns=['median_insert_size'])[1]['median_insert_size'], '90')
+
+	def test_parse_test_data(self):
+
+		hs_metrics_file = Path('test_data/run1/RochePanCancer/sample1/run1_sample1_HsMetrics.txt')
+
+		hs_metrics = parsers.parse_hs_metrics_file(hs_metrics_file)
+
+		self.assertEqual(hs_metrics['total_reads'], 2000000)
+		self.assertEqual(hs_metrics['bait_set'], 'RochePanCancer_capture')
+		self.assertEqual(hs_metrics['pct_selected_bases'], None)
+
+
+class TestVariantCount(TestCase):
+	"""
+	Test counting passing variants in a multi sample vcf
+	"""
+
+	def setUp(self):
+
+		self.vcf_file = tempfile.NamedTemporaryFile(mode='w', suffix='.vcf', delete=False)
+
+		self.vcf_file.write(
+			'##fileformat=VCFv4.2\n'
+			'##FILTER=<ID=PASS,Description="All filters passed">\n'
+			'##FILTER=<ID=LowQual,Description="Low quality">\n'
+			'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+			'##contig=<ID=chr1,length=1000>\n'
+			'#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample1\tsample2\tsample3\n'
+			'chr1\t10\t.\tA\tG\t50\tPASS\t.\tGT\t0/1\t0/0\t0/0\n'
+			'chr1\t20\t.\tA\tG\t50\tPASS\t.\tGT\t1/1\t./.\t0/0\n'
+			'chr1\t30\t.\tA\tG\t50\tLowQual\t.\tGT\t0/1\t0/1\t0/0\n'
+			'chr1\t40\t.\tA\tG\t50\tPASS\t.\tGT\t0/1\t0/1\t0/0\n'
+			)
+
+		self.vcf_file.close()
+
+	def tearDown(self):
+
+		os.remove(self.vcf_file.name)
+
+	def test_count_passing_variants(self):
+
+		self.assertEqual(parsers.count_passing_variants(self.vcf_file.name, ['sample1', 'sample2', 'sample3']), {'sample1': 3, 'sample2': 1, 'sample3': 0})
+
+		# the first passing variant is not counted
+		self.assertEqual(parsers.get_passing_variant_count(self.vcf_file.name, ['sample1', 'sample2', 'sample3']), {'sample1': 2, 'sample2': 0, 'sample3': 0})
+		self.assertEqual(parsers.get_passing_variant_count(self.vcf_file.name, ['sample1']), {'sample1': 2})
+
+
+class TestInterop(TestCase):
+	"""
+	Test the interop tables are cached and the index metrics are added
+	"""
+
+	fixtures = ['test_data']
+
+	def setUp(self):
+
+		self.run_folder = tempfile.TemporaryDirectory()
+		Path(self.run_folder.name).joinpath('InterOp').mkdir()
+		Path(self.run_folder.name).joinpath('InterOp', 'QMetricsOut.bin').touch()
+
+		self.read_table = pd.DataFrame([[1, 1] + [0.5] * 13, [2, 1] + [float('nan')] * 13], columns=parsers.INTEROP_READ_COLUMNS)
+		self.index_table = pd.DataFrame([[1, 'sample1', 300, 1000], [1, 'sample2', 600, 1000], [2, 'sample1', 100, 1000]], columns=parsers.INTEROP_INDEX_COLUMNS)
+
+	def tearDown(self):
+
+		self.run_folder.cleanup()
+
+	def test_interop_cache(self):
+
+		with mock.patch('pipelines.parsers.read_interop_tables', return_value=(self.read_table, self.index_table)) as read_interop_tables:
+
+			interop_dict = parsers.parse_interop_data(self.run_folder.name, 2, 1)
+			self.assertEqual(parsers.parse_interop_data(self.run_folder.name, 2, 1), interop_dict)
+			self.assertEqual(read_interop_tables.call_count, 1)
+
+			# interop files have changed
+			os.utime(Path(self.run_folder.name).joinpath('InterOp', 'QMetricsOut.bin'), (1, 1))
+			parsers.parse_interop_data(self.run_folder.name, 2, 1)
+			self.assertEqual(read_interop_tables.call_count, 2)
+
+		self.assertEqual(interop_dict['read_summaries'][1][1]['percent_q30'], 0.5)
+		self.assertEqual(interop_dict['read_summaries'][2][1]['percent_q30'], None)
+		self.assertEqual(interop_dict['index_summaries'], {'sample1': 20.0, 'sample2': 30.0})
+
+	def test_add_interop_index_metrics(self):
+
+		run = Run.objects.get(run_id='190520_M02641_0219_000000000-CGJT6')
+		sample_ids = list(SampleAnalysis.objects.filter(run=run).values_list('sample_id', flat=True))
+
+		InteropIndexMetrics.objects.filter(run=run).delete()
+
+		interop_dict = {'index_summaries': {sample_ids[0]: 12.3456, sample_ids[1]: 10.0, 'not_a_sample': 5.0}}
+
+		management_utils.add_interop_index_metrics(interop_dict, run)
+		management_utils.add_interop_index_metrics(interop_dict, run)
+
+		self.assertEqual(InteropIndexMetrics.objects.filter(run=run).count(), 2)
+		self.assertEqual(float(InteropIndexMetrics.objects.get(run=run, sample_id=sample_ids[0]).pct_reads_identified), 12.346)
+
+
+class TestWatcher(TestCase):
+
+	fixtures = ['test_data']
+
+	def test_polling_file_watcher(self):
+
+		with tempfile.TemporaryDirectory() as results_dir:
+
+			file_watcher = watcher.FileWatcher(use_inotify=False)
+
+			run_dir = Path(results_dir).joinpath('run1')
+
+			file_watcher.watch('run1', run_dir, 2)
+
+			self.assertEqual(file_watcher.wait_for_changes(0), set())
+
+			# appears
+			run_dir.joinpath('sample1').mkdir(parents=True)
+
+			self.assertEqual(file_watcher.wait_for_changes(0), {'run1'})
+			self.assertEqual(file_watcher.wait_for_changes(0), set())
+
+			# pipeline finishes
+			run_dir.joinpath('sample1', 'post_processing_finished.txt').write_text('')
+
+			self.assertEqual(file_watcher.wait_for_changes(0), {'run1'})
+
+			file_watcher.unwatch('run1')
+
+			run_dir.joinpath('sample2').mkdir()
+
+			self.assertEqual(file_watcher.wait_for_changes(0), set())
+
+	def test_polling_only_lists_top_directory(self):
+
+		with tempfile.TemporaryDirectory() as results_dir:
+
+			run_dir = Path(results_dir).joinpath('run1')
+
+			for i in range(10):
+
+				run_dir.joinpath(f'sample{i}', 'post_processing').mkdir(parents=True)
+
+			file_watcher = watcher.FileWatcher(use_inotify=False)
+
+			file_watcher.watch('run1', run_dir, watcher.RESULTS_WATCH_DEPTH)
+
+			with mock.patch('qc_database.watcher.os.scandir', wraps=os.scandir) as scandir:
+
+				self.assertEqual(file_watcher.wait_for_changes(0), set())
+
+				self.assertEqual(scandir.call_count, 1)
+
+				# the sample directory's mtime changes
+				run_dir.joinpath('sample3', '1_GermlineEnrichment-2.5.3.sh.e1').write_text('')
+
+				self.assertEqual(file_watcher.wait_for_changes(0), {'run1'})
+
+				self.assertEqual(scandir.call_count, 2)
+
+	def test_unavailable_mount_skipped(self):
+
+		with tempfile.TemporaryDirectory() as results_dir:
+
+			mount_guard = MountGuard({results_dir: 5})
+
+			file_watcher = watcher.FileWatcher(use_inotify=False, mount_guard=mount_guard)
+
+			run_dir = Path(results_dir).joinpath('run1')
+			run_dir.joinpath('sample1').mkdir(parents=True)
+
+			file_watcher.watch('run1', run_dir, 2)
+
+			mount_guard.mark_degraded(results_dir)
+
+			run_dir.joinpath('sample2').mkdir()
+
+			with mock.patch('qc_database.watcher.os.scandir', side_effect=AssertionError('listed an unavailable mount')):
+
+				self.assertEqual(file_watcher.wait_for_changes(0), set())
+
+			# picked up once the mount is back
+			mount_guard.degraded = {}
+
+			self.assertEqual(file_watcher.wait_for_changes(0), {'run1'})
+
+	def test_needs_polling(self):
+
+		with tempfile.TemporaryDirectory() as temp_dir:
+
+			mounts_file = Path(temp_dir).joinpath('mounts')
+
+			mounts_file.write_text('/dev/sda1 / ext4 rw 0 0\nserver:/export /data/results nfs4 rw 0 0\nfuse /mnt/my\\040drive fuse.sshfs rw 0 0\n')
+
+			mounts = watcher.get_mounts(str(mounts_file))
+
+			self.assertTrue(watcher.needs_polling('/data/results/run1', mounts))
+			self.assertTrue(watcher.needs_polling('/mnt/my drive/run1', mounts))
+			self.assertFalse(watcher.needs_polling('/data/resultsold/run1', mounts))
+			self.assertFalse(watcher.needs_polling('/home', mounts))
+
+	def test_only_changed_run_analyses_are_checked(self):
+
+		with tempfile.TemporaryDirectory() as temp_dir:
+
+			archive_dir = Path(temp_dir).joinpath('archive')
+			archive_dir.mkdir()
+
+			config = Path(temp_dir).joinpath('config.yaml')
+			config.write_text(f'''
+archives:
+  - path: '{archive_dir}'
+pipelines:
+  GermlineEnrichment-2.5.3-IlluminaTruSightCancer:
+    results_dir: '{temp_dir}/results/'
+''')
+
+			RunAnalysis.objects.all().update(watching=True)
+
+			run_watcher = watcher.RunWatcher(str(config), poll_interval=0, file_watcher=watcher.FileWatcher(use_inotify=False))
+
+			with mock.patch('qc_database.ingestion.process_run_analyses') as process_run_analyses, mock.patch('qc_database.ingestion.ingest_new_runs') as ingest_new_runs:
+
+				# first cycle is a full sweep
+				run_watcher.run_cycle()
+
+				self.assertEqual(ingest_new_runs.call_count, 1)
+				self.assertEqual(len(process_run_analyses.call_args[0][0]), RunAnalysis.objects.count())
+
+				# nothing has changed
+				run_watcher.run_cycle()
+
+				self.assertEqual(process_run_analyses.call_count, 1)
+
+				# results appear for one run analysis
+				Path(temp_dir).joinpath('results', '190520_M02641_0219_000000000-CGJT6', 'IlluminaTruSightCancer').mkdir(parents=True)
+
+				run_watcher.run_cycle()
+
+				self.assertEqual(process_run_analyses.call_count, 2)
+				self.assertEqual(list(process_run_analyses.call_args[0][0]), [RunAnalysis.objects.get(pk=16)])
+				self.assertEqual(ingest_new_runs.call_count, 1)
+
+				# a new run folder in the archive
+				archive_dir.joinpath('200101_M00766_0001_000000000-ABCDE').mkdir()
+
+				run_watcher.run_cycle()
+
+				self.assertEqual(ingest_new_runs.call_count, 2)
+
+
+class TestChangeTracking(TestCase):
+
+	fixtures = ['test_data']
+
+	def test_unchanged_save_skipped(self):
+
+		sample_analysis = SampleAnalysis.objects.get(pk=301)
+
+		with CaptureQueriesContext(connection) as queries:
+
+			sample_analysis.save()
+
+		self.assertEqual(len(queries.captured_queries), 0)
+
+	def test_only_changed_fields_written(self):
+
+		sample_analysis = SampleAnalysis.objects.get(pk=301)
+		sample_analysis.sex = 'XX'
+
+		with CaptureQueriesContext(connection) as queries:
+
+			sample_analysis.save()
+
+		updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+
+		self.assertEqual(len(updates), 1)
+		self.assertIn('"sex"', updates[0])
+		self.assertNotIn('"results_valid"', updates[0])
+
+		sample_analysis.refresh_from_db()
+		self.assertEqual(sample_analysis.sex, 'XX')
+
+		# saved values become the new baseline
+		self.assertEqual(sample_analysis.get_changed_fields(), [])
+
+	def test_summary_refresh_skipped(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+		run_analysis.refresh_summary()
+
+		last_updated = run_analysis.summary.last_updated
+
+		run_analysis.refresh_summary()
+
+		self.assertEqual(RunAnalysisSummary.objects.get(pk=16).last_updated, last_updated)
+
+
+class TestConfig(TestCase):
+
+	def test_configs_compile(self):
+
+		for config_path in ['config/config_local.yaml', 'config/config_gen01.yaml']:
+
+			config = compile_config(parsers.parse_config(config_path), config_path)
+
+			self.assertTrue(len(config.pipelines) > 0)
+
+		pipeline_config = config.get_pipeline('GermlineEnrichment_TSC-1.0.1-IlluminaTruSightCancer')
+
+		self.assertEqual(pipeline_config.min_q30_score, 0.75)
+		self.assertEqual(pipeline_config.auto_qc_checks, 'pct_q30,fastqc,variant_check,contamination,ntc_contamination,sex_match')
+		self.assertEqual(pipeline_config.min_sensitivity, None)
+
+		# the kwargs for a pipeline class are only worked out once
+		kwargs = pipeline_config.get_pipeline_kwargs(germline_pipelines.GermlineEnrichment)
+		self.assertEqual(sorted(kwargs), sorted(germline_pipelines.GermlineEnrichment.config_keys))
+		self.assertIs(pipeline_config.get_pipeline_kwargs(germline_pipelines.GermlineEnrichment), kwargs)
+
+	def test_defaults(self):
+
+		config = compile_config({'pipelines': {'Pipeline-1.0.0-Panel': {'min_q30_score': 0.9}}})
+
+		pipeline_config = config.get_pipeline('Pipeline-1.0.0-Panel')
+
+		self.assertEqual(pipeline_config.min_q30_score, 0.9)
+		self.assertEqual(pipeline_config.min_variants, 25)
+		self.assertEqual(pipeline_config.auto_qc_checks, None)
+		self.assertEqual(pipeline_config.get_pipeline_kwargs(germline_pipelines.GermlineEnrichment), {})
+
+		unconfigured = config.get_pipeline('Other-1.0.0-Panel')
+
+		self.assertEqual(unconfigured.configured, False)
+		self.assertEqual(unconfigured.contamination_cutoff, 0.015)
+		self.assertIs(config.get_pipeline('Other-1.0.0-Panel'), unconfigured)
+
+		self.assertEqual(config.scheduler['idle_interval'], 300)
+		self.assertEqual(config.metric_workers, 4)
+
+	def test_errors_reported_at_load(self):
+
+		with self.assertRaises(ConfigError) as context:
+
+			compile_config({
+				'pipelines': {
+					'Pipeline-1.0.0-Panel': {'min_q30_score': '0.8', 'qc_checks': ['pct_q30', 'q30'], 'min_variants': 10},
+					'Pipeline-1.0.0-Other': {'min_titv': 2.2, 'max_titv': 2.0, 'sample_expected_files': '*.bam'},
+				},
+				'scheduler': {'idle_interval': 0},
+				'metric_workers': 0,
+				'mount_probes': {'mounts': {'/mnt/wren_archive': 0}},
+			})
+
+		message = str(context.exception)
+
+		self.assertIn('pipelines.Pipeline-1.0.0-Panel.min_q30_score should be a number', message)
+		self.assertIn('unknown check q30', message)
+		self.assertIn('should set both min_variants and max_variants', message)
+		self.assertIn('min_titv is greater than max_titv', message)
+		self.assertIn('sample_expected_files should be a list', message)
+		self.assertIn('mount_probes.mounts./mnt/wren_archive should be a positive number', message)
+		self.assertIn('scheduler.idle_interval', message)
+		self.assertIn('metric_workers', message)
+
+	def test_compiled_config_cached(self):
+
+		with tempfile.TemporaryDirectory() as temp_dir:
+
+			config_path = Path(temp_dir).joinpath('config.yaml')
+			config_path.write_text('pipelines:\n  Pipeline-1.0.0-Panel:\n    min_q30_score: 0.9\n')
+
+			self.assertEqual(load_config(str(config_path)).get_pipeline('Pipeline-1.0.0-Panel').min_q30_score, 0.9)
+
+			# not parsed again while the file is unchanged
+			with mock.patch.object(parsers, 'parse_config') as parse_config:
+
+				self.assertEqual(load_config(str(config_path)).get_pipeline('Pipeline-1.0.0-Panel').min_q30_score, 0.9)
+
+			parse_config.assert_not_called()
+
+			config_path.write_text('pipelines:\n  Pipeline-1.0.0-Panel:\n    min_q30_score: 0.85\n')
+			mtime = config_path.stat().st_mtime + 10
+			os.utime(str(config_path), (mtime, mtime))
+
+			self.assertEqual(load_config(str(config_path)).get_pipeline('Pipeline-1.0.0-Panel').min_q30_score, 0.85)
+
+			config_path.write_text('pipelines:\n  Pipeline-1.0.0-Panel:\n    min_q30_score: high\n')
+
+			with self.assertRaises(ConfigError):
+
+				load_config(str(config_path))
+
+
+class TestIdentityMap(TestCase):
+
+	def make_rows(self, n_samples, sex='Male', prefix='sample'):
+
+		return [{
+			'sample': f'{prefix}{i}',
+			'pipeline': 'GermlineEnrichment-2.5.3',
+			'analysis_type': 'NewPanel',
+			'worksheet': 'ws1',
+			'sex': sex,
+			'contamination_cutoff': 0.025,
+			'ntc_contamination_cutoff': 10,
+		} for i in range(n_samples)]
+
+	def test_constant_queries_per_run(self):
+
+		n_queries = []
+
+		# the first run also creates the pipeline, panel and worksheet
+		upsert_sample_analyses(Run.objects.create(run_id='run_0'), self.make_rows(1, prefix='first'), IdentityMap(), update_fields=['sex'])
+
+		for n_samples in [5, 50]:
+
+			run_obj = Run.objects.create(run_id=f'run_{n_samples}')
+
+			with CaptureQueriesContext(connection) as queries:
+
+				upsert_sample_analyses(run_obj, self.make_rows(n_samples, prefix=f'run{n_samples}_'), IdentityMap(), update_fields=['sex'])
+
+			n_queries.append(len(queries.captured_queries))
+
+			self.assertEqual(SampleAnalysis.objects.filter(run=run_obj, sex='Male', contamination_cutoff=0.025).count(), n_samples)
+
+		self.assertEqual(n_queries[0], n_queries[1])
+
+		# creations are still in the audit log
+		self.assertEqual(LogEntry.objects.filter(action=LogEntry.Action.CREATE, content_type=ContentType.objects.get_for_model(SampleAnalysis)).count(), 56)
+
+	def test_upsert_existing(self):
+
+		identity_map = IdentityMap()
+		run_obj = Run.objects.create(run_id='run1')
+
+		upsert_sample_analyses(run_obj, self.make_rows(3), identity_map, update_fields=['sex'])
+
+		# nothing to do the second time
+		with CaptureQueriesContext(connection) as queries:
+
+			upsert_sample_analyses(run_obj, self.make_rows(3), identity_map, update_fields=['sex'])
+
+		self.assertEqual(len(queries.captured_queries), 1)
+
+		rows = self.make_rows(3, sex='Female')
+		rows[0]['contamination_cutoff'] = 0.5
+
+		upsert_sample_analyses(run_obj, rows, identity_map, update_fields=['sex'])
+
+		sample_analyses = SampleAnalysis.objects.filter(run=run_obj)
+
+		self.assertEqual(sample_analyses.count(), 3)
+		self.assertEqual(sample_analyses.filter(sex='Female', contamination_cutoff=0.025).count(), 3)
+
+		update = LogEntry.objects.get_for_object(sample_analyses.get(sample_id='sample0')).get(action=LogEntry.Action.UPDATE)
+		self.assertEqual(update.changes_dict, {'sex': ['Male', 'Female']})
+
+
+class TestMetricsCache(TestCase):
+
+	def test_parse_through_cache(self):
+
+		hs_metrics_file = Path('test_data/190520_M02641_0219_000000000-CGJT6/IlluminaTruSightCancer/19M07041/190520_M02641_0219_000000000-CGJT6_19M07041_HsMetrics.txt')
+
+		with tempfile.TemporaryDirectory() as temp_dir:
+
+			copied_file = Path(temp_dir).joinpath(hs_metrics_file.name)
+			copied_file.write_bytes(hs_metrics_file.read_bytes())
+
+			store_path = Path(temp_dir).joinpath('metrics_cache.sqlite3')
+
+			metrics_cache = MetricsCache(store_path)
+
+			expected = parsers.parse_hs_metrics_file(copied_file)
+
+			self.assertEqual(metrics_cache.parse(parsers.parse_hs_metrics_file, copied_file), expected)
+
+			# callers get their own copy
+			metrics = metrics_cache.parse(parsers.parse_hs_metrics_file, copied_file)
+			metrics['total_reads'] = None
+			self.assertEqual(metrics_cache.parse(parsers.parse_hs_metrics_file, copied_file), expected)
+
+			self.assertEqual(metrics_cache.get_counts(), {'memory_hits': 2, 'store_hits': 0, 'misses': 1})
+
+			metrics_cache.close()
+
+			# the next pass reads it from the store
+			metrics_cache = MetricsCache(store_path)
+
+			self.assertEqual(metrics_cache.parse(parsers.parse_hs_metrics_file, copied_file), expected)
+			self.assertEqual(metrics_cache.get_counts(), {'memory_hits': 0, 'store_hits': 1, 'misses': 0})
+
+			# parsed again once the file changes
+			mtime = copied_file.stat().st_mtime + 10
+			os.utime(str(copied_file), (mtime, mtime))
+
+			metrics_cache.clear_memory()
+			metrics_cache.parse(parsers.parse_hs_metrics_file, copied_file)
+
+			self.assertEqual(metrics_cache.get_counts()['misses'], 1)
+
+			metrics_cache.close()
+
+	def test_pipeline_parses_each_file_once(self):
+
+		pipeline = germline_pipelines.GermlineEnrichment(results_dir = Path('test_data/190520_M02641_0219_000000000-CGJT6/IlluminaTruSightCancer'),
+														sample_names = ['19M07041', '19M07248'],
+														run_id = '190520_M02641_0219_000000000-CGJT6')
+
+		first = pipeline.get_hs_metrics()
+		second = pipeline.get_hs_metrics()
+
+		self.assertEqual(first, second)
+		self.assertEqual(pipeline.get_metrics_cache().get_counts(), {'memory_hits': 2, 'store_hits': 0, 'misses': 2})
+
+
+class TestSlackOutbox(TestCase):
+
+	def test_messages_sent_as_digest(self):
+
+		message_slack(':information_source: *run has finished sequencing*\n```Run ID:          "run1"```')
+		message_slack('second message')
+
+		self.assertEqual(SlackMessage.objects.filter(sent=None).count(), 2)
+
+		with SlackStubServer() as stub:
+
+			self.assertEqual(send_pending_messages(stub.url), 2)
+
+		self.assertEqual(stub.messages, [':information_source: *run has finished sequencing*\n```Run ID:          "run1"```\n\nsecond message'])
+		self.assertEqual(SlackMessage.objects.filter(sent=None).count(), 0)
+
+	def test_retry_with_backoff(self):
+
+		message_slack('message')
+
+		with SlackStubServer() as stub:
+
+			stub.failures = 1
+
+			now = timezone.now()
+
+			self.assertEqual(send_pending_messages(stub.url, now), 0)
+
+			message = SlackMessage.objects.get()
+			self.assertEqual(message.attempts, 1)
+			self.assertEqual(message.next_attempt_at, now + datetime.timedelta(seconds=30))
+
+			# not due yet
+			self.assertEqual(send_pending_messages(stub.url, now), 0)
+
+			self.assertEqual(send_pending_messages(stub.url, now + datetime.timedelta(seconds=31)), 1)
+
+		self.assertEqual(stub.messages, ['message'])
+
+	def test_connection_reused(self):
+
+		# too long to go in one digest
+		message_slack('a' * 2000)
+		message_slack('b' * 2000)
+
+		with SlackStubServer() as stub:
+
+			self.assertEqual(send_pending_messages(stub.url), 2)
+
+		self.assertEqual(len(stub.messages), 2)
+		self.assertEqual(len(stub.connections), 1)
+
+
+class TestIngestion(TestCase):
+	"""
+	Test checking watched run analyses against the files in test_data
+	"""
+
+	fixtures = ['test_data']
+
+	def setUp(self):
+
+		self.config_dict = parsers.parse_config('config/config_local.yaml')
+
+		for run_config_key in self.config_dict['pipelines']:
+
+			self.config_dict['pipelines'][run_config_key]['results_dir'] = str(Path('test_data').resolve())
+			self.config_dict['pipelines'][run_config_key].pop('fastq_dir', None)
+
+		self.config = compile_config(self.config_dict)
+
+	def reset_run_analysis(self, pk):
+
+		run_analysis = RunAnalysis.objects.get(pk=pk)
+
+		SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline).update(results_completed=False, results_valid=False)
+
+		return run_analysis
+
+	def check_samples_updated(self, run_analysis):
+
+		run_analysis.refresh_from_db()
+
+		self.assertEqual(run_analysis.results_completed, True)
+		self.assertEqual(run_analysis.results_valid, True)
+		self.assertEqual(run_analysis.summary.n_samples_completed, run_analysis.summary.n_samples)
+		self.assertEqual(run_analysis.get_n_samples_valid(), run_analysis.get_n_samples_completed())
+
+	def test_process_run_analyses(self):
+
+		run_analysis = self.reset_run_analysis(16)
+
+		ingestion.process_run_analyses([run_analysis], self.config)
+
+		self.check_samples_updated(run_analysis)
+
+	def test_slack_message_written_with_result(self):
+
+		RunAnalysis.objects.filter(pk=16).update(demultiplexing_completed=False, demultiplexing_valid=False)
+		run_analysis = RunAnalysis.objects.get(pk=16)
+
+		result = {'pk': 16, 'error': None, 'demultiplexing_completed': True, 'demultiplexing_valid': True, 'samples': None,
+					'run_completed': None, 'run_valid': None, 'metrics_load': None, 'metrics': []}
+
+		with self.settings(MESSAGE_SLACK=True):
+
+			# the message goes with the rolled back result
+			with mock.patch.object(RunAnalysis, 'refresh_summary', side_effect=ValueError('broken')):
+
+				ingestion.apply_and_notify(run_analysis, dict(result))
+
+			run_analysis.refresh_from_db()
+
+			self.assertEqual(run_analysis.demultiplexing_completed, False)
+			self.assertEqual(SlackMessage.objects.count(), 0)
+
+			ingestion.apply_and_notify(run_analysis, dict(result))
+
+		run_analysis.refresh_from_db()
+
+		self.assertEqual(run_analysis.demultiplexing_completed, True)
+		self.assertEqual(SlackMessage.objects.filter(text__contains='has generated FASTQs successfully').count(), 1)
+
+	def test_process_run_analyses_workers(self):
+
+		run_analysis = self.reset_run_analysis(16)
+
+		# missing results for this one shouldn't stop the other run analysis
+		broken_run_analysis = RunAnalysis.objects.get(pk=13)
+		self.config_dict['pipelines']['GermlineEnrichment-2.5.4-AgilentOGTFH']['results_dir'] = '/does/not/exist/'
+
+		ingestion.process_run_analyses([broken_run_analysis, run_analysis], compile_config(self.config_dict), workers=2)
+
+		self.check_samples_updated(run_analysis)
+
+		broken_run_analysis.refresh_from_db()
+
+		self.assertEqual(broken_run_analysis.results_completed, False)
+
+	def test_unchanged_samples_not_revalidated(self):
+
+		run_analysis = self.reset_run_analysis(16)
+
+		ingestion.process_run_analyses([run_analysis], self.config)
+
+		sample_analyses = SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline)
+
+		self.assertEqual(sample_analyses.filter(results_fingerprint=None).count(), 0)
+
+		# pretend one sample directory has changed
+		changed_sample = sample_analyses.first()
+		sample_analyses.filter(pk=changed_sample.pk).update(results_fingerprint='changed')
+
+		with mock.patch.object(germline_pipelines.GermlineEnrichment, 'sample_is_valid', return_value=True) as sample_is_valid:
+
+			ingestion.process_run_analyses([RunAnalysis.objects.get(pk=16)], self.config)
+
+		sample_is_valid.assert_called_once_with(changed_sample.sample_id)
+
+		changed_sample.refresh_from_db()
+		self.assertNotEqual(changed_sample.results_fingerprint, 'changed')
+
+		self.check_samples_updated(run_analysis)
+
+	def test_post_sample_file_in_subdirectory_revalidated(self):
+
+		with tempfile.TemporaryDirectory() as results_dir:
+
+			results_path = Path(results_dir)
+			results_path.joinpath('sample1').mkdir()
+			results_path.joinpath('sample1', 'sample1.bam').touch()
+			results_path.joinpath('results', 'contamination').mkdir(parents=True)
+			results_path.joinpath('results', 'post_processing_finished.txt').touch()
+
+			def check():
+
+				pipeline = dragen_pipelines.DragenWGS(results_dir = results_dir,
+													sample_names = ['sample1'],
+													run_id = 'run1',
+													sample_expected_files = ['*.bam'],
+													post_sample_files = ['results/contamination/*{sample}_contamination.selfSM'])
+
+				return pipeline.get_sample_fingerprint('sample1'), pipeline.sample_is_complete('sample1'), pipeline.sample_is_valid('sample1')
+
+			first_pass = check()
+
+			self.assertEqual(first_pass[1:], (True, False))
+			self.assertEqual(ingestion.can_reuse_sample_state(first_pass[0], first_pass), False)
+
+			# only changes the mtime of the contamination directory
+			results_path.joinpath('results', 'contamination', 'run1_sample1_contamination.selfSM').touch()
+
+			second_pass = check()
+
+			self.assertNotEqual(second_pass[0], first_pass[0])
+			self.assertEqual(second_pass[1:], (True, True))
+			self.assertEqual(ingestion.can_reuse_sample_state(second_pass[0], second_pass), True)
+
+	def test_failed_check_is_backed_off(self):
+
+		run_analysis = RunAnalysis.objects.get(pk=16)
+		run_analysis.results_completed = False
+		run_analysis.next_check_at = timezone.now()
+		run_analysis.check_backoff = 0
+		run_analysis.save()
+
+		with mock.patch.object(ingestion, '_check_run_analysis', side_effect=ValueError('broken')):
+
+			ingestion.process_run_analyses([run_analysis], self.config)
+
+			run_analysis.refresh_from_db()
+
+			self.assertEqual(run_analysis.check_backoff, 1)
+			self.assertGreater(run_analysis.next_check_at, timezone.now() + datetime.timedelta(seconds=self.config.scheduler['idle_interval']))
+			self.assertEqual(ingestion.get_due_run_analyses().filter(pk=16).exists(), False)
+
+			ingestion.process_run_analyses([run_analysis], self.config)
+
+			run_analysis.refresh_from_db()
+
+			self.assertEqual(run_analysis.check_backoff, 2)
+
+	def test_strict_validation(self):
+
+		run_analysis = self.reset_run_analysis(16)
+
+		# the bams in test_data are empty so look truncated
+		self.config_dict['pipelines']['GermlineEnrichment-2.5.3-IlluminaTruSightCancer']['strict_validation'] = True
+
+		ingestion.process_run_analyses([run_analysis], compile_config(self.config_dict))
+
+		run_analysis.refresh_from_db()
+
+		self.assertEqual(run_analysis.results_valid, False)
+
+		sample_analyses = SampleAnalysis.objects.filter(run=run_analysis.run, pipeline=run_analysis.pipeline)
+
+		self.assertEqual(sample_analyses.filter(results_valid=True).count(), 0)
+		self.assertEqual(sample_analyses.exclude(results_fingerprint=None).count(), 0)
+
+	def test_sample_sheet_fingerprint(self):
+
+		with tempfile.TemporaryDirectory() as archive_dir:
+
+			run_folder = Path(archive_dir).joinpath('200101_M00766_0001_000000000-ABCDE')
+			run_folder.mkdir()
+			run_folder.joinpath('run_copy_complete.txt').touch()
+
+			sample_sheet = run_folder.joinpath('SampleSheet.csv')
+
+			def write_sample_sheet(samples, panel='IlluminaTruSightCancer'):
+
+				lines = ['[Data]', 'Sample_ID,Sample_Plate,Description']
+
+				for sample in samples:
+
+					lines.append(f'{sample},ws1,pipelineName=GermlineEnrichment;pipelineVersion=2.5.3;panel={panel};sex=Male')
+
+				if sample_sheet.exists():
+
+					# make sure the mtime moves on
+					mtime = sample_sheet.stat().st_mtime + 10
+					sample_sheet.write_text('\n'.join(lines) + '\n')
+					os.utime(str(sample_sheet), (mtime, mtime))
+
+				else:
+
+					sample_sheet.write_text('\n'.join(lines) + '\n')
+
+			def get_samples():
+
+				return set(SampleAnalysis.objects.filter(run=run_obj).values_list('sample_id', flat=True))
+
+			# a known run so the run log files aren't needed
+			run_obj = Run.objects.create(run_id=run_folder.name)
+			archives = [{'path': archive_dir, 'instrument': None}]
+
+			write_sample_sheet(['sample1', 'sample2'])
+			ingestion.ingest_new_runs(archives, self.config, full_scan=True)
+
+			self.assertEqual(set(SampleAnalysis.objects.filter(run=run_obj).values_list('sample_id', flat=True)), {'sample1', 'sample2'})
+
+			run_obj.refresh_from_db()
+			self.assertNotEqual(run_obj.sample_sheet_hash, None)
+
+			# not parsed again while it is unchanged
+			with mock.patch.object(parsers, 'sample_sheet_parser') as sample_sheet_parser:
+
+				ingestion.ingest_new_runs(archives, self.config, full_scan=True)
+
+			sample_sheet_parser.assert_not_called()
+
+			# samples taken off the sheet are kept unless remove_missing_samples is on
+			write_sample_sheet(['sample2', 'sample3'])
+
+			ingestion.ingest_new_runs(archives, self.config, full_scan=True)
+
+			self.assertEqual(get_samples(), {'sample1', 'sample2', 'sample3'})
+
+			self.config_dict['remove_missing_samples'] = True
+			remove_config = compile_config(self.config_dict)
+
+			write_sample_sheet(['sample3', 'sample4'])
+
+			ingestion.ingest_new_runs(archives, remove_config, full_scan=True)
+
+			self.assertEqual(get_samples(), {'sample3', 'sample4'})
+
+			run_analysis = RunAnalysis.objects.get(run=run_obj)
+			self.assertEqual(run_analysis.summary.n_samples, 2)
+
+			# runs known before sheets were fingerprinted only have samples added
+			Run.objects.filter(pk=run_obj.pk).update(sample_sheet_hash=None)
+
+			write_sample_sheet(['sample4', 'sample5'])
+
+			ingestion.ingest_new_runs(archives, remove_config, full_scan=True)
+
+			self.assertEqual(get_samples(), {'sample3', 'sample4', 'sample5'})
+
+			run_obj.refresh_from_db()
+			self.assertNotEqual(run_obj.sample_sheet_hash, None)
+
+			# every sample moves to another panel
+			write_sample_sheet(['sample4', 'sample5'], panel='AgilentOGTFH')
+
+			ingestion.ingest_new_runs(archives, remove_config, full_scan=True)
+
+			run_analysis.refresh_from_db()
+
+			self.assertEqual(SampleAnalysis.objects.filter(run=run_obj, analysis_type_id='IlluminaTruSightCancer').count(), 0)
+			self.assertEqual(run_analysis.watching, False)
+			self.assertEqual(run_analysis.next_check_at, None)
+			self.assertEqual(run_analysis.summary.n_samples, 0)
+
+			self.client.login(username='admin', password='hello123')
+
+			response = self.client.get(f'/run_analysis/{run_analysis.pk}/')
+
+			self.assertEqual(response.status_code, 200)
+
+	def test_pipeline_registry(self):
+
+		self.assertEqual(registry.get_pipeline_class('GermlineEnrichment-2.5.3'), germline_pipelines.GermlineEnrichment)
+		self.assertEqual(registry.get_pipeline_class('DragenWGS-master'), dragen_pipelines.DragenWGS)
+		self.assertEqual(registry.get_pipeline_class('CRUK-2.0.0').ingest, False)
+		self.assertEqual(registry.get_pipeline_class('Unknown-1.0.0'), None)
+
+	def test_metric_getters_in_parallel(self):
+
+		class SlowPipeline:
+
+			def get_first(self):
+
+				time.sleep(0.2)
+				return {'sample1': 1}
+
+			def get_second(self):
+
+				return {'sample1': 2}
+
+		steps = [registry.metric_step('get_first', 'add_first'), registry.metric_step('get_second', 'add_second', ['sex'])]
+
+		# loaders are still given the metrics in step order
+		self.assertEqual(ingestion.run_metric_getters(SlowPipeline(), steps, workers=2), [
+			('add_first', {'sample1': 1}, ()),
+			('add_second', {'sample1': 2}, ('sex',)),
+			])
+
+	def test_check_schedule(self):
+
+		run_analysis = self.reset_run_analysis(16)
+
+		ingestion.process_run_analyses([run_analysis], self.config)
+
+		# complete and valid so no more checks until it is reset
+		run_analysis.refresh_from_db()
+		self.assertEqual(run_analysis.next_check_at, None)
+		self.assertNotIn(run_analysis, ingestion.get_due_run_analyses())
+
+		run_analysis.reset_check_schedule()
+		run_analysis.save()
+		self.assertIn(run_analysis, ingestion.get_due_run_analyses())
+
+		# stalled runs back off
+		scheduler_config = compile_config({'scheduler': {'idle_interval': 100}}).scheduler
+		now = timezone.now()
+
+		run_analysis.results_completed = False
+
+		ingestion.schedule_next_check(run_analysis, False, 0, scheduler_config, now)
+		self.assertEqual(run_analysis.next_check_at, now + datetime.timedelta(seconds=200))
+
+		ingestion.schedule_next_check(run_analysis, False, 0, scheduler_config, now)
+		self.assertEqual(run_analysis.next_check_at, now + datetime.timedelta(seconds=400))
+
+		# some samples finishing resets the backoff and it's checked more often
+		ingestion.schedule_next_check(run_analysis, True, 3, scheduler_config, now)
+		self.assertEqual(run_analysis.next_check_at, now + datetime.timedelta(seconds=60))
+
+		run_analysis.check_backoff = 50
+		ingestion.schedule_next_check(run_analysis, False, 3, scheduler_config, now)
+		self.assertEqual(run_analysis.next_check_at, now + datetime.timedelta(seconds=21600))
+
+	def test_update_database_only_checks_due(self):
+
+		RunAnalysis.objects.update(watching=True, next_check_at=timezone.now() + datetime.timedelta(hours=1))
+		RunAnalysis.objects.filter(pk=16).update(next_check_at=timezone.now())
+
+		with tempfile.TemporaryDirectory() as archive_dir:
+
+			with mock.patch('qc_database.ingestion.process_run_analyses') as process_run_analyses:
+
+				call_command('update_database', '--raw_data_dir', archive_dir, '--config', 'config/config_local.yaml')
+
+				self.assertEqual(list(process_run_analyses.call_args[0][0]), [RunAnalysis.objects.get(pk=16)])
+
+				call_command('update_database', '--raw_data_dir', archive_dir, '--config', 'config/config_local.yaml', '--ignore_schedule')
+
+				self.assertEqual(len(process_run_analyses.call_args[0][0]), RunAnalysis.objects.count())
+
+	def test_update_database_command(self):
+
+		with tempfile.TemporaryDirectory() as archive_dir:
+
+			call_command('update_database', '--raw_data_dir', archive_dir, '--config', 'config/config_local.yaml', '--workers', '2')
+
+		# results directories in config_local don't exist here
+		self.assertEqual(RunAnalysis.objects.filter(watching=True, results_completed=True).count(), 0)
+		self.assertEqual(RunAnalysisSummary.objects.count(), RunAnalysis.objects.filter(watching=True).count())
+
+	def test_update_database_many_archives(self):
+
+		with tempfile.TemporaryDirectory() as archive_1, tempfile.TemporaryDirectory() as archive_2:
+
+			Path(archive_1).joinpath('200101_M00766_0001_000000000-ABCDE').mkdir()
+			Path(archive_2).joinpath('200101_A00001_0001_ABCDEFGHIJ').mkdir()
+
+			with mock.patch('qc_database.ingestion.process_run_analyses') as process_run_analyses:
+
+				call_command('update_database', '--raw_data_dir', archive_1, archive_2, '--config', 'config/config_local.yaml')
+
+			# watched runs are only swept once
+			self.assertEqual(process_run_analyses.call_count, 1)
+
+			# both archives were scanned - neither folder has a sample sheet
+			self.assertEqual(RunFolderScan.objects.filter(ingested=False).count(), 2)
+
+	def test_get_archives(self):
+
+		config = compile_config({'archives': [{'path': '/data/archive/miseq/', 'instrument': 'miseq'}, {'path': '/data/archive/hiseq', 'instrument': 'hiseq'}]})
+
+		self.assertEqual(management_utils.get_archives(None, config), [
+			{'path': '/data/archive/miseq', 'instrument': 'miseq'},
+			{'path': '/data/archive/hiseq', 'instrument': 'hiseq'},
+			])
+
+		# command line overrides the config but keeps the instrument tag
+		self.assertEqual(management_utils.get_archives(['/data/archive/hiseq', '/data/archive/hiseq/', '/data/other'], config), [
+			{'path': '/data/archive/hiseq', 'instrument': 'hiseq'},
+			{'path': '/data/other', 'instrument': None},
+			])
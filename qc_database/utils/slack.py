@@ -1,9 +1,326 @@
-import subprocess
+"""
+Slack messages go through the SlackMessage outbox table.
+
+message_slack writes the message in the caller's transaction and wakes the \
+background sender once it commits, so a slow or unreachable webhook never holds \
+up ingestion or a page response. The sender posts whatever is due as one digest, \
+and failed posts are retried with backoff.
+
+"""
+
 from django.conf import settings
+from django.db import transaction, connection
+from django.utils import timezone
+from urllib.parse import urlsplit
+import datetime
+import http.client
+import json
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# seconds before retrying a failed post - doubles with each attempt up to the max
+RETRY_INTERVAL = 30
+MAX_RETRY_INTERVAL = 3600
+MAX_ATTEMPTS = 10
+
+# how long a sender has to post a message it has claimed before another can try
+CLAIM_SECONDS = 120
+
+# slack truncates very long messages so split digests at this length
+MAX_DIGEST_LENGTH = 3000
+
+# how often the background sender looks for messages to retry if nothing wakes it
+SENDER_POLL_INTERVAL = 60
+
+
+class SlackClient:
+	"""
+	Posts to a webhook over a kept alive connection which is reused between posts.
+
+	"""
+
+	def __init__(self, url, timeout=10):
+
+		self.url = urlsplit(url.strip())
+		self.timeout = timeout
+		self.connection = None
+		self.lock = threading.Lock()
+
+	def get_connection(self):
+
+		if self.connection == None:
+
+			if self.url.scheme == 'https':
+
+				self.connection = http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+			else:
+
+				self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+		return self.connection
+
+	def close(self):
+
+		if self.connection != None:
+
+			self.connection.close()
+			self.connection = None
+
+	def post(self, text):
+		"""
+		Raises an exception if the message wasn't accepted.
+
+		"""
+
+		body = json.dumps({'text': text}).encode()
+		path = self.url.path or '/'
+
+		if self.url.query:
+
+			path = path + '?' + self.url.query
+
+		with self.lock:
+
+			# a kept alive connection may have been closed by the server so try a fresh one once
+			for attempt in range(2):
+
+				try:
+
+					http_connection = self.get_connection()
+					http_connection.request('POST', path, body=body, headers={'Content-type': 'application/json'})
+					response = http_connection.getresponse()
+					response_body = response.read()
+
+				except (http.client.HTTPException, ConnectionError) as e:
+
+					self.close()
+
+					if attempt == 1:
+
+						raise
+
+					continue
+
+				except OSError:
+
+					self.close()
+					raise
+
+				if response.status != 200:
+
+					raise IOError(f'Slack returned {response.status}: {response_body[:200]}')
+
+				return
+
+
+clients = {}
+
+
+def get_client(url=None):
+
+	if url == None:
+
+		url = settings.SLACK_URL
+
+	if url not in clients:
+
+		clients[url] = SlackClient(url)
+
+	return clients[url]
 
 
 def message_slack(message):
-    # build curl command and run it
-    command = "curl -X POST -H 'Content-type: application/json' --data '{" + f'"text":"{message}"' + "}' " + settings.SLACK_URL
-    subprocess.run(command, shell=True)
-    print ('Slack message sent.')
+	"""
+	Queue a slack message - it is sent after the current transaction commits.
+
+	"""
+
+	from qc_database.models import SlackMessage
+
+	SlackMessage.objects.create(text=message)
+
+	transaction.on_commit(wake_sender)
+
+
+def make_digests(texts, max_length=MAX_DIGEST_LENGTH):
+	"""
+	Join messages into as few posts as possible without making any longer than max_length.
+
+	A single message longer than max_length is sent on its own.
+
+	"""
+
+	digests = []
+	current = []
+	current_length = 0
+
+	for text in texts:
+
+		if len(current) > 0 and current_length + len(text) + 2 > max_length:
+
+			digests.append(current)
+			current = []
+			current_length = 0
+
+		current.append(text)
+		current_length = current_length + len(text) + 2
+
+	if len(current) > 0:
+
+		digests.append(current)
+
+	return digests
+
+
+def get_retry_time(attempts, now):
+
+	if attempts >= MAX_ATTEMPTS:
+
+		return None
+
+	interval = min(RETRY_INTERVAL * 2 ** (attempts - 1), MAX_RETRY_INTERVAL)
+
+	return now + datetime.timedelta(seconds=interval)
+
+
+def claim_pending_messages(now):
+
+	from qc_database.models import SlackMessage
+
+	pending = list(SlackMessage.objects.filter(sent=None, next_attempt_at__lte=now).order_by('pk').values_list('pk', flat=True))
+
+	if len(pending) == 0:
+
+		return []
+
+	claim = uuid.uuid4().hex
+
+	# only messages nobody else claimed in the meantime are updated
+	SlackMessage.objects.filter(pk__in=pending, sent=None, next_attempt_at__lte=now).update(claim=claim,
+																							next_attempt_at=now + datetime.timedelta(seconds=CLAIM_SECONDS))
+
+	return list(SlackMessage.objects.filter(claim=claim, sent=None).order_by('pk'))
+
+
+def send_pending_messages(url=None, now=None):
+	"""
+	Send every message which is due, digested into as few posts as possible.
+
+	Returns the number of messages sent.
+
+	"""
+
+	from qc_database.models import SlackMessage
+
+	if now == None:
+
+		now = timezone.now()
+
+	messages = claim_pending_messages(now)
+
+	client = get_client(url)
+
+	n_sent = 0
+
+	for digest in make_digests([message.text for message in messages]):
+
+		digest_messages = messages[:len(digest)]
+		messages = messages[len(digest):]
+
+		pks = [message.pk for message in digest_messages]
+
+		try:
+
+			client.post('\n\n'.join(digest))
+
+		except Exception as e:
+
+			logger.warning(f'Could not send {len(pks)} slack messages: {e}')
+
+			attempts = max(message.attempts for message in digest_messages) + 1
+
+			SlackMessage.objects.filter(pk__in=pks).update(attempts=attempts,
+															next_attempt_at=get_retry_time(attempts, now),
+															last_error=str(e),
+															claim=None)
+
+			continue
+
+		SlackMessage.objects.filter(pk__in=pks).update(sent=timezone.now(), claim=None)
+
+		n_sent = n_sent + len(pks)
+
+	if n_sent > 0:
+
+		logger.info(f'Sent {n_sent} slack messages')
+
+	return n_sent
+
+
+class BackgroundSender:
+	"""
+	Thread which sends the outbox whenever it is woken and retries failures every poll interval.
+
+	"""
+
+	def __init__(self, poll_interval=SENDER_POLL_INTERVAL):
+
+		self.poll_interval = poll_interval
+		self.event = threading.Event()
+		self.thread = None
+		self.lock = threading.Lock()
+
+	def wake(self):
+
+		with self.lock:
+
+			if self.thread == None or self.thread.is_alive() == False:
+
+				self.thread = threading.Thread(target=self.run, name='slack-sender', daemon=True)
+				self.thread.start()
+
+		self.event.set()
+
+	def run(self):
+
+		while True:
+
+			self.event.wait(self.poll_interval)
+			self.event.clear()
+
+			try:
+
+				send_pending_messages()
+
+			except Exception as e:
+
+				logger.exception(e)
+
+			finally:
+
+				# the thread's own connection - don't leave it open between wake ups
+				connection.close()
+
+
+background_sender = BackgroundSender()
+
+# management commands send the outbox themselves at the end of each cycle
+background_sender_enabled = True
+
+
+def disable_background_sender():
+
+	global background_sender_enabled
+
+	background_sender_enabled = False
+
+
+def wake_sender():
+
+	if background_sender_enabled == True and settings.MESSAGE_SLACK:
+
+		background_sender.wake()
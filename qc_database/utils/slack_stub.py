@@ -0,0 +1,107 @@
+"""
+A local stand in for the slack webhook for tests and development.
+
+	python -m qc_database.utils.slack_stub 8099
+
+prints every message posted to it. Point SLACK_URL at http://localhost:8099/ to use it.
+
+"""
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import json
+import sys
+import threading
+
+
+class SlackStubHandler(BaseHTTPRequestHandler):
+
+	# keep alive so the connection reuse in SlackClient is exercised
+	protocol_version = 'HTTP/1.1'
+
+	def do_POST(self):
+
+		length = int(self.headers.get('Content-Length', 0))
+		payload = json.loads(self.rfile.read(length).decode())
+
+		server = self.server
+
+		with server.lock:
+
+			server.connections.add(self.client_address)
+
+			if server.failures > 0:
+
+				server.failures = server.failures - 1
+				status, body = 500, b'stub failure'
+
+			else:
+
+				server.messages.append(payload['text'])
+				status, body = 200, b'ok'
+
+		if server.verbose == True:
+
+			print(payload['text'], flush=True)
+
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+
+		pass
+
+
+class SlackStubServer(ThreadingMixIn, HTTPServer):
+	"""
+	Records the messages posted to it. Set failures to make the next n posts fail.
+
+	Use as a context manager to run it in a background thread:
+
+		with SlackStubServer() as stub:
+			send_pending_messages(stub.url)
+
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, port=0, verbose=False):
+
+		super().__init__(('127.0.0.1', port), SlackStubHandler)
+
+		self.messages = []
+		self.connections = set()
+		self.failures = 0
+		self.verbose = verbose
+		self.lock = threading.Lock()
+		self.thread = None
+
+	@property
+	def url(self):
+
+		return f'http://127.0.0.1:{self.server_address[1]}/services/stub'
+
+	def __enter__(self):
+
+		self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+		self.thread.start()
+
+		return self
+
+	def __exit__(self, *args):
+
+		self.shutdown()
+		self.server_close()
+
+
+if __name__ == '__main__':
+
+	port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+
+	server = SlackStubServer(port, verbose=True)
+
+	print(f'Listening on {server.url}', flush=True)
+
+	server.serve_forever()
@@ -1,6 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from .models import *
 from .forms import *
+from .auto_qc import RunAnalysisQC
 from .utils.slack import message_slack
 from .utils.kpi import make_kpi_excel
 from django.contrib.auth.decorators import login_required
@@ -19,7 +20,7 @@ def home(request):
 
 	"""
 
-	run_analyses = RunAnalysis.objects.filter(watching=True).order_by('-run')
+	run_analyses = RunAnalysis.objects.filter(watching=True).order_by('-run').select_related('pipeline', 'analysis_type', 'run', 'summary')
 
 
 	return render(request, 'auto_qc/home.html', {'run_analyses': run_analyses})
@@ -34,19 +35,27 @@ def view_run_analysis(request, pk):
 
 	run_analysis = get_object_or_404(RunAnalysis, pk=pk)
 
-	sample_analyses = SampleAnalysis.objects.filter(
-		run = run_analysis.run,
-		pipeline = run_analysis.pipeline,
-		analysis_type = run_analysis.analysis_type
-	).order_by('worksheet', 'sample')
+	# load all the metrics for the run analysis at once and reuse the per sample results in the template
+	run_analysis_qc = RunAnalysisQC(run_analysis)
+
+	sample_analyses = run_analysis_qc.get_sample_analyses()
 
 	run_level_qualities = InteropRunQuality.objects.filter(run = run_analysis.run)
 
-	auto_qc = run_analysis.passes_auto_qc()
+	auto_qc = run_analysis_qc.passes_auto_qc()
 
 	min_q30_score = round(run_analysis.min_q30_score * 100)
-	max_contamination_score = round(sample_analyses[0].contamination_cutoff*100, 1)
-	max_ntc_contamination_score = round(sample_analyses[0].ntc_contamination_cutoff, 1)
+
+	# all the samples can have been taken off the sample sheet
+	if len(sample_analyses) > 0:
+
+		max_contamination_score = round(sample_analyses[0].contamination_cutoff*100, 1)
+		max_ntc_contamination_score = round(sample_analyses[0].ntc_contamination_cutoff, 1)
+
+	else:
+
+		max_contamination_score = None
+		max_ntc_contamination_score = None
 
 	checks_to_do = run_analysis.auto_qc_checks
 
@@ -89,6 +98,7 @@ def view_run_analysis(request, pk):
 				run_analysis.signoff_user = request.user
 				run_analysis.signoff_date = datetime.now()
 				run_analysis.save()
+				run_analysis.refresh_summary(run_analysis_qc)
 
 				# message run status to slack
 
@@ -116,7 +126,9 @@ def view_run_analysis(request, pk):
 			run_analysis.watching = True
 			run_analysis.signoff_user = None
 			run_analysis.signoff_date = None
+			run_analysis.reset_check_schedule()
 			run_analysis.save()
+			run_analysis.refresh_summary(run_analysis_qc)
 
 			return redirect('home')
 
@@ -130,6 +142,10 @@ def view_run_analysis(request, pk):
 				run_analysis.sensitivity_user = request.user
 				run_analysis.save()
 
+				# sensitivity changes the auto qc result so recalculate
+				auto_qc = run_analysis_qc.passes_auto_qc()
+				run_analysis.refresh_summary(run_analysis_qc)
+
 
 	return render(request, 'auto_qc/view_run_analysis.html', {'run_analysis': run_analysis,
 															 'sample_analyses': sample_analyses,
@@ -150,7 +166,7 @@ def view_archived_run_analysis(request):
 	View run analyses which are not being watched,
 
 	"""
-	run_analyses = RunAnalysis.objects.filter(watching=False).order_by('-run').select_related('pipeline','analysis_type', 'run')
+	run_analyses = RunAnalysis.objects.filter(watching=False).order_by('-run').select_related('pipeline','analysis_type', 'run', 'summary')
 
 	return render(request, 'auto_qc/archived_run_analysis.html', {'run_analyses': run_analyses})
 
@@ -0,0 +1,730 @@
+"""
+Event driven run detection for the watch_runs command.
+
+FileWatcher reports which watched directory trees have changed. It uses inotify \
+(through the optional inotify_simple package) where it can and falls back to \
+polling directory and marker file mtimes on network filesystems such as NFS, \
+where inotify never sees changes made by other machines. Listings go through the \
+mount guard so a hung mount is skipped rather than stalling the watcher.
+
+RunWatcher keeps the config and database connection for the life of the daemon \
+and only checks the run analyses whose results or fastq directories have changed, \
+with a sweep of the archives and the run analyses the scheduler says are due every \
+so often as a safety net.
+
+"""
+
+from django.conf import settings
+from django.db import close_old_connections
+from pathlib import Path
+import fnmatch
+import logging
+import os
+import time
+
+try:
+	import inotify_simple
+except ImportError:
+	inotify_simple = None
+
+from qc_database.models import *
+from qc_database import ingestion, management_utils
+from qc_database.utils import slack
+from pipelines.config import load_config, ConfigError
+from pipelines.mount_guard import get_mount_guard, MountUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+# files which mean a run or pipeline has moved on - any new directory counts as well
+WATCHED_FILE_PATTERNS = [
+	'run_copy_complete.txt',
+	'SampleSheet.csv',
+	'post_processing_finished.txt',
+	'*.sh.e*',
+	'*.fastq.gz',
+]
+
+# filesystems where inotify only sees changes made on this machine
+POLLED_FILESYSTEMS = ['nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'lustre', 'gpfs', 'ceph', 'fuse']
+
+# how far down a results directory to watch e.g. run/panel/sample/post_processing/results
+RESULTS_WATCH_DEPTH = 4
+
+FASTQ_WATCH_DEPTH = 3
+
+# an archive is watched at the level of the run folders
+ARCHIVE_WATCH_DEPTH = 1
+
+# polled trees only list the top directory - its subdirectories e.g. the sample directories \
+# are stat'd and anything deeper is left to the sweep of the run analyses which are due
+POLL_DEPTH = 0
+
+
+def get_mounts(mounts_file='/proc/mounts'):
+	"""
+	List of (mount point, filesystem type) with the longest mount points first.
+
+	"""
+
+	mounts = []
+
+	try:
+
+		with open(mounts_file) as f:
+
+			for line in f:
+
+				fields = line.split()
+
+				if len(fields) < 3:
+					continue
+
+				# spaces etc are octal escaped in /proc/mounts
+				mount_point = fields[1].encode().decode('unicode_escape')
+
+				mounts.append((mount_point, fields[2]))
+
+	except OSError:
+
+		pass
+
+	return sorted(mounts, key=lambda mount: len(mount[0]), reverse=True)
+
+
+def get_filesystem_type(path, mounts):
+
+	path = os.path.abspath(str(path))
+
+	for mount_point, filesystem_type in mounts:
+
+		if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+
+			return filesystem_type
+
+	return None
+
+
+def needs_polling(path, mounts):
+
+	filesystem_type = get_filesystem_type(path, mounts)
+
+	if filesystem_type == None:
+
+		return False
+
+	for polled in POLLED_FILESYSTEMS:
+
+		if filesystem_type == polled or filesystem_type.startswith(polled + '.'):
+
+			return True
+
+	return False
+
+
+def matches_watched_pattern(name, patterns):
+
+	for pattern in patterns:
+
+		if fnmatch.fnmatchcase(name, pattern):
+
+			return True
+
+	return False
+
+
+def list_directory(directory, patterns):
+	"""
+	The subdirectories of a directory with their mtimes and the watched files in it with their size and mtime.
+
+	"""
+
+	subdirectories = []
+	files = []
+
+	with os.scandir(str(directory)) as it:
+
+		for entry in it:
+
+			try:
+
+				if entry.is_dir():
+
+					subdirectories.append((entry.path, entry.stat().st_mtime_ns))
+
+				elif matches_watched_pattern(entry.name, patterns):
+
+					entry_stat = entry.stat()
+					files.append((entry.path, entry_stat.st_size, entry_stat.st_mtime_ns))
+
+			except OSError:
+
+				continue
+
+	return subdirectories, files
+
+
+def get_tree_signature(path, max_depth, patterns, mount_guard=None):
+	"""
+	Directory mtimes plus the size and mtime of any watched files, listing down to \
+	max_depth - the subdirectories of the deepest directories listed are only stat'd.
+
+	None if the directory doesn't exist yet. Each listing has the deadline of the \
+	directory's mount and MountUnavailable is raised if it stops responding.
+
+	"""
+
+	if mount_guard == None:
+
+		mount_guard = get_mount_guard()
+
+	path = Path(path)
+
+	try:
+
+		signature = [('.', mount_guard.probe(path, os.stat, str(path)).st_mtime_ns)]
+
+	except MountUnavailable:
+
+		raise
+
+	except OSError:
+
+		return None
+
+	to_visit = [(path, 0)]
+
+	while len(to_visit) > 0:
+
+		directory, depth = to_visit.pop()
+
+		try:
+
+			subdirectories, files = mount_guard.probe(directory, list_directory, directory, patterns)
+
+		except MountUnavailable:
+
+			raise
+
+		except OSError:
+
+			continue
+
+		signature.extend(files)
+		signature.extend(subdirectories)
+
+		if depth < max_depth:
+
+			to_visit.extend((Path(subdirectory), depth + 1) for subdirectory, mtime in subdirectories)
+
+	return frozenset(signature)
+
+
+def list_subdirectories(directory):
+
+	with os.scandir(str(directory)) as it:
+
+		return [entry.path for entry in it if entry.is_dir()]
+
+
+class FileWatcher:
+	"""
+	Watches directory trees and reports the keys of the ones which have changed.
+
+	Each tree is watched with inotify if possible, otherwise it is polled. A tree \
+	which doesn't exist yet is polled until it appears. Polling only looks at the \
+	top of a tree, see POLL_DEPTH.
+
+	"""
+
+	def __init__(self, use_inotify=True, mounts=None, patterns=None, mount_guard=None):
+
+		self.patterns = patterns if patterns != None else WATCHED_FILE_PATTERNS
+		self.mounts = mounts if mounts != None else get_mounts()
+
+		# RunWatcher swaps in the guard for the config's mount_probes
+		self.mount_guard = mount_guard if mount_guard != None else get_mount_guard()
+
+		# key -> {'path', 'max_depth', 'mode', 'signature', 'wds'}
+		self.watches = {}
+
+		# watch descriptor -> {key: (directory, depth)} - keys can share a directory e.g. a run's fastqs
+		self.wds = {}
+
+		self.inotify = None
+
+		if use_inotify == True and inotify_simple != None:
+
+			try:
+
+				self.inotify = inotify_simple.INotify()
+
+			except OSError as e:
+
+				logger.warning(f'Could not start inotify, polling instead: {e}')
+
+		elif use_inotify == True:
+
+			logger.info('inotify_simple is not installed - polling for changes instead')
+
+	def keys(self):
+
+		return set(self.watches.keys())
+
+	def watch(self, key, path, max_depth):
+
+		if key in self.watches:
+
+			if self.watches[key]['path'] == Path(path) and self.watches[key]['max_depth'] == max_depth:
+
+				return
+
+			self.unwatch(key)
+
+		self.watches[key] = {
+			'path': Path(path),
+			'max_depth': max_depth,
+			'mode': 'poll',
+			'signature': None,
+			'wds': set(),
+		}
+
+		self.start_watch(key)
+
+	def unwatch(self, key):
+
+		watch = self.watches.pop(key, None)
+
+		if watch == None:
+
+			return
+
+		for wd in watch['wds']:
+
+			self.forget_wd(key, wd)
+
+	def forget_wd(self, key, wd):
+
+		watchers = self.wds.get(wd, {})
+		watchers.pop(key, None)
+
+		if len(watchers) == 0:
+
+			self.wds.pop(wd, None)
+
+			try:
+
+				self.inotify.rm_watch(wd)
+
+			except OSError:
+
+				pass
+
+	def can_use_inotify(self, path):
+
+		return self.inotify != None and needs_polling(path, self.mounts) == False and self.mount_guard.probe(path, os.path.isdir, str(path))
+
+	def start_watch(self, key):
+		"""
+		Use inotify for a watch if we can, otherwise record the signature to poll against.
+
+		A watch on a mount which isn't responding is polled and started again once it is.
+
+		"""
+
+		watch = self.watches[key]
+
+		try:
+
+			if self.can_use_inotify(watch['path']):
+
+				try:
+
+					self.add_tree_watches(key, watch['path'], 0)
+					watch['mode'] = 'inotify'
+					return
+
+				except OSError as e:
+
+					# usually fs.inotify.max_user_watches
+					logger.warning(f'Could not add inotify watch for {watch["path"]}, polling instead: {e}')
+
+					for wd in watch['wds']:
+
+						self.forget_wd(key, wd)
+
+					watch['wds'] = set()
+
+			watch['mode'] = 'poll'
+			watch['signature'] = get_tree_signature(watch['path'], POLL_DEPTH, self.patterns, self.mount_guard)
+
+		except MountUnavailable as e:
+
+			logger.warning(f'Could not watch {watch["path"]}: {e}')
+
+			watch['mode'] = 'poll'
+			watch['signature'] = None
+
+	def add_tree_watches(self, key, directory, depth):
+
+		flags = inotify_simple.flags
+		mask = flags.CREATE | flags.MOVED_TO | flags.CLOSE_WRITE | flags.DELETE | flags.ONLYDIR
+
+		wd = self.inotify.add_watch(str(directory), mask)
+
+		self.wds.setdefault(wd, {})[key] = (Path(directory), depth)
+		self.watches[key]['wds'].add(wd)
+
+		if depth >= self.watches[key]['max_depth']:
+
+			return
+
+		try:
+
+			subdirectories = self.mount_guard.probe(directory, list_subdirectories, directory)
+
+		except MountUnavailable:
+
+			raise
+
+		except OSError:
+
+			return
+
+		for subdirectory in subdirectories:
+
+			self.add_tree_watches(key, subdirectory, depth + 1)
+
+	def read_events(self, timeout):
+
+		changed = set()
+
+		# wait a second after the first event so a burst of writes is handled together
+		events = self.inotify.read(timeout=int(timeout * 1000), read_delay=1000)
+
+		flags = inotify_simple.flags
+
+		for event in events:
+
+			if event.mask & flags.Q_OVERFLOW:
+
+				# lost events so check everything
+				changed.update(key for key, watch in self.watches.items() if watch['mode'] == 'inotify')
+				continue
+
+			if event.mask & flags.IGNORED:
+
+				# the directory has gone - poll for it if it was the top of the tree
+				for key in self.wds.pop(event.wd, {}):
+
+					if key in self.watches:
+
+						self.watches[key]['wds'].discard(event.wd)
+
+						if len(self.watches[key]['wds']) == 0:
+
+							changed.add(key)
+							self.start_watch(key)
+
+				continue
+
+			for key, (directory, depth) in list(self.wds.get(event.wd, {}).items()):
+
+				if event.mask & flags.ISDIR:
+
+					changed.add(key)
+
+					# watch new directories as they are created
+					if event.mask & (flags.CREATE | flags.MOVED_TO) and depth < self.watches[key]['max_depth']:
+
+						try:
+
+							self.add_tree_watches(key, directory.joinpath(event.name), depth + 1)
+
+						except OSError as e:
+
+							logger.warning(f'Could not watch {directory.joinpath(event.name)}: {e}')
+
+				elif matches_watched_pattern(event.name, self.patterns):
+
+					changed.add(key)
+
+		return changed
+
+	def poll(self):
+
+		changed = set()
+
+		for key, watch in list(self.watches.items()):
+
+			if watch['mode'] != 'poll':
+
+				continue
+
+			try:
+
+				signature = get_tree_signature(watch['path'], POLL_DEPTH, self.patterns, self.mount_guard)
+
+			except MountUnavailable as e:
+
+				# nothing has changed as far as we know - try again next cycle
+				logger.warning(f'Skipping {watch["path"]} this cycle: {e}')
+				continue
+
+			if signature != watch['signature']:
+
+				changed.add(key)
+
+				# a directory which has just been created can now be watched with inotify
+				if watch['signature'] == None:
+
+					self.start_watch(key)
+					continue
+
+			watch['signature'] = signature
+
+		return changed
+
+	def wait_for_changes(self, timeout):
+		"""
+		Wait up to timeout seconds and return the keys of the watches which changed.
+
+		"""
+
+		inotify_watches = [key for key, watch in self.watches.items() if watch['mode'] == 'inotify']
+
+		if len(inotify_watches) > 0:
+
+			changed = self.read_events(timeout)
+
+		else:
+
+			time.sleep(timeout)
+			changed = set()
+
+		return changed | self.poll()
+
+	def close(self):
+
+		if self.inotify != None:
+
+			self.inotify.close()
+
+
+class RunWatcher:
+	"""
+	The watch_runs daemon.
+
+	Archives are watched for new run folders and watched run analyses for changes \
+	to their results and fastq directories. Only run analyses which have changed \
+	are checked, apart from the sweep every sweep_interval seconds.
+
+	"""
+
+	def __init__(self, config_path, raw_data_dirs=None, poll_interval=30, sweep_interval=300, workers=1, file_watcher=None):
+
+		self.config_path = config_path
+		self.raw_data_dirs = raw_data_dirs
+		self.poll_interval = poll_interval
+		self.sweep_interval = sweep_interval
+		self.workers = workers
+
+		self.file_watcher = file_watcher if file_watcher != None else FileWatcher()
+
+		self.config = None
+		self.config_mtime = None
+		self.archives = []
+
+		self.last_sweep = None
+
+		# run analysis pks to check on the next cycle
+		self.dirty = set()
+
+		self.load_config()
+
+	def load_config(self):
+		"""
+		Load the config if it has changed since we last read it.
+
+		A config with mistakes in it is reported and the last good one kept.
+
+		"""
+
+		try:
+
+			config_mtime = os.stat(self.config_path).st_mtime_ns
+
+		except OSError as e:
+
+			logger.warning(f'Could not read config {self.config_path}: {e}')
+			return False
+
+		if config_mtime == self.config_mtime:
+
+			return False
+
+		try:
+
+			config = load_config(self.config_path)
+
+		except ConfigError as e:
+
+			logger.error(str(e))
+
+			# don't report the same mistake every cycle
+			self.config_mtime = config_mtime
+			return False
+
+		if self.config != None:
+
+			logger.info(f'Config {self.config_path} has changed - reloading')
+
+		self.config = config
+		self.config_mtime = config_mtime
+		self.archives = management_utils.get_archives(self.raw_data_dirs, config)
+
+		self.file_watcher.mount_guard = get_mount_guard(config.mount_probes)
+
+		return True
+
+	def refresh_watches(self):
+		"""
+		Watch the archives and the directories of every watched run analysis.
+
+		Run analyses seen for the first time are checked on the next cycle.
+
+		"""
+
+		wanted = {}
+
+		for archive in self.archives:
+
+			wanted[('archive', archive['path'])] = (archive['path'], ARCHIVE_WATCH_DEPTH)
+
+		# finished run analyses aren't looked at again until they are reset
+		run_analyses = RunAnalysis.objects.filter(watching=True, next_check_at__isnull=False).select_related('run', 'pipeline', 'analysis_type')
+
+		watched_run_analyses = {key[1] for key in self.file_watcher.keys() if key[0] == 'run_analysis'}
+
+		for run_analysis in run_analyses:
+
+			job = {
+				'run_id': run_analysis.run.run_id,
+				'analysis_type_id': run_analysis.analysis_type.analysis_type_id,
+				'pipeline_config': self.config.get_pipeline(ingestion.get_run_config_key(run_analysis)),
+			}
+
+			results_dir, fastq_dir = ingestion.get_run_analysis_dirs(job)
+
+			wanted[('run_analysis', run_analysis.pk, 'results')] = (results_dir, RESULTS_WATCH_DEPTH)
+
+			if fastq_dir != None:
+
+				wanted[('run_analysis', run_analysis.pk, 'fastq')] = (fastq_dir, FASTQ_WATCH_DEPTH)
+
+			if run_analysis.pk not in watched_run_analyses:
+
+				self.dirty.add(run_analysis.pk)
+
+		for key in self.file_watcher.keys() - set(wanted.keys()):
+
+			self.file_watcher.unwatch(key)
+
+		for key, (path, max_depth) in wanted.items():
+
+			self.file_watcher.watch(key, path, max_depth)
+
+	def check_run_analyses(self, pks):
+
+		run_analyses = RunAnalysis.objects.filter(pk__in=pks, watching=True, next_check_at__isnull=False).select_related('run', 'pipeline', 'analysis_type').order_by('pk')
+
+		ingestion.process_run_analyses(run_analyses, self.config, self.workers)
+
+	def sweep(self):
+
+		logger.info('Sweeping archives and run analyses due a check')
+
+		ingestion.ingest_new_runs(self.archives, self.config)
+
+		self.refresh_watches()
+
+		# anything changed since the last cycle plus whatever the schedule says is due
+		due_run_analyses = set(ingestion.get_due_run_analyses().values_list('pk', flat=True))
+
+		self.check_run_analyses(due_run_analyses | self.dirty)
+
+		ingestion.refresh_missing_summaries()
+
+		self.dirty = set()
+		self.last_sweep = time.time()
+
+	def run_cycle(self):
+
+		# the connection may have been dropped while we were waiting
+		close_old_connections()
+
+		self.load_config()
+
+		if self.last_sweep == None or time.time() - self.last_sweep >= self.sweep_interval:
+
+			self.sweep()
+			return
+
+		# run analyses can be added or signed off by the webapp and update_database
+		self.refresh_watches()
+
+		changed = self.file_watcher.wait_for_changes(self.poll_interval)
+
+		close_old_connections()
+
+		changed_archives = [archive for archive in self.archives if ('archive', archive['path']) in changed]
+
+		if len(changed_archives) > 0:
+
+			ingestion.ingest_new_runs(changed_archives, self.config)
+
+			# new runs will have new run analyses to watch
+			self.refresh_watches()
+
+		for key in changed:
+
+			if key[0] == 'run_analysis':
+
+				self.dirty.add(key[1])
+
+		if len(self.dirty) > 0:
+
+			logger.info(f'Checking {len(self.dirty)} changed run analyses')
+
+			dirty = self.dirty
+			self.dirty = set()
+
+			self.check_run_analyses(dirty)
+
+	def run(self, max_cycles=None):
+
+		cycles = 0
+
+		try:
+
+			while max_cycles == None or cycles < max_cycles:
+
+				try:
+
+					self.run_cycle()
+
+					if settings.MESSAGE_SLACK:
+
+						slack.send_pending_messages()
+
+				except Exception as e:
+
+					# keep the daemon going - the next sweep will pick up anything missed
+					logger.exception(e)
+					time.sleep(self.poll_interval)
+
+				cycles = cycles + 1
+
+		finally:
+
+			self.file_watcher.close()